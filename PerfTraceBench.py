@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# benchmark for PerfTraceParser.py, it writes synthetic strace (-ttt -T -f) or AIX truss (-d -f)
+# logs and times the parser on them, end to end and stage by stage, e.g.
+#   python PerfTraceBench.py --lines 1000000
+#   python PerfTraceBench.py --format truss --paths 100000 --pids 32 --error-rate 0.2
+#   python PerfTraceBench.py --scale 1000000,10000000,100000000 --jobs 4 --stages none
+#   python PerfTraceBench.py --output bench.jsonl --baseline last.jsonl
+import os,sys,time,argparse,random,json,io,contextlib,tempfile
+import concurrent.futures
+try:
+    import resource
+except ImportError:
+    # no peak memory on windows
+    resource = None
+import PerfTraceParser
+
+class LogGenerator():
+    # a trace that looks like a busy server: a few processes opening, reading and writing files picked
+    # from paths of them (some much busier than others), stats, mmaps, lock waits and failed calls
+    def __init__(self, trace_format='strace', paths=10000, pids=8, error_rate=0.05, seed=1):
+        self.trace_format = trace_format
+        self.rng = random.Random(seed)
+        self.paths = ['/data/dir{0}/file{1}.dat'.format(k % 100, k) for k in range(max(1, paths))]
+        self.pids = [str(4000 + k) for k in range(max(1, pids))]
+        self.error_rate = error_rate
+        self.timestamp = 1500000000.0 if trace_format == 'strace' else 0.0
+        # pid -> {handle: path} of what each process has open
+        self.handles = dict((pid, dict()) for pid in self.pids)
+        # pid -> (command, args, retval, duration) of a call strace split with <unfinished ...>
+        self.resumed = dict()
+        self.errnos = {'ENOENT': 2, 'EAGAIN': 11}
+        # (chance, kind), picked from in order
+        self.mix = [(0.12, 'open'), (0.10, 'close'), (0.30, 'read'), (0.15, 'write'), (0.05, 'lseek'),
+                    (0.10, 'stat'), (0.05, 'mmap'), (0.08, 'lock'), (0.05, 'getpid')]
+
+    def path(self):
+        # cubing skews the pick towards the start of the list, so a few files are hot
+        return self.paths[int(len(self.paths) * self.rng.random() ** 3)]
+
+    def strace_line(self, pid, command, args, retval, duration):
+        return '{0} {1:.6f} {2}({3}) = {4} <{5:.6f}>\n'.format(pid, self.timestamp, command, args, retval, duration)
+
+    def truss_line(self, pid, command, args, retval, duration):
+        # truss -d has the seconds since the start, errors are "Err#2  ENOENT" instead of a return value
+        thread = '{0}/{1}'.format(pid, 1 + int(pid) % 3)
+        if retval.startswith('-1 '):
+            error = retval.split()[1]
+            return '{0}:  {1:.4f}:        {2}({3})\t\tErr#{4}  {5}\n'.format(thread, self.timestamp, command, args, self.errnos[error], error)
+        return '{0}:  {1:.4f}:        {2}({3})\t\t= {4}\n'.format(thread, self.timestamp, command, args, retval)
+
+    def call(self, pid):
+        # one call as (command, args, retval), in strace's words
+        rng = self.rng
+        handles = self.handles[pid]
+        chance = rng.random()
+        for weight, kind in self.mix:
+            chance -= weight
+            if chance < 0:
+                break
+        if not handles and kind in ['close', 'read', 'write', 'lseek']:
+            kind = 'open'
+        failed = rng.random() < self.error_rate
+        if kind == 'open':
+            path = self.path()
+            if failed:
+                return 'openat', 'AT_FDCWD, "{0}", O_RDONLY'.format(path), '-1 ENOENT (No such file or directory)'
+            handle = 3
+            while handle in handles:
+                handle += 1
+            handles[handle] = path
+            return 'openat', 'AT_FDCWD, "{0}", O_RDONLY|O_CLOEXEC'.format(path), str(handle)
+        if kind == 'stat':
+            if failed:
+                return 'newfstatat', 'AT_FDCWD, "{0}.missing", 0x7ffd3c1f8e90, 0'.format(self.path()), '-1 ENOENT (No such file or directory)'
+            return 'newfstatat', 'AT_FDCWD, "{0}", {{st_mode=S_IFREG|0644, st_size=4096, ...}}, 0'.format(self.path()), '0'
+        if kind == 'mmap':
+            return 'mmap', 'NULL, {0}, PROT_READ, MAP_PRIVATE|MAP_ANONYMOUS, -1, 0'.format(4096 * rng.randint(1, 64)), '0x7f{0:010x}'.format(rng.getrandbits(36))
+        if kind == 'lock':
+            return 'futex', '0x7f{0:010x}, FUTEX_WAIT_PRIVATE, 0, NULL'.format(rng.getrandbits(12) << 4), '-1 EAGAIN (Resource temporarily unavailable)' if failed else '0'
+        if kind == 'getpid':
+            return 'getpid', '', pid
+        handle = rng.choice(list(handles))
+        if kind == 'close':
+            del handles[handle]
+            return 'close', str(handle), '0'
+        if kind == 'lseek':
+            return 'lseek', '{0}, {1}, SEEK_SET'.format(handle, 4096 * rng.randint(0, 1000)), str(4096 * rng.randint(0, 1000))
+        if failed:
+            return kind, '{0}, 0x7ffd3c1f8e90, 4096'.format(handle), '-1 EAGAIN (Resource temporarily unavailable)'
+        size = rng.choice([1, 64, 512, 4096, 4096, 65536])
+        return kind, '{0}, "\\x00\\x01\\x02\\x03"..., {1}'.format(handle, size), str(size)
+
+    def lines(self, count):
+        rng = self.rng
+        emitted = 0
+        while emitted < count:
+            pid = rng.choice(self.pids)
+            self.timestamp += rng.random() * 0.0002
+            duration = rng.random() * 0.0005
+            if pid in self.resumed:
+                # the other threads had a turn, the call finishes now
+                command, args, retval, duration = self.resumed.pop(pid)
+                yield '{0} {1:.6f} <... {2} resumed>{3}) = {4} <{5:.6f}>\n'.format(pid, self.timestamp, command, args, retval, duration)
+                emitted += 1
+                continue
+            command, args, retval = self.call(pid)
+            if self.trace_format == 'truss':
+                # truss names the kernel calls
+                command = {'openat': 'kopen', 'read': 'kread', 'write': 'kwrite', 'lseek': 'klseek', 'newfstatat': 'statx',
+                           'futex': 'thread_waitlock_', 'getpid': '_getpid'}.get(command, command)
+                if command == 'kopen':
+                    args = args.split(', ', 1)[1]
+                yield self.truss_line(pid, command, args, retval, duration)
+            elif command == 'read' and len(self.pids) > 1 and rng.random() < 0.05:
+                # another thread gets a line in before the read finishes
+                split = args.find(',')
+                yield '{0} {1:.6f} {2}({3}, <unfinished ...>\n'.format(pid, self.timestamp, command, args[:split])
+                self.resumed[pid] = (command, args[split+1:].lstrip(), retval, duration)
+            else:
+                yield self.strace_line(pid, command, args, retval, duration)
+            emitted += 1
+
+    def write(self, path, count):
+        with open(path, 'w') as fp:
+            batch = []
+            for line in self.lines(count):
+                batch.append(line)
+                if len(batch) >= 10000:
+                    fp.write(''.join(batch))
+                    batch = []
+            fp.write(''.join(batch))
+
+def peak_rss():
+    # peak resident memory in MB of this process and, separately, of the shard workers it waited on
+    if resource is None:
+        return None, None
+    scale = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+def run_end_to_end(args):
+    # runs in a fresh process, so the peak memory is the parser's own
+    logfile, jobs, top_k = args
+    start = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        parser = PerfTraceParser.PerfTracerParser(logfile, jobs=jobs, use_cache=False, top_k=top_k)
+        parser.parse_log_file()
+        records = sum(1 for record in parser.report_records())
+    seconds = time.time() - start
+    rss, children_rss = peak_rss()
+    return {'stage': 'end_to_end', 'lines': parser.lines, 'seconds': seconds, 'records': records,
+            'peak_rss_mb': rss, 'workers_peak_rss_mb': children_rss if jobs > 1 else None}
+
+def run_stages(args):
+    # each stage on its own: reading and decoding the lines, the regex tokenizer,
+    # the whole per line parse (tokenizer included) and building the report
+    logfile, jobs, top_k = args
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        parser = PerfTraceParser.PerfTracerParser(logfile, use_cache=False, top_k=top_k)
+        parser.trace_format = PerfTraceParser.sniff_trace_format(PerfTraceParser.log_head(logfile))
+        start = time.time()
+        lines = 0
+        with open(logfile, 'rb', buffering=PerfTraceParser.read_buffer_size) as fp:
+            for line in fp:
+                line.decode('utf-8', 'replace').rstrip()
+                lines += 1
+        results.append({'stage': 'read', 'lines': lines, 'seconds': time.time() - start})
+        start = time.time()
+        with open(logfile, 'rb', buffering=PerfTraceParser.read_buffer_size) as fp:
+            for line in fp:
+                parser.tokenize_line(line.decode('utf-8', 'replace').rstrip())
+        results.append({'stage': 'tokenize', 'lines': lines, 'seconds': time.time() - start})
+        parser = PerfTraceParser.PerfTracerParser(logfile, use_cache=False, top_k=top_k)
+        # as a shard is set up, without the progress output
+        parser.total_bytes = 0
+        parser.bytes_read = 0
+        parser.progress_step = 0
+        parser.quiet = True
+        start = time.time()
+        with open(logfile, 'rb', buffering=PerfTraceParser.read_buffer_size) as fp:
+            parser.parse_lines(fp)
+        parser.sample_timeline()
+        results.append({'stage': 'parse', 'lines': lines, 'seconds': time.time() - start})
+        start = time.time()
+        records = sum(1 for record in parser.report_records())
+        results.append({'stage': 'report', 'lines': lines, 'seconds': time.time() - start, 'records': records})
+    results[-1]['peak_rss_mb'] = peak_rss()[0]
+    return results
+
+def in_fresh_process(function, args):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(function, args).result()
+
+def print_results(results):
+    print('{0:>8} {1:>6} {2:>12} {3:<11} {4:>10} {5:>12} {6:>10} {7:>8}'.format(
+        'format', 'jobs', 'lines', 'stage', 'seconds', 'lines/sec', 'peak MB', 'scaling'))
+    # lines/sec relative to the smallest run of the same stage, 1.00 means it scales linearly
+    first_rate = dict()
+    for result in results:
+        key = (result['format'], result['jobs'], result['stage'])
+        rate = result['lines_per_sec']
+        first_rate.setdefault(key, rate)
+        print('{0:>8} {1:>6} {2:>12} {3:<11} {4:>10.2f} {5:>12.0f} {6:>10} {7:>8.2f}'.format(
+            result['format'], result['jobs'], result['lines'], result['stage'], result['seconds'], rate,
+            '{0:.1f}'.format(result['peak_rss_mb']) if result.get('peak_rss_mb') is not None else '-',
+            rate / first_rate[key] if first_rate[key] else 0.0), flush=True)
+
+def compare_baseline(results, baseline, tolerance):
+    # the runs that got slower than the same run in an earlier --output by more than tolerance percent
+    earlier = dict()
+    with open(baseline) as fp:
+        for line in fp:
+            if line.strip():
+                result = json.loads(line)
+                earlier[(result['format'], result['lines'], result['jobs'], result['stage'])] = result['lines_per_sec']
+    slower = 0
+    for result in results:
+        rate = earlier.get((result['format'], result['lines'], result['jobs'], result['stage']))
+        if not rate:
+            continue
+        change = 100.0 * (result['lines_per_sec'] - rate) / rate
+        slower += change < -tolerance
+        print('{0} {1} lines {2}: {3:.0f} -> {4:.0f} lines/sec ({5:+.1f}%){6}'.format(
+            result['format'], result['lines'], result['stage'], rate, result['lines_per_sec'], change,
+            ' SLOWER' if change < -tolerance else ''))
+    return slower
+
+if __name__=='__main__':
+    arg_parser = argparse.ArgumentParser(description='Time PerfTraceParser on synthetic strace or truss logs')
+    arg_parser.add_argument('--format', choices=['strace', 'truss'], default='strace', help='kind of log to generate (default: strace)')
+    arg_parser.add_argument('--lines', type=int, default=1000000, help='lines in the log (default: 1000000)')
+    arg_parser.add_argument('--scale', metavar='LINES,LINES,...',
+                            help='run once per log size instead of --lines, e.g. 1000000,10000000,100000000')
+    arg_parser.add_argument('--paths', type=int, default=10000, help='distinct paths in the log (default: 10000)')
+    arg_parser.add_argument('--pids', type=int, default=8, help='processes making the calls (default: 8)')
+    arg_parser.add_argument('--error-rate', type=float, default=0.05, help='share of the calls that fail (default: 0.05)')
+    arg_parser.add_argument('--seed', type=int, default=1, help='random seed, the same seed gives the same log (default: 1)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1, help='parser processes for the end to end run (default: 1)')
+    arg_parser.add_argument('--top-k', type=int, default=None, metavar='N', help='run the parser with --top-k N')
+    arg_parser.add_argument('--stages', choices=['all', 'none'], default='all',
+                            help='also time the read, tokenize, parse and report stages on their own (default: all)')
+    arg_parser.add_argument('--directory', default=tempfile.gettempdir(), help='where the logs are written (default: the temp directory)')
+    arg_parser.add_argument('--keep', action='store_true', help='keep the generated logs, a later run with the same settings reuses them')
+    arg_parser.add_argument('-o', '--output', metavar='FILE', help='append the results to FILE as JSON Lines')
+    arg_parser.add_argument('--baseline', metavar='FILE', help='compare with the results of an earlier --output')
+    arg_parser.add_argument('--tolerance', type=float, default=10.0,
+                            help='percent slower than the baseline that counts as a regression (default: 10)')
+    args = arg_parser.parse_args()
+    sizes = [int(k) for k in args.scale.split(',')] if args.scale else [args.lines]
+    results = []
+    for lines in sizes:
+        logfile = os.path.join(args.directory, 'perftrace-bench-{0}-{1}-p{2}-n{3}-e{4:g}-s{5}.log'.format(
+            args.format, lines, args.paths, args.pids, args.error_rate, args.seed))
+        if not os.path.exists(logfile):
+            print('Writing {0} lines to {1}...'.format(lines, logfile), flush=True)
+            start = time.time()
+            LogGenerator(args.format, args.paths, args.pids, args.error_rate, args.seed).write(logfile, lines)
+            print('written in {0:.1f} seconds, {1:.1f} MB'.format(time.time() - start, os.path.getsize(logfile) / 1048576.0), flush=True)
+        try:
+            runs = [in_fresh_process(run_end_to_end, (logfile, max(1, args.jobs), args.top_k))]
+            if args.stages == 'all':
+                runs.extend(in_fresh_process(run_stages, (logfile, 1, args.top_k)))
+        finally:
+            if not args.keep:
+                os.remove(logfile)
+        for run in runs:
+            run.update({'format': args.format, 'jobs': max(1, args.jobs) if run['stage'] == 'end_to_end' else 1,
+                        'paths': args.paths, 'pids': args.pids, 'error_rate': args.error_rate, 'top_k': args.top_k,
+                        'lines_per_sec': run['lines'] / run['seconds'] if run['seconds'] > 0 else 0.0})
+            results.append(run)
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'a') as fp:
+            for result in results:
+                fp.write(json.dumps(result) + '\n')
+        print('Results appended to {0}'.format(args.output))
+    if args.baseline is not None and compare_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
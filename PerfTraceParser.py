@@ -4,186 +4,1010 @@
 # e.g. on Linux generate a strace log file like this: strace -ttt -T -f -o strace.log -p <pid>
 # default usage: python PerfTraceParser.py
 #           or: python PerfTraceParser.py logfilename
+#           or: strace -ttt -T -f ... 2>&1 | python PerfTraceParser.py -
+#           or: python PerfTraceParser.py -j 8 logfilename
+#           or: python PerfTraceParser.py --follow 5 logfilename
+#           or: python PerfTraceParser.py -o report.jsonl logfilename
+#           or: python PerfTraceParser.py --resume logfilename
+#           or: python PerfTraceParser.py --from 12:30:00 --to 12:31:00 logfilename
+#           or: python PerfTraceParser.py before.log --compare after.log
+#           or: python PerfTraceParser.py logfilename --query "path where command=read top 20 by seconds"
+#           or: python PerfTraceParser.py logfilename debug --trace-memory --profile parse.prof
 
-import sys,time,traceback,math
+import os,sys,time,traceback,math,argparse,operator,signal
+import concurrent.futures
+import array,pickle,zlib,hashlib,heapq,select,bisect,itertools,fnmatch,mmap,shutil,shlex
+import io,gzip,bz2,lzma,re
+import json,csv,contextlib,errno,tempfile
 from collections import OrderedDict
 
 # globals
 compare_field = ''
 debug = False
+# rows per page of the tables printed to a terminal, None fits a page to the terminal and 0 doesn't page
+page_rows = None
+# colour the busiest cells of the tables, None only colours a terminal
+colour_output = None
+# bump when the parser state changes shape so old caches are ignored
+cache_version = 9
+# big reads keep the decompressors busy instead of waiting on small ones
+read_buffer_size = 1024 * 1024
+# magic bytes at the start of a compressed log
+compression_magic = [(b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'xz'), (b'\x28\xb5\x2f\xfd', 'zstd')]
+# the fields in front of the command, e.g. "1234 1500000000.123456 " for strace -f -ttt,
+# "[pid  1234] 10:20:30.123456 " when strace -f -tt writes to a terminal or "1234/1:  0.0123: " for truss -f -d
+line_prefix = re.compile(r'\s*(?:(?:\[pid\s+)?(\d+(?:/\d+)?)(?:\]\s*|:(?!\d\d:)\s*|\s+))?(?:(\d+\.\d+|\d+:\d\d:\d\d(?:\.\d+)?):?\s+)?')
+# command(args) after the prefix, args starts with either a quoted path or the first argument, each
+# TraceFormat adds how its tracer writes the return value
+call_pattern = r'(\w+)\(((?:"([^"\\]*(?:\\.[^"\\]*)*)"(?:\.\.\.)?|([^,)]*)).*)\)\s+'
+# a quoted argument, strace escapes the quotes inside it
+quoted_string = re.compile(r'\s*"([^"\\]*(?:\\.[^"\\]*)*)"')
+# a call without a return value
+no_return_line = re.compile(r'(\w+)\((.*)\)\s*$')
+# the lines a fork, vfork, clone or kfork can be on, see shard_process_roots
+fork_line_pattern = re.compile(rb'fork|clone')
 
 class PrintFormat():
     def __init__(self):
         self.max_format = '5;30;41'
         self.nearmax_format = '5;30;43'
         self.nearmax_threshold = 0.5
+        # column -> largest value, column -> widest value
+        self.maxes = dict()
+        self.maxwidths = dict()
+        # what the maxes were last computed from, see compute_maxes
+        self.computed_for = None
 
     def set_max(self, key, value):
-        if hasattr(self, key):
-            # convert new value to int
-            value = int(value)
-            # get the previous value
-            prev_value = int(getattr(self, key))
-            # check if it is bigger
-            if value > prev_value:
-                # if it's bigger then update it
-                setattr(self, key, value)
-        else:
-            # does not exist so set to what was passed in
-            setattr(self, key, value)
+        value = int(value)
+        if value > self.maxes.get(key, 0) or key not in self.maxes:
+            self.maxes[key] = value
         self.set_maxwidth(key, value)
 
     def get_max(self, key):
-        if hasattr(self, key):
-            return getattr(self, key)
-        else:
-            # not set return 0
-            return 0
+        # not set return 0
+        return self.maxes.get(key, 0)
 
     def set_maxwidth(self, key, value):
         value_length = len(str(value))
-        maxwidth_key = 'maxwidth_' + key
-        if hasattr(self, maxwidth_key):
-            existing_maxwidth = getattr(self, maxwidth_key)
-            if (value_length > existing_maxwidth):
-                setattr(self, maxwidth_key, value_length)
-        else:
-            # not set, so set it
-            setattr(self, maxwidth_key, value_length)
+        if value_length > self.maxwidths.get(key, 0):
+            self.maxwidths[key] = value_length
 
-    def setget_maxwidth(self, key, value):
-        value_length = len(str(value))
-        self.set_maxwidth(key, value)
-        maxwidth_key = 'maxwidth_' + key
-        existing_maxwidth = getattr(self, maxwidth_key)
-        return existing_maxwidth
-
-    def fixed_width_print(self,print_string, width):
-        space = ' '
-        print_string = str(print_string)
-        howmuch = width - len(print_string) if len(print_string) < width else 1
-        return str('{0}{1}'.format(print_string, space * howmuch))
-
-    def max_colour_print(self, value, maxvalue, width):
-        if value == 0 or maxvalue == 0:
-            colour = False
-        elif value == maxvalue:
-            colour = True
-            format = self.max_format
-        elif value >= (maxvalue * self.nearmax_threshold):
-            colour = True
-            format = self.nearmax_format
-        else:
-            colour = False
-        value_formatted = self.fixed_width_print(value, width)        
-        if colour == True:
-            value_formatted = '\x1b[{0}m{1}\x1b[0m'.format(format, value_formatted)
-        return value_formatted
+    def compute_maxes(self, file_instances, file_commands, computed_for=None):
+        # the column maxima and widths are worked out once before printing,
+        # rather than on every increment while parsing
+        if computed_for is not None and computed_for == self.computed_for:
+            return
+        self.maxes = dict()
+        self.maxwidths = dict()
+        column_maxes = [0] * len(file_commands)
+        for fileinstance in file_instances:
+            self.set_maxwidth('filename', fileinstance.filename)
+            self.set_maxwidth('handle', fileinstance.lasthandle)
+            for index, count in enumerate(fileinstance.counts):
+                if count > column_maxes[index]:
+                    column_maxes[index] = count
+        for command, column_max in zip(file_commands, column_maxes):
+            self.set_max(command, column_max)
+        self.computed_for = computed_for
+
+    def file_table(self, file_commands, out=None):
+        # the table of the 'A' view, the widths and maxima come from compute_maxes so nothing is
+        # measured while the rows are printed
+        columns = [('filename', '<{0}'.format(max(len('filename'), self.maxwidths.get('filename', 0)) + 4)),
+                   ('handle', '<{0}'.format(max(len('handle'), self.maxwidths.get('handle', 0)) + 2))]
+        for command in file_commands:
+            columns.append((command, '<{0}'.format(max(len(command), self.maxwidths.get(command, 0)) + 2)))
+        columns.append(('handles', ''))
+        highlights = [(index + 2, self.get_max(command)) for index, command in enumerate(file_commands) if self.get_max(command)]
+        return TableRenderer(columns, '|', out, highlights, self)
+
+class TableRenderer():
+    # prints a table with the column widths worked out once up front, the rows are formatted a batch
+    # at a time into one write rather than a flushed print each, a long table is paged on a terminal
+    # and the colours are left out when the output isn't one
+    batch_rows = 4096
+
+    def __init__(self, columns, separator='  ', out=None, highlights=None, print_format=None):
+        # columns is [(title, format spec)] like ('calls', '>10') or ('seconds', '>12.6f'), '' isn't padded
+        self.out = out if out is not None else sys.stdout
+        self.titles = [k[0] for k in columns]
+        self.separator = separator
+        self.row_format = separator.join('{{{0}:{1}}}'.format(index, k[1]) for index, k in enumerate(columns))
+        # the titles only take the alignment and width of their column
+        self.header_format = separator.join('{{{0}:{1}}}'.format(index, re.match(r'[<>^]?\d*', k[1]).group())
+                                            for index, k in enumerate(columns))
+        self.cell_formats = ['{{0:{0}}}'.format(k[1]) for k in columns]
+        # (column, at least this, largest value) of the numbers coloured at or near the largest in their column
+        self.highlights = None
+        if highlights and self.colour():
+            self.highlights = [(index, top * print_format.nearmax_threshold, top) for index, top in highlights]
+            self.max_format = print_format.max_format
+            self.nearmax_format = print_format.nearmax_format
+        self.page_rows = 0
+        if page_rows != 0 and self.out.isatty() and sys.stdin.isatty():
+            self.page_rows = page_rows or max(5, shutil.get_terminal_size().lines - 2)
+        self.lines_written = 0
+        self.stopped = False
+
+    def colour(self):
+        if colour_output is not None:
+            return colour_output
+        return self.out.isatty() and 'NO_COLOR' not in os.environ
+
+    def format_row(self, cells):
+        padded = None
+        if self.highlights is not None:
+            for index, near, top in self.highlights:
+                value = cells[index]
+                if value and value >= near:
+                    if padded is None:
+                        padded = [cell_format.format(cell) for cell_format, cell in zip(self.cell_formats, cells)]
+                    padded[index] = '\x1b[{0}m{1}\x1b[0m'.format(self.max_format if value == top else self.nearmax_format, padded[index])
+        if padded is None:
+            return self.row_format.format(*cells)
+        return self.separator.join(padded)
+
+    def write_header(self, underline=False):
+        header = self.header_format.format(*self.titles)
+        return self.write_lines([header, '-' * len(header)] if underline else [header])
+
+    def write_rows(self, rows):
+        # the rows are only formatted as they are written, so a table the reader stops paging isn't finished
+        return self.write_lines(self.format_row(row) for row in rows)
+
+    def write_lines(self, lines):
+        # False once the reader has stopped paging
+        batch = []
+        for line in lines:
+            if self.stopped:
+                break
+            if self.page_rows and self.lines_written and self.lines_written % self.page_rows == 0:
+                self.flush(batch)
+                batch = []
+                self.stopped = not self.more()
+                if self.stopped:
+                    break
+            batch.append(line)
+            self.lines_written += 1
+            if len(batch) >= self.batch_rows:
+                self.flush(batch)
+                batch = []
+        self.flush(batch)
+        return not self.stopped
+
+    def flush(self, batch):
+        if batch:
+            self.out.write('\n'.join(batch) + '\n')
+            self.out.flush()
+
+    def more(self):
+        try:
+            answer = input('-- {0} lines, Enter for the next page, Q to stop --'.format(self.lines_written))
+        except (EOFError, KeyboardInterrupt):
+            print('')
+            return False
+        return answer.strip().upper() != 'Q'
 
 def dict_inc_or_add(dict_to_check, key):
-    if key in dict_to_check:
+    if dict_to_check.__class__ is TopCounts:
+        dict_to_check.add(key, 1)
+    elif key in dict_to_check:
         dict_to_check[key] += 1
     else:
         dict_to_check[key] = 1
 
+def dict_add(dict_to_check, key, count):
+    if dict_to_check.__class__ is TopCounts:
+        dict_to_check.add(key, count)
+    elif key in dict_to_check:
+        dict_to_check[key] += count
+    else:
+        dict_to_check[key] = count
+
 def print_dict(title, dict, output_limit = 10):
     print('Top {0} {1}:'.format(output_limit, title))
-    i = 0
-    #loop through a sorted representation of the dict by value and print out up until the limit
-    for key in dict:
-        i += 1
-        print('{0}: {1}'.format(key, dict[key]), flush=True)
-        if i >= output_limit:
-            break
-            
+    if dict.__class__ is TopCounts and dict.max_error():
+        print('(approximate, only the top {0} are kept and a count can be up to {1} too high)'.format(dict.capacity, dict.max_error()))
+    # heap select the biggest few rather than sorting the whole dict
+    if dict.__class__ is TopCounts:
+        items = dict.counts.items()
+    else:
+        items = dict.items()
+    print_lines('{0}: {1}'.format(key, count) for key, count in heapq.nlargest(output_limit, items, key=lambda k: k[1]))
+
+def print_lines(lines):
+    # one batched write, paged on a terminal, instead of a flushed print per line
+    sys.stdout.flush()
+    return TableRenderer([]).write_lines(lines)
+
 def sort_dict(unsorted_dict, descending_direction=True):
     # sort dict by value and direction
     sorted_dict = OrderedDict(sorted(unsorted_dict.items(), key=lambda k: k[1], reverse=descending_direction))
     return sorted_dict
 
+def file_sort_key(file_commands, field):
+    # a key function for one column, so sorting doesn't go through the
+    # comparison methods and a lookup of the column for every pair of files
+    if field == '' or field == 'filename':
+        return lambda fileinstance: fileinstance.filename
+    index = file_commands.ids.get(field)
+    if index is None:
+        return lambda fileinstance: 0
+    return lambda fileinstance: fileinstance.counts[index] if index < len(fileinstance.counts) else 0
+
+class LatencyStats():
+    # streaming latency histogram, each power of two is split into sub_buckets
+    # so percentiles are within a few percent while memory stays bounded
+    __slots__ = ['count', 'total', 'max', 'buckets']
+    sub_buckets = 16
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = dict()
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if duration > 0:
+            mantissa, exponent = math.frexp(duration)
+            bucket = exponent * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets)
+        else:
+            bucket = None
+        dict_inc_or_add(self.buckets, bucket)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+        for bucket, count in other.buckets.items():
+            dict_add(self.buckets, bucket, count)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100.0)
+        seen = self.buckets.get(None, 0)
+        if seen >= rank:
+            return 0.0
+        for bucket in sorted(b for b in self.buckets if b is not None):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # report the upper edge of the bucket, never more than the real max
+                exponent, sub_bucket = divmod(bucket, self.sub_buckets)
+                upper = math.ldexp(0.5 + (sub_bucket + 1) / (2.0 * self.sub_buckets), exponent)
+                return min(upper, self.max)
+        return self.max
+
+    def header(self, title):
+        return '{0:<30} {1:>10} {2:>12} {3:>10} {4:>10} {5:>10} {6:>10} {7:>10}'.format(
+            title, 'calls', 'total(s)', 'mean', 'p50', 'p95', 'p99', 'max')
+
+    def summary(self, title):
+        return '{0:<30} {1:>10} {2:>12.6f} {3:>10.6f} {4:>10.6f} {5:>10.6f} {6:>10.6f} {7:>10.6f}'.format(
+            title, self.count, self.total, self.mean(), self.percentile(50),
+            self.percentile(95), self.percentile(99), self.max)
+
+class ByteStats():
+    # the bytes moved by reads and writes, the time they took and how many of them
+    # were of each size, bucket n holds the transfers of 2**(n-1) to 2**n-1 bytes
+    __slots__ = ['reads', 'writes', 'read_bytes', 'write_bytes', 'mapped_bytes', 'seconds', 'buckets']
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.mapped_bytes = 0
+        self.seconds = 0.0
+        self.buckets = array.array('q')
+
+    def add(self, size, is_write, duration):
+        if is_write:
+            self.writes += 1
+            self.write_bytes += size
+        else:
+            self.reads += 1
+            self.read_bytes += size
+        if duration is not None:
+            self.seconds += duration
+        bucket = size.bit_length()
+        buckets = self.buckets
+        if bucket >= len(buckets):
+            buckets.extend([0] * (bucket + 1 - len(buckets)))
+        buckets[bucket] += 1
+
+    def merge(self, other):
+        self.reads += other.reads
+        self.writes += other.writes
+        self.read_bytes += other.read_bytes
+        self.write_bytes += other.write_bytes
+        self.mapped_bytes += other.mapped_bytes
+        self.seconds += other.seconds
+        buckets = self.buckets
+        if len(other.buckets) > len(buckets):
+            buckets.extend([0] * (len(other.buckets) - len(buckets)))
+        for bucket, count in enumerate(other.buckets):
+            buckets[bucket] += count
+
+    def calls(self):
+        return self.reads + self.writes
+
+    def total(self):
+        return self.read_bytes + self.write_bytes
+
+    def mean(self):
+        return self.total() / self.calls() if self.calls() else 0.0
+
+    def throughput(self):
+        # bytes a second while in the calls, from the strace -T durations
+        return self.total() / self.seconds if self.seconds > 0 else 0.0
+
+    def header(self, title):
+        return '{0:<40} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10} {7:>12}'.format(
+            title, 'reads', 'read', 'writes', 'written', 'mean size', 'mapped', 'in calls/s')
+
+    def summary(self, title):
+        return '{0:<40} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10} {7:>12}'.format(
+            title, self.reads, format_bytes(self.read_bytes), self.writes, format_bytes(self.write_bytes),
+            format_bytes(self.mean()), format_bytes(self.mapped_bytes), format_bytes(self.throughput()) if self.seconds > 0 else '-')
+
+def format_bytes(count):
+    # 1536 -> "1.5K"
+    for unit in ['', 'K', 'M', 'G', 'T']:
+        if count < 1024 or unit == 'T':
+            break
+        count /= 1024.0
+    if unit == '':
+        return '{0:.0f}'.format(count)
+    return '{0:.1f}{1}'.format(count, unit)
+
+def print_transfers(title, transfers, files, handle_bytes, output_limit = 10, small_io_bytes = 64):
+    # the files that moved the most bytes, the sizes the reads and writes came in and the
+    # files that mostly move a few bytes at a time, which costs a call for very little work
+    if not transfers.calls() and not transfers.mapped_bytes:
+        return
+    print('{0}: {1} read in {2} calls, {3} written in {4} calls, {5} mapped'.format(
+        title, format_bytes(transfers.read_bytes), transfers.reads, format_bytes(transfers.write_bytes),
+        transfers.writes, format_bytes(transfers.mapped_bytes)))
+    print('Sizes of the reads and writes:')
+    most = max(transfers.buckets) if transfers.buckets else 0
+    for bucket, count in enumerate(transfers.buckets):
+        if count:
+            if bucket < 2:
+                size = str(bucket)
+            else:
+                size = '{0}-{1}'.format(format_bytes(2 ** (bucket - 1)), format_bytes(2 ** bucket - 1))
+            print('{0:>16} {1:>10} {2:>6.1f}% {3}'.format(size, count, 100.0 * count / transfers.calls(), '#' * int(40 * count / most)))
+    print('Top {0} files by bytes moved:'.format(output_limit))
+    print(transfers.header('filename'))
+    print_lines(fileinstance.transfers.summary(fileinstance.filename)
+                for fileinstance in heapq.nlargest(output_limit, files, key=lambda k: k.transfers.total()))
+    print('Top {0} handles by bytes moved:'.format(output_limit))
+    items = handle_bytes.counts.items() if handle_bytes.__class__ is TopCounts else handle_bytes.items()
+    for handle, count in heapq.nlargest(output_limit, items, key=lambda k: k[1]):
+        print('{0}: {1}'.format(handle, format_bytes(count)))
+    small = [(k.get_attr_val_safe('small_io'), k) for k in files]
+    small = [k for k in small if k[0]]
+    print('Top {0} files by reads and writes of {1} bytes or less:'.format(output_limit, small_io_bytes))
+    print('{0:<40} {1:>10} {2:>10} {3:>10}'.format('filename', 'small', 'of calls', 'mean size'))
+    for count, fileinstance in heapq.nlargest(output_limit, small, key=lambda k: k[0]):
+        print('{0:<40} {1:>10} {2:>9.1f}% {3:>10}'.format(fileinstance.filename, count,
+              100.0 * count / fileinstance.transfers.calls(), format_bytes(fileinstance.transfers.mean())))
+    print('', flush=True)
+
+class TopCounts():
+    # bounded memory counter for keys that can have millions of distinct values. Only the capacity
+    # biggest counts are kept, a new key takes over the smallest one (Space-Saving) and starts from
+    # what a count-min sketch of every key has seen of it, so counts are never too low and errors
+    # holds by how much each one can be too high
+    def __init__(self, capacity, depth=4):
+        self.capacity = capacity
+        self.counts = dict()
+        self.errors = dict()
+        # (count, key) for every key, counts only go up so an entry can be stale but never too high
+        self.heap = []
+        self.width = max(1024, capacity * 2)
+        self.depth = depth
+        self.sketch = array.array('q', [0]) * (self.width * depth)
+        self.total = 0
+
+    def sketch_indexes(self, key):
+        # one cell per row, double hashing makes the rows independent enough
+        data = key.encode('utf-8', 'replace')
+        first = zlib.crc32(data)
+        second = zlib.adler32(data) | 1
+        width = self.width
+        return [row * width + (first + row * second) % width for row in range(self.depth)]
+
+    def add(self, key, count):
+        self.total += count
+        sketch = self.sketch
+        estimate = None
+        for index in self.sketch_indexes(key):
+            sketch[index] += count
+            if estimate is None or sketch[index] < estimate:
+                estimate = sketch[index]
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            # nothing has been dropped yet so this really is the first time
+            self.insert(key, count, 0)
+        else:
+            self.insert(key, estimate, estimate - count)
+
+    def insert(self, key, count, error):
+        counts = self.counts
+        if len(counts) < self.capacity:
+            counts[key] = count
+            self.errors[key] = error
+            heapq.heappush(self.heap, (count, key))
+            return
+        # refresh stale entries until the smallest count is at the top, then take it over
+        heap = self.heap
+        while counts[heap[0][1]] != heap[0][0]:
+            heapq.heapreplace(heap, (counts[heap[0][1]], heap[0][1]))
+        smallest_key = heap[0][1]
+        if counts[smallest_key] > count:
+            # smaller than everything kept
+            return
+        del counts[smallest_key]
+        del self.errors[smallest_key]
+        counts[key] = count
+        self.errors[key] = error
+        heapq.heapreplace(heap, (count, key))
+
+    def merge(self, other):
+        # the counts of a shard, the sketches are added first so a new key starts from all of it
+        self.total += other.total
+        sketch = self.sketch
+        for index, count in enumerate(other.sketch):
+            if count:
+                sketch[index] += count
+        if len(other.counts) >= other.capacity:
+            # the shard may have dropped keys that are kept here, its sketch says how many it saw at most
+            for key in self.counts:
+                if key not in other.counts:
+                    estimate = min(other.sketch[index] for index in self.sketch_indexes(key))
+                    self.counts[key] += estimate
+                    self.errors[key] += estimate
+        for key, count in other.counts.items():
+            if key in self.counts:
+                self.counts[key] += count
+                self.errors[key] += other.errors[key]
+            elif len(self.counts) < self.capacity:
+                self.insert(key, count, other.errors[key])
+            else:
+                estimate = min(sketch[index] for index in self.sketch_indexes(key))
+                self.insert(key, estimate, estimate - count + other.errors[key])
+
+    def max_error(self):
+        # the most any of the counts kept can be too high by
+        return max(self.errors.values()) if self.errors else 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __getitem__(self, key):
+        return self.counts[key]
+
+    def __iter__(self):
+        # biggest first, like a dict that has been through sort_dict
+        return iter(sorted(self.counts, key=self.counts.get, reverse=True))
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(key, self.counts[key]) for key in self]
+
+    def values(self):
+        return [self.counts[key] for key in self]
+
+def print_latency(title, latency_dict, output_limit = 10):
+    print('Top {0} {1} by time spent:'.format(output_limit, title))
+    print(LatencyStats().header(title))
+    top = heapq.nlargest(output_limit, latency_dict.items(), key=lambda k: k[1].total)
+    print_lines(latency.summary(key) for key, latency in top)
+
+class PidInstance():
+    # the calls made by one pid, or one pid/lwp for truss
+    def __init__(self, pid):
+        self.pid = pid
+        self.calls = 0
+        self.errors = 0
+        self.syscall_commands = dict()
+        self.syscall_time = dict()
+        self.latency = LatencyStats()
+        # the first and the last two commands, runs of three calls in a row are counted to find the loops
+        # a thread is stuck in, and a run split over two shards is put back together on merge
+        self.first_calls = ()
+        self.last_calls = ()
+
+    def add_call(self, syscall_command, duration):
+        self.calls += 1
+        dict_inc_or_add(self.syscall_commands, syscall_command)
+        if duration is not None:
+            self.latency.add(duration)
+            dict_add(self.syscall_time, syscall_command, duration)
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.errors += other.errors
+        for syscall_command, count in other.syscall_commands.items():
+            dict_add(self.syscall_commands, syscall_command, count)
+        for syscall_command, duration in other.syscall_time.items():
+            dict_add(self.syscall_time, syscall_command, duration)
+        self.latency.merge(other.latency)
+        self.first_calls = (self.first_calls + other.first_calls)[:2]
+        self.last_calls = (self.last_calls + other.last_calls)[-2:]
+
+    def header(self):
+        return '{0:<16} {1:>10} {2:>8} {3:>12} {4:>10}  {5}'.format('pid', 'calls', 'errors', 'total(s)', 'p95', 'top command')
+
+    def __str__(self):
+        if self.syscall_time:
+            top_command = max(self.syscall_time, key=self.syscall_time.get)
+            top_command = '{0} ({1:.6f}s)'.format(top_command, self.syscall_time[top_command])
+        else:
+            top_command = max(self.syscall_commands, key=self.syscall_commands.get) if self.syscall_commands else ''
+            top_command = '{0} ({1})'.format(top_command, self.syscall_commands.get(top_command, 0))
+        return '{0:<16} {1:>10} {2:>8} {3:>12.6f} {4:>10.6f}  {5}'.format(
+            self.pid if self.pid != '' else '-', self.calls, self.errors, self.latency.total,
+            self.latency.percentile(95), top_command)
+
+def print_pids(title, pid_dict, output_limit = 10, by_time = False):
+    print('Top {0} {1}:'.format(output_limit, title))
+    print(PidInstance('').header())
+    if by_time:
+        top = heapq.nlargest(output_limit, pid_dict.values(), key=lambda k: k.latency.total)
+    else:
+        top = heapq.nlargest(output_limit, pid_dict.values(), key=lambda k: k.calls)
+    print_lines(str(pid_instance) for pid_instance in top)
+
+class FdTable():
+    # the open handles of a process, threads created with CLONE_FILES share one
+    def __init__(self, handles=None):
+        self.handles = dict(handles) if handles else dict()
+        self.opened = 0
+        self.closed = 0
+        self.peak = len(self.handles)
+        # handles opened less the ones closed since the table was started. A shard can't tell if a handle
+        # it opens or closes for the first time was open before it, so those are listed in order with the
+        # most change got to before each for the merge to work the peak out, change_peak is since the last
+        self.change = 0
+        self.change_peak = 0
+        self.touched = set(self.handles)
+        self.first_touches = []
+        # handles a shard closed without having seen them opened
+        self.removed = set()
+
+    def get(self, handle):
+        return self.handles.get(handle)
+
+    def open(self, handle, name):
+        # returns how many handles were added, a reused number replaces the old file
+        added = 0 if handle in self.handles else 1
+        self.handles[handle] = name
+        self.removed.discard(handle)
+        self.opened += 1
+        if len(self.handles) > self.peak:
+            self.peak = len(self.handles)
+        self.change += added
+        if handle not in self.touched:
+            self.touch(handle, False)
+        elif self.change > self.change_peak:
+            self.change_peak = self.change
+        return added
+
+    def close(self, handle, track_removed=False):
+        # returns how many handles were removed
+        self.closed += 1
+        if track_removed:
+            # a shard has to tell the merge this handle is gone, even if it was opened before the shard started
+            self.removed.add(handle)
+        if handle in self.handles:
+            del self.handles[handle]
+            self.change -= 1
+            return 1
+        if not track_removed or handle in self.touched:
+            # a handle the shard has seen closed already is not open any more
+            return 0
+        self.change -= 1
+        if handle not in self.touched:
+            self.touch(handle, True)
+        return 1
+
+    def touch(self, handle, closing):
+        # the peak so far goes with what the merge knew before this handle, the next one starts after it
+        self.touched.add(handle)
+        self.first_touches.append((self.change_peak, handle, closing))
+        self.change_peak = self.change
+
+    def copy(self):
+        fd_table = FdTable(self.handles)
+        fd_table.removed = set(self.removed)
+        # a forked child starts from where its parent had got to, the peaks before it are the parent's
+        fd_table.change = fd_table.change_peak = self.change
+        fd_table.touched = set(self.touched)
+        fd_table.first_touches = [(None, handle, closing) for peak, handle, closing in self.first_touches]
+        return fd_table
+
+    def merge(self, other, handles):
+        # apply what a shard did to this table, handles being its final state. Its peaks count
+        # from the handles open at the start of it, less the ones it opened that already were
+        # and plus the ones it closed that weren't
+        start_size = len(self.handles)
+        correction = 0
+        peak = self.peak
+        for change_peak, handle, closing in other.first_touches:
+            if change_peak is not None:
+                peak = max(peak, start_size + change_peak + correction)
+            if closing and handle not in self.handles:
+                correction += 1
+            elif not closing and handle in self.handles:
+                correction -= 1
+        peak = max(peak, start_size + other.change_peak + correction)
+        for handle in other.removed:
+            self.handles.pop(handle, None)
+        self.handles.update(handles)
+        self.opened += other.opened
+        self.closed += other.closed
+        self.peak = max(peak, len(self.handles))
+
+    def leaked(self):
+        # the name held open by the most handles
+        counts = dict()
+        for name in self.handles.values():
+            dict_inc_or_add(counts, name)
+        if not counts:
+            return ''
+        name = max(counts, key=counts.get)
+        return '{0} (x{1})'.format(name, counts[name])
+
+def print_fd_tables(title, fd_tables, output_limit = 10):
+    # one line per table, threads sharing a table are listed together
+    pids_by_table = OrderedDict()
+    for pid, fd_table in fd_tables.items():
+        pids_by_table.setdefault(id(fd_table), (fd_table, []))[1].append(pid if pid != '' else '-')
+    top = heapq.nlargest(output_limit, pids_by_table.values(), key=lambda k: len(k[0].handles))
+    print('Top {0} {1}:'.format(output_limit, title))
+    print('{0:<24} {1:>8} {2:>8} {3:>10} {4:>10}  {5}'.format('pid', 'open', 'peak', 'opened', 'closed', 'most held'))
+    print_lines('{0:<24} {1:>8} {2:>8} {3:>10} {4:>10}  {5}'.format(
+        ','.join(pids[:3]) + (',+{0}'.format(len(pids) - 3) if len(pids) > 3 else ''),
+        len(fd_table.handles), fd_table.peak, fd_table.opened, fd_table.closed, fd_table.leaked()) for fd_table, pids in top)
+
+def print_fd_samples(title, fd_samples, points = 20):
+    # a handle count that keeps climbing over the trace points at a leak
+    if not fd_samples:
+        return
+    print('{0}:'.format(title))
+    step = max(1, len(fd_samples) // points)
+    samples = fd_samples[::step]
+    if samples[-1] is not fd_samples[-1]:
+        samples.append(fd_samples[-1])
+    for position, open_handles in samples:
+        # the position is a timestamp when the trace has them, otherwise a line number
+        position = '{0:.6f}'.format(position) if isinstance(position, float) else 'line {0}'.format(position)
+        print('{0:>20}: {1}'.format(position, open_handles))
+    print('peak open handles: {0}'.format(max(k[1] for k in fd_samples)), flush=True)
+
+class Timeline():
+    # calls, errors and seconds spent per window of self.window seconds, in total and for
+    # each command and the busiest files. every series is a few arrays with a slot per window,
+    # so the memory goes with windows x series and not with the number of calls. windows
+    # are counted from 0 seconds so shards line up, and double in width when there are
+    # more than max_windows of them, like the handle samples do. the parser fills the
+    # window a line falls in from its counters once a line falls in the next one, see
+    # sample_timeline
+    max_windows = 2048
+    max_files = 64
+
+    def __init__(self, window=1.0):
+        self.window = window
+        # number of the first window, None until the first timestamp
+        self.first = None
+        # the window being counted and when it ends
+        self.current = 0
+        self.end = None
+        self.calls = array.array('q')
+        self.errors = array.array('q')
+        self.seconds = array.array('d')
+        # command -> (calls, seconds)
+        self.commands = dict()
+        # filename -> (calls, seconds) for the max_files busiest files, a file has to have
+        # more calls than the least busy of them to get in and its series starts in the
+        # window it does, file_calls are the calls of each in all
+        self.files = dict()
+        self.file_calls = dict()
+        self.file_threshold = 1
+        # command or filename -> (calls, seconds), and the errors, at the end of the last window
+        self.last_commands = dict()
+        self.last_files = dict()
+        self.last_errors = 0
+        # filename -> (FileInstance, calls, seconds) before the file was first used in
+        # the window being counted, some may be busy enough to track
+        self.touched = dict()
+
+    def __getstate__(self):
+        # the touched files are pickled by name, the parser links them up to its own again
+        state = dict(self.__dict__)
+        state['touched'] = dict((filename, touched[1:]) for filename, touched in self.touched.items())
+        return state
+
+    def series(self):
+        return [self.calls, self.errors, self.seconds] + [k for v in list(self.commands.values()) + list(self.files.values()) for k in v]
+
+    def new_series(self):
+        return (array.array('q', bytes(8 * len(self.calls))), array.array('d', bytes(8 * len(self.calls))))
+
+    def move_to(self, timestamp):
+        # start counting the window timestamp falls in
+        if self.first is None:
+            self.first = int(timestamp // self.window)
+        index = int(timestamp // self.window) - self.first
+        while index >= self.max_windows:
+            self.coarsen()
+            index = int(timestamp // self.window) - self.first
+        index = max(index, self.current)
+        if index >= len(self.calls):
+            zeros = bytes(8 * (index + 1 - len(self.calls)))
+            for series in self.series():
+                series.frombytes(zeros)
+        self.current = index
+        self.end = (self.first + index + 1) * self.window
+
+    def coarsen(self):
+        # halve the number of windows by adding them up in pairs
+        if self.first % 2:
+            for series in self.series():
+                series.insert(0, 0)
+            self.first -= 1
+            self.current += 1
+        for series in self.series():
+            if len(series) % 2:
+                series.append(0)
+            series[:] = array.array(series.typecode, map(operator.add, series[::2], series[1::2]))
+        self.first //= 2
+        self.current //= 2
+        self.window *= 2
+        self.end = (self.first + self.current + 1) * self.window
+
+    def add(self, named_series, last, name, calls, seconds):
+        # count what name did since the last window in the current one
+        last_calls, last_seconds = last.get(name, (0, 0.0))
+        if calls == last_calls:
+            return 0, 0.0
+        series = named_series.get(name)
+        if series is None:
+            series = named_series[name] = self.new_series()
+        series[0][self.current] += calls - last_calls
+        series[1][self.current] += seconds - last_seconds
+        last[name] = (calls, seconds)
+        return calls - last_calls, seconds - last_seconds
+
+    def prune_files(self):
+        if len(self.files) <= self.max_files:
+            return
+        keep = set(heapq.nlargest(self.max_files, self.file_calls, key=self.file_calls.get))
+        for filename in [k for k in self.files if k not in keep]:
+            del self.files[filename]
+            del self.file_calls[filename]
+            self.last_files.pop(filename, None)
+        self.file_threshold = max(self.file_threshold, min(self.file_calls.values()) + 1)
+
+    def merge(self, other):
+        # add another timeline in, the finer of the two is coarsened to match
+        if other.first is None:
+            return
+        if self.first is None:
+            for name in ['window', 'first', 'current', 'end', 'calls', 'errors', 'seconds', 'commands', 'files', 'file_calls', 'file_threshold']:
+                setattr(self, name, getattr(other, name))
+            return
+        while other.window < self.window:
+            other.coarsen()
+        while self.window < other.window:
+            self.coarsen()
+        if other.first < self.first:
+            zeros = bytes(8 * (self.first - other.first))
+            for series in self.series():
+                series[:0] = array.array(series.typecode, zeros)
+            self.current += self.first - other.first
+            self.first = other.first
+        offset = other.first - self.first
+        if offset + len(other.calls) > len(self.calls):
+            zeros = bytes(8 * (offset + len(other.calls) - len(self.calls)))
+            for series in self.series():
+                series.frombytes(zeros)
+        pairs = [(self.calls, other.calls), (self.errors, other.errors), (self.seconds, other.seconds)]
+        for mine, theirs in [(self.commands, other.commands), (self.files, other.files)]:
+            for name, series in theirs.items():
+                if name not in mine:
+                    mine[name] = self.new_series()
+                pairs.append((mine[name][0], series[0]))
+                pairs.append((mine[name][1], series[1]))
+        for mine, theirs in pairs:
+            mine[offset:offset + len(theirs)] = array.array(mine.typecode, map(operator.add, mine[offset:offset + len(theirs)], theirs))
+        for filename, calls in other.file_calls.items():
+            self.file_calls[filename] = self.file_calls.get(filename, 0) + calls
+        self.file_threshold = max(self.file_threshold, other.file_threshold)
+        self.prune_files()
+        # carry on counting in the last window of the two
+        self.current = max(self.current, offset + other.current)
+        self.end = (self.first + self.current + 1) * self.window
+        while len(self.calls) > self.max_windows:
+            self.coarsen()
+
+    def start(self, index):
+        return (self.first + index) * self.window
+
+    def busiest(self, named_series, index):
+        # the name with the most calls in a window
+        best = max(named_series.items(), key=lambda k: k[1][0][index], default=None)
+        return best[0] if best is not None and best[1][0][index] else ''
+
+def format_timestamp(timestamp):
+    # -ttt timestamps are seconds since the epoch, show the time of day next to them
+    if timestamp >= 86400 * 2:
+        return '{0:.3f} {1}.{2:03d}'.format(timestamp, time.strftime('%H:%M:%S', time.localtime(timestamp)), int(timestamp % 1 * 1000))
+    return '{0:.3f}'.format(timestamp)
+
+def print_timeline(title, timeline, output_limit = 10, points = 20):
+    # the calls over the whole trace in about points rows, then the busiest windows
+    # with the command and file behind them, to line storms up with other metrics
+    if timeline.first is None:
+        return
+    windows = len(timeline.calls)
+    step = max(1, -(-windows // points))
+    print('{0}, {1} windows of {2:g} seconds:'.format(title, windows, timeline.window))
+    print('{0:>30} {1:>10} {2:>10} {3:>8} {4:>12}  {5}'.format('from', 'calls', 'calls/s', 'errors', 'seconds', 'busiest command'))
+    for index in range(0, windows, step):
+        calls = sum(timeline.calls[index:index + step])
+        busiest = max(timeline.commands.items(), key=lambda k: sum(k[1][0][index:index + step]))[0] if calls else ''
+        print('{0:>30} {1:>10} {2:>10.1f} {3:>8} {4:>12.6f}  {5}'.format(
+            format_timestamp(timeline.start(index)), calls, calls / (timeline.window * len(timeline.calls[index:index + step])),
+            sum(timeline.errors[index:index + step]), sum(timeline.seconds[index:index + step]), busiest))
+    print('Top {0} busiest {1:g} second windows:'.format(output_limit, timeline.window))
+    print('{0:>30} {1:>10} {2:>8} {3:>12}  {4:<16} {5}'.format('from', 'calls', 'errors', 'seconds', 'command', 'file'))
+    busiest = [index for index in heapq.nlargest(output_limit, range(windows), key=lambda k: timeline.calls[k]) if timeline.calls[index]]
+    print_lines('{0:>30} {1:>10} {2:>8} {3:>12.6f}  {4:<16} {5}'.format(
+        format_timestamp(timeline.start(index)), timeline.calls[index], timeline.errors[index], timeline.seconds[index],
+        timeline.busiest(timeline.commands, index), timeline.busiest(timeline.files, index)) for index in busiest)
+
+def latency_fields(record, latency):
+    # add the LatencyStats columns to a report record
+    record['calls'] = latency.count
+    record['total'] = latency.total
+    record['mean'] = latency.mean()
+    record['p50'] = latency.percentile(50)
+    record['p95'] = latency.percentile(95)
+    record['p99'] = latency.percentile(99)
+    record['max'] = latency.max
+    return record
+
+def write_records(records, fp, report_format):
+    # written as they are made so the report is never held in memory, JSON Lines keeps
+    # each record whole, CSV flattens them to one table,key,field,value row per field
+    if report_format == 'csv':
+        writer = csv.writer(fp)
+        writer.writerow(['table', 'key', 'field', 'value'])
+        for record in records:
+            table = record.pop('table')
+            key = record.pop('key')
+            for field, value in record.items():
+                if isinstance(value, list):
+                    value = ' '.join(str(k) for k in value)
+                writer.writerow([table, key, field, value])
+    else:
+        for record in records:
+            fp.write(json.dumps(record))
+            fp.write('\n')
+
+class FileCommands(list):
+    # the commands seen against files, in the order they were first seen,
+    # each file keeps its counters in an array indexed the same way
+    def __init__(self, commands=()):
+        list.__init__(self, commands)
+        self.ids = dict((command, index) for index, command in enumerate(self))
+
+    def intern(self, command):
+        index = self.ids.get(command)
+        if index is None:
+            index = self.ids[command] = len(self)
+            self.append(command)
+        return index
+
+    def __reduce__(self):
+        return (FileCommands, (list(self),))
+
 class FileInstance():
+    __slots__ = ['print_format', 'file_commands', 'filename', 'lasthandle', 'handles', 'latency', 'counts', 'transfers']
+    file_exclusions = frozenset(['sig', 'sock', 'shutdown', 'connext', 'esend'])
+    # how the calls went rather than calls themselves, small_io counts the reads and writes of a few bytes
+    result_keys = ['success', 'failure', 'handle', 'error', 'small_io']
+
     def __init__(self, filename, handle, print_format, file_commands):
         self.print_format = print_format
         self.file_commands = file_commands
         self.filename = filename
-        self.print_format.set_maxwidth('filename', filename)
         self.lasthandle = handle
-        self.print_format.set_maxwidth('handle', handle)
         self.handles = []
-        self.file_exclusions = ['sig', 'sock', 'shutdown', 'connext', 'esend']
+        # time spent in calls against this file, from the strace -T durations
+        self.latency = LatencyStats()
+        # one counter per entry in file_commands, grown as new commands turn up
+        self.counts = array.array('q')
+        # ByteStats once something is read, written or mapped
+        self.transfers = None
+
+    def calls(self):
+        # the calls made against the file, leaving out the counts of how they went
+        return sum(self.counts) - sum(self.get_attr_val_safe(key) for key in self.result_keys)
 
     def incHandles(self, handle):
         self.lasthandle = handle
-        if handle not in self.handles and handle is not '0':
+        if handle != '0' and handle not in self.handles:
             self.handles.append(handle)
 
     def incAttr(self, key):
+        self.addAttr(key, 1)
+
+    def addAttr(self, key, count):
         # check for exclusion commands
-        exclude = False
         if key in self.file_exclusions:
-            exclude = True
-        if exclude is not True:                
-            new_value = 1
-            # does it already exist?
-            if hasattr(self, key):
-                # get the previous value and increment it
-                new_value = int(getattr(self, key)) + 1
-            # udpate the value
-            setattr(self, key, new_value)
-            # update the max value for this key
-            self.print_format.set_max(key, new_value)
+            return
+        index = self.file_commands.ids.get(key)
+        if index is None:
             # add the key to list of file commands if not already added
-            if key not in self.file_commands:
-                self.file_commands.append(key)
-        else:
-            # this command is to be excluded
-            pass
-            
+            index = self.file_commands.intern(key)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += count
+
+    def merge(self, other):
+        # add the counters of the same file parsed by another shard
+        for index, count in enumerate(other.counts):
+            if count:
+                self.addAttr(other.file_commands[index], count)
+        for handle in other.handles:
+            if handle not in self.handles:
+                self.handles.append(handle)
+        self.latency.merge(other.latency)
+        if other.transfers is not None:
+            self.add_transfers(other.transfers)
+        if other.lasthandle != 0:
+            self.lasthandle = other.lasthandle
+
+    def add_transfers(self, transfers):
+        if self.transfers is None:
+            self.transfers = ByteStats()
+        self.transfers.merge(transfers)
+
     def get_attr_val_safe(self, key):
-        if hasattr(self, key):
-            return getattr(self, key)
-        else:
+        index = self.file_commands.ids.get(key)
+        if index is None or index >= len(self.counts):
             # not set return 0
             return 0
-            
-    def header(self):        
-        output_string = ''        
-        title_filename = 'filename'        
-        width = self.print_format.setget_maxwidth(title_filename, title_filename) + 4        
-        str_filename = self.print_format.fixed_width_print(title_filename, width)        
-        output_string = '{0}'.format(str_filename)        
-        title_lasthandle = 'handle'
-        width = self.print_format.setget_maxwidth(title_lasthandle, title_lasthandle) + 2 
-        str_lasthandle = self.print_format.fixed_width_print(title_lasthandle, width)
-        output_string = '{0}|{1}'.format(output_string, str_lasthandle)        
-        for command in self.file_commands:
-            width = self.print_format.setget_maxwidth(command, command) + 2
-            cmd_print = self.print_format.fixed_width_print(command, width)
-            output_string = '{0}|{1}'.format(output_string, cmd_print)        
-        str_handles = 'handles'
-        output_string = '{0}|{1}'.format(output_string, str_handles)        
-        underline = '-' * len(output_string)
-        return output_string + '\n' + underline
-        
-    def __str__(self):        
-        output_string = ''        
-        title_filename = 'filename'        
-        width = self.print_format.setget_maxwidth(title_filename, self.filename) + 4        
-        str_filename = self.print_format.fixed_width_print(self.filename, width)        
-        output_string = '{0}'.format(str_filename)        
-        title_lasthandle = 'handle'
-        width = self.print_format.setget_maxwidth('handle', str(self.lasthandle)) + 2 
-        str_lasthandle = self.print_format.fixed_width_print(str(self.lasthandle), width)
-        output_string = '{0}|{1}'.format(output_string, str_lasthandle)        
-        for command in self.file_commands:            
-            current_value = self.get_attr_val_safe(command)
-            max_val = self.print_format.get_max(command)
-            width = self.print_format.setget_maxwidth(command, current_value) + 2
-            cmd_print = self.print_format.max_colour_print(current_value, max_val, width)
-            output_string = '{0}|{1}'.format(output_string, cmd_print)
-        output_string = '{0}|{1}'.format(output_string, self.handles)        
-        return output_string
-        
+        return self.counts[index]
+
+    def cells(self, columns):
+        # the row of the 'A' view, with a count for each of the first columns file commands
+        counts = self.counts[:columns].tolist()
+        if len(counts) < columns:
+            counts.extend([0] * (columns - len(counts)))
+        return [self.filename, str(self.lasthandle)] + counts + [self.handles]
+
     def get_compare_values(self,other):
         global compare_field
         if isinstance(other, str):
@@ -191,13 +1015,9 @@ class FileInstance():
             other = FileInstance(other, 0, self.print_format, self.file_commands)
         if not isinstance(other, FileInstance):
             raise TypeError("{0} is not of type FileInstance".format(type(other)))
-        value_self = 0
-        value_other = 0
-        if compare_field is not '':
-            if hasattr(self, compare_field):
-                value_self = getattr(self, compare_field)
-            if hasattr(other, compare_field):
-                value_other = getattr(other, compare_field)
+        if compare_field != '' and compare_field != 'filename':
+            value_self = self.get_attr_val_safe(compare_field)
+            value_other = other.get_attr_val_safe(compare_field)
         else:
             value_self = getattr(self, 'filename')
             value_other = getattr(other, 'filename')
@@ -215,20 +1035,1516 @@ class FileInstance():
         value_self, value_other = self.get_compare_values(other)
         return value_self > value_other
 
+def pack_file_instances(file_instances):
+    # the files as a few columns of plain values, pickling 100,000s of small objects one at a time
+    # is most of the time it takes to save the cache or a checkpoint and to send a shard back
+    lengths = array.array('q', [len(fileinstance.counts) for fileinstance in file_instances])
+    counts = array.array('q')
+    for fileinstance in file_instances:
+        counts.extend(fileinstance.counts)
+    latencies = [(k.latency.count, k.latency.total, k.latency.max, k.latency.buckets) for k in file_instances]
+    transfers = [None if k.transfers is None else (k.transfers.reads, k.transfers.writes, k.transfers.read_bytes, k.transfers.write_bytes,
+                                                   k.transfers.mapped_bytes, k.transfers.seconds, k.transfers.buckets)
+                 for k in file_instances]
+    return ([k.filename for k in file_instances], [k.lasthandle for k in file_instances], [k.handles for k in file_instances],
+            lengths, counts, latencies, transfers)
+
+def unpack_file_instances(packed, print_format, file_commands):
+    filenames, lasthandles, handles, lengths, counts, latencies, transfers = packed
+    file_instances = []
+    start = 0
+    for index, filename in enumerate(filenames):
+        fileinstance = FileInstance(filename, lasthandles[index], print_format, file_commands)
+        fileinstance.handles = handles[index]
+        fileinstance.counts = counts[start:start + lengths[index]]
+        start += lengths[index]
+        latency = fileinstance.latency
+        latency.count, latency.total, latency.max, latency.buckets = latencies[index]
+        if transfers[index] is not None:
+            byte_stats = fileinstance.transfers = ByteStats()
+            (byte_stats.reads, byte_stats.writes, byte_stats.read_bytes, byte_stats.write_bytes,
+             byte_stats.mapped_bytes, byte_stats.seconds, byte_stats.buckets) = transfers[index]
+        file_instances.append(fileinstance)
+    return file_instances
+
+class FilenameIndex():
+    # the lowercased filenames joined into one string, a line each, so a substring is found
+    # with one search in C rather than lowercasing and testing every file on every query,
+    # and a sorted copy for prefixes like a directory and everything below it. file ids
+    # are positions in associated_file_instances, only files added since the last query
+    # get indexed
+    glob_chars = re.compile(r'[*?[]')
+    glob_wildcards = re.compile(r'\*|\?|\[!?\]?[^]]*\]?')
+
+    def __init__(self):
+        self.names = []
+        self.text = ''
+        # where each name starts in text
+        self.starts = array.array('q')
+        # (name, id) in name order, rebuilt when files are added
+        self.sorted_names = None
+
+    def update(self, file_instances):
+        if len(self.names) == len(file_instances):
+            return
+        new_names = [fileinstance.filename.lower() for fileinstance in file_instances[len(self.names):]]
+        offset = len(self.text)
+        for name in new_names:
+            self.starts.append(offset)
+            offset += len(name) + 1
+        self.names.extend(new_names)
+        self.text += '\n'.join(new_names) + '\n'
+        self.sorted_names = None
+
+    def containing(self, text):
+        # finding the line of each match only pays off when there are few of them
+        if self.text.count(text) * 8 > len(self.names):
+            return [file_id for file_id, name in enumerate(self.names) if text in name]
+        file_ids = []
+        last_id = -1
+        starts = self.starts
+        for match in re.finditer(re.escape(text), self.text):
+            file_id = bisect.bisect_right(starts, match.start()) - 1
+            if file_id != last_id:
+                file_ids.append(file_id)
+                last_id = file_id
+        return file_ids
+
+    def prefixed(self, prefix):
+        if self.sorted_names is None:
+            self.sorted_names = sorted(zip(self.names, range(len(self.names))))
+        file_ids = []
+        for name, file_id in itertools.islice(self.sorted_names, bisect.bisect_left(self.sorted_names, (prefix,)), None):
+            if not name.startswith(prefix):
+                break
+            file_ids.append(file_id)
+        file_ids.sort()
+        return file_ids
+
+    def search(self, text):
+        # ids in the order the files were first seen, text is a substring or a glob over the whole name.
+        # Names like "pipe:[7,8]" have glob characters in them, so it is only a glob when no name has the text
+        text = text.lower()
+        file_ids = self.containing(text)
+        if file_ids or self.glob_chars.search(text) is None:
+            return file_ids
+        # narrow it down by the plain text in the glob first, then check those against the glob
+        literals = [literal for literal in self.glob_wildcards.split(text) if literal]
+        if literals and text.startswith(literals[0]):
+            file_ids = self.prefixed(literals[0])
+        elif literals:
+            file_ids = self.containing(max(literals, key=len))
+        else:
+            file_ids = range(len(self.names))
+        matcher = re.compile(fnmatch.translate(text), re.S).match
+        names = self.names
+        return [file_id for file_id in file_ids if matcher(names[file_id])]
+
+def parent_directory(filename):
+    parent = filename.rpartition('/')[0]
+    if parent == '':
+        return '/' if filename[:1] == '/' else '.'
+    return parent
+
+def directory_rollup(file_instances, file_commands, field=''):
+    # directory -> [files, calls, seconds, count of field] for every directory,
+    # counting everything below it, files are added to their own directory and
+    # then each directory to its parent, deepest first
+    index = file_commands.ids.get(field)
+    directories = dict()
+    for fileinstance in file_instances:
+        directory = parent_directory(fileinstance.filename)
+        totals = directories.get(directory)
+        if totals is None:
+            totals = directories[directory] = [0, 0, 0.0, 0]
+        totals[0] += 1
+        totals[1] += sum(fileinstance.counts)
+        totals[2] += fileinstance.latency.total
+        if index is not None and index < len(fileinstance.counts):
+            totals[3] += fileinstance.counts[index]
+    for directory in list(directories):
+        while directory not in ('/', '.'):
+            directory = parent_directory(directory)
+            if directory in directories:
+                break
+            directories[directory] = [0, 0, 0.0, 0]
+    for directory in sorted(directories, key=lambda k: k.count('/'), reverse=True):
+        if directory in ('/', '.'):
+            continue
+        totals = directories[directory]
+        parent_totals = directories[parent_directory(directory)]
+        for i in range(4):
+            parent_totals[i] += totals[i]
+    return directories
+
+def print_directories(title, directories, field, output_limit = 10):
+    print('Top {0} {1} by {2}:'.format(output_limit, title, field if field not in ('', 'filename') else 'calls'))
+    print('{0:>8} {1:>10} {2:>12} {3:>10}  {4}'.format('files', 'calls', 'seconds', field if field not in ('', 'filename') else '', 'directory'))
+    column = 3 if field not in ('', 'filename') else 1
+    # the deepest directory first when a chain of them hold the same files
+    top = heapq.nlargest(output_limit, directories.items(), key=lambda k: (k[1][column], k[0].count('/')))
+    print_lines('{0:>8} {1:>10} {2:>12.6f} {3:>10}  {4}'.format(totals[0], totals[1], totals[2], totals[3] if column == 3 else '', directory)
+                for directory, totals in top)
+
+def detect_compression(header):
+    for magic, compression in compression_magic:
+        if header[:len(magic)] == magic:
+            return compression
+    return None
+
+def open_compressed(fp, compression):
+    # decompress the log as it is read rather than to a file first
+    if compression == 'gzip':
+        reader = gzip.GzipFile(fileobj=fp)
+    elif compression == 'bz2':
+        reader = bz2.BZ2File(fp)
+    elif compression == 'xz':
+        reader = lzma.LZMAFile(fp)
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            print('The log is zstd compressed, install the zstandard module to read it or decompress it first')
+            sys.exit(1)
+        reader = zstandard.ZstdDecompressor().stream_reader(fp, read_size=read_buffer_size)
+    return io.BufferedReader(reader, buffer_size=read_buffer_size)
+
+def split_log_file(logfile, start, total_bytes, jobs):
+    # byte ranges of roughly equal size, each one ending just after a newline
+    shards = []
+    chunk = max(1, (total_bytes - start) // jobs)
+    with open(logfile, 'rb') as fp:
+        while start < total_bytes:
+            end = start + chunk
+            if end >= total_bytes:
+                end = total_bytes
+            else:
+                fp.seek(end)
+                fp.readline()
+                end = fp.tell()
+            shards.append((start, end))
+            start = end
+    return shards
+
+def read_log_range(logfile, start, end):
+    # yield the lines between two newline aligned offsets of the log
+    if start >= end:
+        return
+    with open(logfile, 'rb') as fp:
+        fp.seek(start)
+        position = start
+        for raw_line in fp:
+            position += len(raw_line)
+            yield raw_line
+            if position >= end:
+                break
+
+def parse_time(text, first_timestamp):
+    # a time for --from and --to, in seconds like the log has them, "+seconds" from the
+    # start of the log or a time of day, HH:MM[:SS.ffffff]
+    text = text.strip()
+    if text[:1] == '+':
+        return first_timestamp + float(text[1:])
+    if ':' not in text:
+        return float(text)
+    hours, minutes, seconds = (text.split(':') + ['0'])[:3]
+    timestamp = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    if first_timestamp >= 86400 * 2:
+        # -ttt gives seconds since the epoch, take the time of day on the day the log starts
+        start = time.localtime(first_timestamp)
+        timestamp += int(first_timestamp) - (start.tm_hour * 3600 + start.tm_min * 60 + start.tm_sec)
+    return timestamp
+
+class TraceFormat():
+    # how one tracer writes its log. The parser works out which one it is reading from the first lines (see
+    # sniff_trace_format) and hands every line to that one, whose tokenize returns the same event whatever wrote it:
+    # (thread, pid, timestamp, command, first argument, path, arguments, return value, error text, duration), or None
+    # for a line that is not a finished call. Another tracer only needs another subclass in trace_formats
+    name = ''
+
+    def score(self, line):
+        # how much the line looks like this tracer wrote it, 0 when it can't have
+        return 0
+
+    def tokenize(self, parser, line):
+        return None
+
+    def event(self, parser, thread, timestamp, command, first_arg, path, args, retval, error_text, duration):
+        # the thread and timestamp as the aggregation wants them, truss threads are pid/lwp and the handles belong to the pid
+        pid = thread
+        if thread is None:
+            pid = thread = ''
+        elif '/' in thread:
+            pid = thread.split('/')[0]
+        if timestamp is not None:
+            if timestamp.__class__ is str and ':' not in timestamp:
+                # -ttt and truss -d, the common case, without a call
+                timestamp = float(timestamp)
+                if parser.first_timestamp is None:
+                    parser.first_timestamp = parser.last_timestamp = timestamp
+                elif timestamp > parser.last_timestamp:
+                    parser.last_timestamp = timestamp
+            else:
+                timestamp = parser.add_timestamp(timestamp)
+        if path is not None:
+            first_arg = path
+        return thread, pid, timestamp, command, first_arg, path, args, retval, error_text, duration
+
+    def line_timestamp(self, line):
+        # the timestamp at the start of a line in seconds or None, for --from and --to
+        timestamp = line_prefix.match(line).group(2)
+        if timestamp is None:
+            return None
+        if ':' in timestamp:
+            hours, minutes, seconds = timestamp.split(':')
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        return float(timestamp)
+
+class StraceFormat(TraceFormat):
+    # strace -f -ttt -T (or -t, -tt), a failed call returns a negative number followed by the errno,
+    # "= -1 ENOENT (No such file or directory)", and calls interrupted by another thread are split over
+    # an "<unfinished ...>" and a "<... resumed>" line
+    name = 'strace'
+    # the prefix then command(args) = retval rest <duration>, rest is the errno text or whatever strace explains the return value with
+    line_pattern = re.compile(line_prefix.pattern + call_pattern + r'=\s+(\S*) ?([^<]*)(?:<(\d+\.\d+)>)?$')
+    # slower, for the odd return value with a "<" in it, e.g. "= ? <unavailable>"
+    lenient_pattern = re.compile(line_prefix.pattern + call_pattern + r'=\s+(\S*) ?(.*?)\s*(?:<(\d+\.\d+)>)?$')
+    # the fields in front of the command as truss writes them, "1234/1:  0.0123: " or "0.0123: "
+    truss_prefix = re.compile(r'\s*(?:\d+(?:/\d+)?:\s+(?:\d+\.\d+:\s)?|\d+\.\d+:\s)')
+    markers = ('<unfinished ...>', ' resumed>', '+++ exited ', '--- SIG')
+
+    def score(self, line):
+        if self.truss_prefix.match(line) is not None:
+            return 0
+        if self.line_pattern.match(line) is not None:
+            return 1
+        return 1 if any(k in line for k in self.markers) else 0
+
+    def tokenize(self, parser, line):
+        # the fast path, every line goes through here so event is done inline
+        match = self.line_pattern.match(line)
+        if match is None:
+            return self.tokenize_partial(parser, line)
+        thread, timestamp, syscall_command, args, path, first_arg, retval, ret_rest, duration = match.groups()
+        pid = thread
+        if thread is None:
+            pid = thread = ''
+        if timestamp is not None:
+            if ':' in timestamp:
+                timestamp = parser.add_timestamp(timestamp)
+            else:
+                timestamp = float(timestamp)
+                if parser.first_timestamp is None:
+                    parser.first_timestamp = parser.last_timestamp = timestamp
+                elif timestamp > parser.last_timestamp:
+                    parser.last_timestamp = timestamp
+        if path is not None:
+            first_arg = path
+        error_text = None
+        if retval[:1] == '-' and ret_rest[:1] == 'E':
+            # a negative return value without an errno after it is just a negative number
+            error_text = (retval + ' ' + ret_rest).rstrip()
+        if duration is not None:
+            duration = float(duration)
+        return thread, pid, timestamp, syscall_command, first_arg, path, args, retval, error_text, duration
+
+    def call_event(self, parser, groups):
+        thread, timestamp, syscall_command, args, path, first_arg, retval, ret_rest, duration = groups
+        error_text = None
+        if retval[:1] == '-' and ret_rest[:1] == 'E':
+            error_text = (retval + ' ' + ret_rest).rstrip()
+        if duration is not None:
+            duration = float(duration)
+        return self.event(parser, thread, timestamp, syscall_command, first_arg, path, args, retval, error_text, duration)
+
+    def tokenize_partial(self, parser, line):
+        # unfinished and resumed calls, exits, signals and anything else strace put in the log
+        prefix = line_prefix.match(line)
+        thread = prefix.group(1) or ''
+        timestamp = prefix.group(2)
+        if timestamp is not None:
+            timestamp = parser.add_timestamp(timestamp)
+        body_start = prefix.end()
+        if line.endswith('<unfinished ...>'):
+            # another thread got in before this call finished, keep the start until it is resumed
+            parser.unfinished[thread] = line[:line.rfind('<unfinished ...>')].rstrip()
+            return None
+        if line.startswith('<... ', body_start):
+            # "<... read resumed>, 4096) = 10", glue it back onto the start of the call
+            end = line.find(' resumed>', body_start)
+            if end < 0:
+                parser.unparsed_lines += 1
+                return None
+            start = parser.unfinished.pop(thread, None)
+            if start is None:
+                if parser.shard:
+                    # the start of the call is in an earlier shard, the merge finishes it
+                    parser.orphan_resumed.append((thread, line))
+                    return None
+                # the log starts part way through the call
+                start = line[:body_start] + line[body_start+5:end] + '('
+            return self.tokenize(parser, start + line[end+9:])
+        if line.startswith('+++ exited ', body_start) or line.startswith('+++ killed by ', body_start):
+            # strace tells us when a thread or process is gone
+            return self.event(parser, thread, timestamp, None, '', None, '', line[body_start+4:-4], None, None)
+        if line.startswith('--- ', body_start):
+            # signal deliveries
+            return None
+        match = self.lenient_pattern.match(line)
+        if match is not None:
+            return self.call_event(parser, match.groups())
+        match = no_return_line.match(line, body_start)
+        if match is None:
+            parser.unparsed_lines += 1
+            return None
+        # strace doesn't print a return value for a call it never saw finish, e.g. exit
+        args = match.group(2)
+        return self.event(parser, thread, timestamp, match.group(1), args.split(',')[0], None, args, None, None, None)
+
+class TrussFormat(StraceFormat):
+    # AIX truss -f -d, "1234/1:  0.0123: kopen("/etc/hosts", O_RDONLY) = 3", a failed call is "Err#2 ENOENT" and
+    # a negative return value is just a number, there are no durations and calls aren't split over lines
+    name = 'truss'
+    line_pattern = re.compile(line_prefix.pattern + call_pattern + r'(?:=\s+(\S*) ?(.*?)|(Err#.*?))\s*$')
+    ignored_lines = ('Received signal', 'Siginfo', 'Stopped by signal')
+
+    def score(self, line):
+        if 'Trace Started' in line or 'Err#' in line:
+            return 3
+        return 2 if self.truss_prefix.match(line) is not None and self.line_pattern.match(line) is not None else 0
+
+    def tokenize(self, parser, line):
+        match = self.line_pattern.match(line)
+        if match is None:
+            return self.tokenize_partial(parser, line)
+        thread, timestamp, syscall_command, args, path, first_arg, retval, ret_rest, error_text = match.groups()
+        if error_text is not None:
+            error_text = error_text.rstrip()
+        return self.event(parser, thread, timestamp, syscall_command, first_arg, path, args, retval, error_text, None)
+
+    def tokenize_partial(self, parser, line):
+        # signals, the header and truss printing a call again once it stops sleeping
+        prefix = line_prefix.match(line)
+        body_start = prefix.end()
+        timestamp = prefix.group(2)
+        if timestamp is not None:
+            timestamp = parser.add_timestamp(timestamp)
+        if line.startswith(self.ignored_lines, body_start) or line.endswith('(sleeping...)') or 'Trace Started' in line:
+            return None
+        match = no_return_line.match(line, body_start)
+        if match is None:
+            parser.unparsed_lines += 1
+            return None
+        # truss doesn't print a return value for exit
+        args = match.group(2)
+        return self.event(parser, prefix.group(1), timestamp, match.group(1), args.split(',')[0], None, args, None, None, None)
+
+class LtraceFormat(StraceFormat):
+    # ltrace -f -ttt -T, laid out like strace but the calls are library functions, maybe with the library in front,
+    # "libc.so.6->fopen(", and -S adds the system calls as "SYS_openat(". A library call doesn't say why it failed,
+    # a system call that returns -2 failed with errno 2
+    name = 'ltrace'
+    library_call_pattern = r'(?:[\w.+-]+->)?' + call_pattern
+    line_pattern = re.compile(line_prefix.pattern + library_call_pattern + r'=\s+(\S*) ?([^<]*)(?:<(\d+\.\d+)>)?$')
+    lenient_pattern = re.compile(line_prefix.pattern + library_call_pattern + r'=\s+(\S*) ?(.*?)\s*(?:<(\d+\.\d+)>)?$')
+    library_call = re.compile(r'.*?(?:[\w.+-]+->|SYS_)\w+\(')
+    # functions strace would never show, a few of them mean ltrace
+    library_functions = frozenset(['malloc', 'calloc', 'realloc', 'free', 'strlen', 'strcmp', 'strncmp', 'strcpy', 'strdup',
+                                   'memcpy', 'memset', 'memcmp', 'fopen', 'fclose', 'fread', 'fwrite', 'fgets', 'fflush',
+                                   'printf', 'fprintf', 'sprintf', 'snprintf', 'puts', 'getenv', 'setlocale', 'pthread_mutex_lock'])
+    # library calls whose first argument is a path or a handle, for the rest a quoted string or a number is neither
+    path_functions = frozenset(['fopen', 'fopen64', 'freopen', 'open', 'open64', 'creat', 'opendir', 'stat', 'stat64', 'lstat',
+                                'lstat64', 'access', 'unlink', 'remove', 'rename', 'mkdir', 'rmdir', 'chdir', 'chmod', 'chown',
+                                'truncate', 'realpath', 'readlink', 'dlopen', 'execv', 'execve', 'execvp', 'mkfifo', 'utime'])
+    handle_functions = frozenset(['read', 'write', 'pread', 'pwrite', 'pread64', 'pwrite64', 'readv', 'writev', 'close',
+                                  'lseek', 'lseek64', 'fstat', 'fstat64', 'fsync', 'fdatasync', 'ftruncate', 'dup', 'dup2',
+                                  'dup3', 'fcntl', 'ioctl', 'send', 'recv', 'sendto', 'recvfrom', 'sendmsg', 'recvmsg',
+                                  'accept', 'connect', 'bind', 'listen', 'shutdown', 'fdopen', 'fdopendir'])
+
+    def score(self, line):
+        if self.library_call.match(line) is not None:
+            return 3
+        match = self.line_pattern.match(line)
+        return 2 if match is not None and match.group(3) in self.library_functions else 0
+
+    def tokenize(self, parser, line):
+        match = self.line_pattern.match(line)
+        if match is None:
+            return self.tokenize_partial(parser, line)
+        return self.call_event(parser, match.groups())
+
+    def call_event(self, parser, groups):
+        thread, timestamp, command, args, path, first_arg, retval, ret_rest, duration = groups
+        error_text = None
+        if command[:4] == 'SYS_':
+            command = command[4:]
+            if retval[:1] == '-' and retval[1:].isdigit():
+                # the raw return value, -errno, written the way strace does it
+                number = int(retval[1:])
+                error_text = '-1 {0} ({1})'.format(errno.errorcode.get(number, 'E{0}'.format(number)), os.strerror(number))
+        elif command not in self.path_functions and command not in self.handle_functions:
+            # e.g. strlen("abc") or malloc(16)
+            path = None
+            first_arg = ''
+        elif command not in self.path_functions:
+            path = None
+        if duration is not None:
+            duration = float(duration)
+        return self.event(parser, thread, timestamp, command, first_arg, path, args, retval, error_text, duration)
+
+class PerfTraceFormat(TraceFormat):
+    # perf trace, "0.123 ( 0.004 ms): cat/1234 openat(dfd: CWD, filename: /etc/hosts, flags: CLOEXEC) = 3", the times
+    # are milliseconds from the start and the arguments are named. They are put back in order as strace would show
+    # them with the paths quoted, so handles and directories are followed the same way. A call another thread got
+    # in front of ends with "..." and is finished by a "... [continued]: poll()) = 1" line
+    name = 'perf'
+    line_pattern = re.compile(r'\s*(\d+\.\d+)\s+\(\s*(?:(\d+\.\d+)\s*ms)?\s*\):\s+(?:.*?/)?(\d+)\s+(\w+)\((.*)\)\s+=\s+(\S+)\s*(.*)$')
+    unfinished_pattern = re.compile(r'\s*(\d+\.\d+)\s+\(\s*\):\s+(?:.*?/)?(\d+)\s+(\w+)\((.*)\)\s+\.\.\.\s*$')
+    continued_pattern = re.compile(r'\s*(?:\d+\.\d+|\?)\s+\(\s*(?:(\d+\.\d+)\s*ms)?\s*\):\s+(?:.*?/)?(\d+)\s+\.\.\. \[continued\]: (\w+)\(\)\)\s+=\s+(\S+)\s*(.*)$')
+    argument = re.compile(r'(\w+): ("(?:[^"\\]|\\.)*"|[^,]*)(?:, |$)')
+    path_arguments = frozenset(['filename', 'pathname', 'path', 'oldname', 'oldpath', 'file'])
+    # perf leaves out the arguments that are 0, the calls the parser reads by position get them back
+    argument_order = {'mmap': ['addr', 'len', 'prot', 'flags', 'fd', 'off'], 'mmap2': ['addr', 'len', 'prot', 'flags', 'fd', 'pgoff']}
+
+    def score(self, line):
+        return 3 if self.line_pattern.match(line) is not None or self.unfinished_pattern.match(line) is not None else 0
+
+    def tokenize(self, parser, line):
+        match = self.line_pattern.match(line)
+        if match is None:
+            return self.tokenize_partial(parser, line)
+        timestamp, duration, thread, syscall_command, args, retval, ret_rest = match.groups()
+        return self.call_event(parser, thread, float(timestamp) / 1000, syscall_command, args, retval, ret_rest, duration)
+
+    def call_event(self, parser, thread, timestamp, syscall_command, args, retval, ret_rest, duration):
+        values = []
+        path = None
+        arguments = self.argument.findall(args)
+        order = self.argument_order.get(syscall_command)
+        if order is not None:
+            named = dict(arguments)
+            arguments = [(name, named.get(name, 'NULL' if name == 'addr' else '0')) for name in order]
+        for name, value in arguments:
+            if value[:1] == '"':
+                value = value[1:-1]
+            if name in self.path_arguments:
+                if not values:
+                    path = value
+                value = '"' + value + '"'
+            elif value == 'CWD' and name == 'dfd':
+                value = 'AT_FDCWD'
+            elif name == 'fd' and '<' in value:
+                # "3</etc/hosts>" when perf knows the file behind the handle
+                value = value[:value.find('<')]
+            values.append(value)
+        error_text = None
+        if retval[:1] == '-' and ret_rest[:1] == 'E':
+            error_text = (retval + ' ' + ret_rest).rstrip()
+        if duration is not None:
+            duration = float(duration) / 1000
+        return self.event(parser, thread, timestamp, syscall_command, values[0] if values else '', path, ', '.join(values),
+                          retval, error_text, duration)
+
+    def tokenize_partial(self, parser, line):
+        match = self.unfinished_pattern.match(line)
+        if match is not None:
+            timestamp, thread, syscall_command, args = match.groups()
+            parser.unfinished[thread] = (float(timestamp) / 1000, syscall_command, args)
+            return None
+        match = self.continued_pattern.match(line)
+        if match is None:
+            parser.unparsed_lines += 1
+            return None
+        duration, thread, syscall_command, retval, ret_rest = match.groups()
+        start = parser.unfinished.pop(thread, None)
+        if start is None:
+            if parser.shard:
+                # the start of the call is in an earlier shard, the merge finishes it
+                parser.orphan_resumed.append((thread, line))
+                return None
+            start = (None, syscall_command, '')
+        return self.call_event(parser, thread, start[0], syscall_command, start[2], retval, ret_rest, duration)
+
+    def line_timestamp(self, line):
+        match = re.match(r'\s*(\d+\.\d+)\s+\(', line)
+        return float(match.group(1)) / 1000 if match is not None else None
+
+trace_formats = OrderedDict((k.name, k) for k in [StraceFormat(), TrussFormat(), LtraceFormat(), PerfTraceFormat()])
+# how many lines of the log are looked at to tell which tracer wrote it
+sniff_lines = 200
+
+def sniff_trace_format(lines):
+    # the format the first lines of the log look most like, strace when none of them do
+    scores = OrderedDict((name, 0) for name in trace_formats)
+    for line in lines:
+        if line.__class__ is bytes:
+            line = line.decode('utf-8', 'replace')
+        line = line.rstrip()
+        for name, trace_format in trace_formats.items():
+            scores[name] += trace_format.score(line)
+    name = max(scores, key=scores.get)
+    return trace_formats[name if scores[name] > 0 else 'strace']
+
+def log_head(logfile, lines = sniff_lines):
+    # the first lines of the log, decompressed if it is
+    with open(logfile, 'rb') as fp:
+        compression = detect_compression(fp.peek(6)[:6])
+        reader = open_compressed(fp, compression) if compression is not None else fp
+        return list(itertools.islice(reader, lines))
+
+def line_timestamp(line, trace_format):
+    # the timestamp at the start of a log line in seconds, or None
+    return trace_format.line_timestamp(line.decode('utf-8', 'replace'))
+
+def first_line_at(fp, offset, trace_format):
+    # the start and timestamp of the first stamped line starting at or after offset
+    if offset > 0:
+        fp.seek(offset - 1)
+        fp.readline()
+    else:
+        fp.seek(0)
+    while True:
+        position = fp.tell()
+        line = fp.readline()
+        if not line:
+            return position, None
+        timestamp = line_timestamp(line, trace_format)
+        if timestamp is not None:
+            return position, timestamp
+
+def find_time_offset(fp, timestamp, start, end, trace_format, after=False):
+    # binary search the byte offsets for the first line stamped at (or after) timestamp,
+    # only a line or two is read at each step
+    limit = end
+    while start < end:
+        middle = (start + end) // 2
+        position, found = first_line_at(fp, middle, trace_format)
+        if found is None or found > timestamp or (found == timestamp and not after):
+            end = middle
+        else:
+            start = position + 1
+    return min(first_line_at(fp, start, trace_format)[0], limit)
+
+def find_time_range(logfile, time_range, total_bytes, trace_format):
+    # the byte range of the log holding the lines stamped between from and to
+    with open(logfile, 'rb') as fp:
+        first_timestamp = first_line_at(fp, 0, trace_format)[1]
+        if first_timestamp is None:
+            raise ValueError('the log has no timestamps, --from and --to need strace or ltrace -ttt, -tt or -t, truss -d or perf trace')
+        from_time, to_time = time_range
+        start = 0
+        end = total_bytes
+        if from_time is not None:
+            start = find_time_offset(fp, parse_time(from_time, first_timestamp), 0, total_bytes, trace_format)
+        if to_time is not None:
+            end = find_time_offset(fp, parse_time(to_time, first_timestamp), start, total_bytes, trace_format, True)
+    return start, max(start, min(end, total_bytes))
+
+def lines_in_time_range(lines, time_range, trace_format):
+    # for pipes and compressed logs that can't be searched, skip to from and stop after to
+    from_time, to_time = time_range
+    started = from_time is None
+    for line in lines:
+        timestamp = line_timestamp(line, trace_format)
+        if timestamp is not None:
+            if from_time is not None and from_time.__class__ is str:
+                from_time = parse_time(from_time, timestamp)
+            if to_time is not None and to_time.__class__ is str:
+                to_time = parse_time(to_time, timestamp)
+            if not started:
+                if timestamp < from_time:
+                    continue
+                started = True
+            if to_time is not None and timestamp > to_time:
+                break
+        if started:
+            yield line
+
+def log_fingerprint(logfile, offset):
+    # hash the start of the log and the block just before offset, enough to tell
+    # a log that has only been appended to from a different one without reading it all
+    block = 64 * 1024
+    digest = hashlib.sha1()
+    with open(logfile, 'rb') as fp:
+        digest.update(fp.read(min(block, offset)))
+        fp.seek(max(0, offset - block))
+        digest.update(fp.read(offset - max(0, offset - block)))
+    return digest.hexdigest()
+
+def cache_directory():
+    # the caches are kept in the user's own cache directory. One next to the log could have been put
+    # there by anybody who can write to the log's directory, and unpickling it would run their code
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'PerfTraceParser')
+
+def private_stat(stat):
+    # only the user can have written it: it is theirs and nobody else can write to it
+    if not hasattr(os, 'getuid'):
+        return True
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+class CacheUnpickler(pickle.Unpickler):
+    # a cache only holds the parser's own classes and arrays, nothing else can be looked up loading one
+    def find_class(self, module, name):
+        if module in ('__main__', 'PerfTraceParser', __name__):
+            value = globals().get(name)
+            if isinstance(value, type) and value.__module__ == __name__:
+                return value
+        elif (module, name) in [('array', 'array'), ('array', '_array_reconstructor'), ('collections', 'OrderedDict')]:
+            return pickle.Unpickler.find_class(self, module, name)
+        raise pickle.UnpicklingError('{0}.{1} is not allowed in a cache'.format(module, name))
+
+class StageTimer():
+    # where the time goes, the parser methods behind each stage are swapped for timed
+    # wrappers on the instance so nothing is added to the parse when it's not on.
+    # The own time of a stage leaves out the stages it called
+    stages = [('parse_lines', 'read'), ('tokenize_line', 'tokenize'), ('parse_line', 'classify'),
+              ('get_file_instance', 'file lookup'), ('at_path', 'file lookup'),
+              ('open_anonymous_handles', 'handles'), ('update_handle', 'handles'), ('fork_fd_table', 'handles'),
+              ('release_fd_table', 'handles'), ('map_file', 'handles'),
+              ('sample_timeline', 'aggregate'), ('sample_open_handles', 'aggregate'), ('count_sequence', 'aggregate'),
+              ('merge_shard', 'aggregate'), ('load_cache', 'cache'), ('save_cache', 'cache'),
+              ('print_summary', 'report'), ('write_report', 'report')]
+
+    def __init__(self):
+        # stage -> [calls, seconds, own seconds]
+        self.totals = OrderedDict()
+        # [start, seconds in the stages called] for each timed call in progress
+        self.running = []
+        self.started = time.time()
+
+    def timed(self, stage, function):
+        totals = self.totals.setdefault(stage, [0, 0.0, 0.0])
+        running = self.running
+        clock = time.perf_counter
+        def timed_call(*args, **kwargs):
+            running.append([clock(), 0.0])
+            try:
+                return function(*args, **kwargs)
+            finally:
+                start, inner = running.pop()
+                elapsed = clock() - start
+                if running:
+                    running[-1][1] += elapsed
+                totals[0] += 1
+                totals[1] += elapsed
+                totals[2] += elapsed - inner
+        return timed_call
+
+    def attach(self, parser):
+        parser.stage_timer = self
+        for name, stage in self.stages:
+            setattr(parser, name, self.timed(stage, getattr(parser, name)))
+            if name not in parser.transient_attributes:
+                parser.transient_attributes.append(name)
+
+    def detach(self, parser):
+        # back to the plain methods, a shard has to be pickled without the wrappers
+        for name, stage in self.stages:
+            parser.__dict__.pop(name, None)
+        self.running = []
+
+    def merge(self, other):
+        for stage, (calls, seconds, own) in other.totals.items():
+            totals = self.totals.setdefault(stage, [0, 0.0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+            totals[2] += own
+
+def peak_memory():
+    # the most memory the process has had resident in MB, None where there's no resource module
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+def print_stage_timer(title, stage_timer, lines):
+    # own time per stage, the worker processes of -j are added in so it can be more than the wall time
+    wall = time.time() - stage_timer.started
+    print('{0}, {1:.3f} seconds since the start:'.format(title, wall))
+    print('{0:<14} {1:>12} {2:>12} {3:>12} {4:>8} {5:>12}'.format('stage', 'calls', 'total(s)', 'own(s)', 'own %', 'us/line'))
+    own_total = sum(k[2] for k in stage_timer.totals.values()) or 1.0
+    if own_total > wall:
+        print('(the worker processes are added in, so the stages come to more than that)')
+    for stage, (calls, seconds, own) in stage_timer.totals.items():
+        if calls:
+            print('{0:<14} {1:>12} {2:>12.3f} {3:>12.3f} {4:>7.1f}% {5:>12.3f}'.format(
+                stage, calls, seconds, own, 100.0 * own / own_total, 1000000.0 * own / lines if lines else 0.0))
+    memory = peak_memory()
+    if memory is not None:
+        print('Peak memory: {0:.1f} MB'.format(memory))
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        print('Python objects: {0:.1f} MB now, {1:.1f} MB at the peak, the biggest allocations by line:'.format(current / 1048576.0, peak / 1048576.0))
+        for statistic in tracemalloc.take_snapshot().statistics('lineno')[:10]:
+            print('  {0}'.format(statistic))
+    print('', flush=True)
+
+def parse_shard(args):
+    # runs in a worker process, the parser is pickled back to be merged
+    logfile, start, end, top_k, window, timed, event_segment, trace_format, process_roots = args
+    shard = PerfTracerParser(logfile, shard=True, top_k=top_k, window=window, trace_format=trace_format)
+    shard.process_roots = process_roots
+    shard.total_bytes = 0
+    shard.bytes_read = 0
+    shard.progress_step = 0
+    if timed:
+        StageTimer().attach(shard)
+    if event_segment is not None:
+        # the shard writes its own segment of the event store, the merge names its pending handles
+        shard.event_segment = EventSegment(event_segment)
+        shard.event_segment.create()
+    # only the first shard holds the first line of the log
+    shard.parse_lines(read_log_range(logfile, start, end), 1 if start == 0 else 2)
+    shard.sample_timeline()
+    shard.shard_end = end
+    if shard.event_segment is not None:
+        shard.event_segment.close()
+    if timed:
+        shard.stage_timer.detach(shard)
+    return shard
+
+def parse_whole_log(args):
+    # runs in a worker process, one log per process for --compare, only the results come back. What
+    # the parse printed is kept for when it fails, as the error and the line it failed on are printed
+    logfile, use_cache, top_k, window, time_range, trace_format = args
+    printed = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(printed):
+            parser = PerfTracerParser(logfile, use_cache=use_cache, top_k=top_k, window=window, time_range=time_range, trace_format=trace_format)
+            parser.parse_log_file()
+    except SystemExit:
+        return None, printed.getvalue()
+    return parser, None
+
+class TraceComparison():
+    # the same workload traced twice or more, e.g. before and after a change or on a fast and a slow
+    # host. Everything is worked out from the parsed results, the first trace is the baseline and
+    # the rows are ranked by how much they changed from it
+    def __init__(self, parsers):
+        self.parsers = parsers
+        names = [os.path.basename(k.logfile) for k in parsers]
+        # the whole path when two logs have the same name in different directories
+        self.names = [k.logfile if names.count(name) > 1 else name for k, name in zip(parsers, names)]
+
+    def totals(self, parser):
+        calls = sum(parser.syscall_commands.values())
+        errors = sum(k.errors for k in parser.pid_instances.values())
+        seconds = sum(k.total for k in parser.syscall_latency.values())
+        duration = parser.last_timestamp - parser.first_timestamp if parser.first_timestamp is not None else None
+        return OrderedDict([('lines', parser.lines), ('calls', calls), ('errors', errors),
+                            ('error_rate', 100.0 * errors / calls if calls else 0.0), ('seconds_in_calls', seconds),
+                            ('trace_seconds', duration), ('calls_per_second', calls / duration if duration else None),
+                            ('files', len(parser.associated_file_instances)), ('threads', len(parser.pid_instances)),
+                            ('bytes_read', parser.transfers.read_bytes), ('bytes_written', parser.transfers.write_bytes)])
+
+    def ranked(self, rows):
+        # rows are (key, [value per trace]), the biggest change from the first trace first, a row
+        # missing from the baseline or the last trace counts as a change from 0
+        def impact(row):
+            values = [k or 0 for k in row[1]]
+            return max(abs(k - values[0]) for k in values)
+        return sorted(rows, key=impact, reverse=True)
+
+    def command_rows(self):
+        commands = set()
+        for parser in self.parsers:
+            commands.update(parser.syscall_commands)
+        calls = [(command, [k.syscall_commands.get(command, 0) for k in self.parsers]) for command in commands]
+        seconds = [(command, [k.syscall_latency[command].total if command in k.syscall_latency else 0.0 for k in self.parsers])
+                   for command in commands if any(command in k.syscall_latency for k in self.parsers)]
+        means = dict((command, [k.syscall_latency[command].mean() if command in k.syscall_latency else None for k in self.parsers])
+                     for command in commands)
+        return self.ranked(calls), self.ranked(seconds), means
+
+    def file_rows(self):
+        # new files are in a later trace but not the first, gone files are in the first but not the last
+        files = [dict((k.filename, k) for k in parser.associated_file_instances) for parser in self.parsers]
+        timed = any(parser.syscall_latency for parser in self.parsers)
+        def value(fileinstance):
+            if fileinstance is None:
+                return None
+            return fileinstance.latency.total if timed else fileinstance.calls()
+        names = set()
+        for by_name in files:
+            names.update(by_name)
+        new, gone, changed = [], [], []
+        for name in names:
+            row = (name, [value(by_name.get(name)) for by_name in files])
+            if name not in files[0]:
+                new.append(row)
+            elif name not in files[-1]:
+                gone.append(row)
+            else:
+                changed.append(row)
+        return 'seconds' if timed else 'calls', self.ranked(new), self.ranked(gone), self.ranked(changed)
+
+    def error_rows(self):
+        # errors per 1000 calls so traces of different lengths can be compared
+        totals = [self.totals(k) for k in self.parsers]
+        errors = set()
+        for parser in self.parsers:
+            errors.update(parser.syscall_errors.keys())
+        rows = []
+        for error in errors:
+            rows.append((error, [1000.0 * parser.syscall_errors.get(error, 0) / total['calls'] if total['calls'] else 0.0
+                                 for parser, total in zip(self.parsers, totals)]))
+        return self.ranked(rows)
+
+    def print_rows(self, title, rows, output_limit, value_format=None, top=True):
+        # a column per trace, then the change from the first to the last, whole numbers
+        # are printed as they are and the rest to value_format
+        def format_value(value):
+            if value is None:
+                return '-'
+            if isinstance(value, int) or value_format is None and float(value).is_integer():
+                return '{0}'.format(value)
+            return (value_format or '{0:.6f}').format(value)
+        print('Top {0} {1}:'.format(output_limit, title) if top else '{0}:'.format(title))
+        width = max([14] + [len(k) + 1 for k in self.names])
+        print('{0:<40} {1} {2:>{3}} {4:>9}'.format('', ' '.join('{0:>{1}}'.format(k[-width:], width) for k in self.names), 'change', width, '%'))
+        for key, values in rows[:output_limit]:
+            first = values[0] or 0
+            change = (values[-1] or 0) - first
+            percent = '{0:+.1f}%'.format(100.0 * change / first) if first else 'new' if values[-1] else ''
+            change = format_value(change)
+            print('{0:<40} {1} {2:>{3}} {4:>9}'.format(str(key), ' '.join('{0:>{1}}'.format(format_value(k), width) for k in values),
+                  change if change[:1] == '-' else '+' + change, width, percent))
+
+    def print_report(self, output_limit = 10):
+        print('\n++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++\n')
+        totals = [self.totals(k) for k in self.parsers]
+        rows = [(name, [k[name] for k in totals]) for name in totals[0]]
+        self.print_rows('Totals', rows, len(rows), top=False)
+        print('------------------------------')
+        calls, seconds, means = self.command_rows()
+        self.print_rows('commands by the change in calls', calls, output_limit, '{0}')
+        print('------------------------------')
+        if seconds:
+            self.print_rows('commands by the change in time spent (s)', seconds, output_limit, '{0:.6f}')
+            print('------------------------------')
+            self.print_rows('commands by the change in mean latency (s)', self.ranked(list(means.items())), output_limit, '{0:.6f}')
+            print('------------------------------')
+        field, new, gone, changed = self.file_rows()
+        value_format = '{0:.6f}' if field == 'seconds' else '{0}'
+        self.print_rows('new files, by {0}'.format(field), new, output_limit, value_format)
+        print('------------------------------')
+        self.print_rows('files gone, by {0}'.format(field), gone, output_limit, value_format)
+        print('------------------------------')
+        self.print_rows('files by the change in {0}'.format(field), changed, output_limit, value_format)
+        print('------------------------------')
+        self.print_rows('errors by the change in errors per 1000 calls', self.error_rows(), output_limit, '{0:.3f}')
+        print('\n++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++\n', flush=True)
+
+    def report_records(self):
+        # the rows above in full, one record per row with a value per trace
+        def record(table, key, values, field):
+            fields = OrderedDict([('table', table), ('key', key)])
+            for name, value in zip(self.names, values):
+                fields['{0}:{1}'.format(field, name)] = value
+            first = values[0] or 0
+            fields['change'] = (values[-1] or 0) - first
+            return fields
+        yield {'table': 'compare_traces', 'key': 'traces', 'logs': [k.logfile for k in self.parsers]}
+        totals = [self.totals(k) for k in self.parsers]
+        for name in totals[0]:
+            yield record('compare_totals', name, [k[name] for k in totals], 'value')
+        calls, seconds, means = self.command_rows()
+        for key, values in calls:
+            yield record('compare_commands', key, values, 'calls')
+        for key, values in seconds:
+            yield record('compare_command_seconds', key, values, 'seconds')
+        field, new, gone, changed = self.file_rows()
+        for table, rows in [('compare_new_files', new), ('compare_gone_files', gone), ('compare_files', changed)]:
+            for key, values in rows:
+                yield record(table, key, values, field)
+        for key, values in self.error_rows():
+            yield record('compare_errors', key, values, 'per_1000_calls')
+
+def compare_log_files(logfiles, jobs, use_cache, top_k, window, time_range, output, report_format, output_limit = 10, trace_format = None):
+    # parse every log at the same time, one process each, then compare what came back
+    print('Comparing {0}, the first is the baseline'.format(', '.join(logfiles)), file=sys.stderr if output == '-' else sys.stdout)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(logfiles), jobs)) as executor:
+        results = list(executor.map(parse_whole_log, [(logfile, use_cache, top_k, window, time_range, trace_format) for logfile in logfiles]))
+    failed = False
+    for logfile, (parser, printed) in zip(logfiles, results):
+        if parser is None:
+            # the progress bar is drawn over itself, only where it got to is shown
+            print('Could not parse {0}:'.format(logfile), file=sys.stderr)
+            for line in printed.splitlines():
+                print(line.rpartition('\r')[2], file=sys.stderr)
+            failed = True
+    if failed:
+        sys.exit(1)
+    parsers = [parser for parser, printed in results]
+    comparison = TraceComparison(parsers)
+    if output is None:
+        comparison.print_report(output_limit)
+    elif output == '-':
+        try:
+            write_records(comparison.report_records(), sys.stdout, report_format)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    else:
+        with open(output, 'w', newline='') as fp:
+            write_records(comparison.report_records(), fp, report_format)
+        print('Report written to {0}'.format(output))
+
+class EventSegment():
+    # the calls from one run of the parser (or one shard of a -j run) with a file per column, the strings
+    # are interned per segment and the columns hold their ids, so a scan never touches a string
+    columns = [('command', 'H'), ('path', 'I'), ('error', 'I'), ('pid', 'i'), ('thread', 'I'), ('fd', 'i'),
+               ('timestamp', 'd'), ('duration', 'd'), ('retval', 'q')]
+    string_columns = ['command', 'path', 'error', 'thread']
+    typecodes = dict(columns)
+    # what is written for a return value that isn't a number, e.g. "?" or a mapped address
+    no_retval = -2 ** 63
+    flush_events = 65536
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.events = 0
+        # the events not written yet, a tuple each, turned into columns when they are
+        self.rows = None
+        # column -> [string, ...] and column -> {string: id}
+        self.strings = None
+        self.ids = None
+        # pid text -> number
+        self.pids = None
+        # path id -> (pid, handle) for handles a shard used before seeing them opened, see resolve_pending
+        self.pending = dict()
+
+    def create(self):
+        if os.path.isdir(self.directory):
+            # left over from a run that never finished
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        self.rows = []
+        self.pids = dict()
+        self.strings = dict((name, ['']) for name in self.string_columns)
+        self.ids = dict((name, {'': 0}) for name in self.string_columns)
+
+    def intern(self, column, text):
+        ids = self.ids[column]
+        string_id = ids.get(text)
+        if string_id is None:
+            string_id = ids[text] = len(ids)
+            self.strings[column].append(text)
+        return string_id
+
+    def pending_path(self, pid, handle):
+        # a stand in for the name of a handle opened in an earlier shard, the merge fills it in
+        path_id = self.intern('path', '\0{0} {1}'.format(pid, handle))
+        self.pending[path_id] = (pid, handle)
+        return path_id
+
+    def add(self, command, path_id, error, pid, thread, fd, timestamp, duration, retval):
+        # in the order of columns, this is once per line so the lookups are done inline
+        ids = self.ids
+        command_id = ids['command'].get(command)
+        if command_id is None:
+            command_id = self.intern('command', command)
+        error_id = 0
+        if error is not None:
+            error_id = ids['error'].get(error)
+            if error_id is None:
+                error_id = self.intern('error', error)
+        thread_id = ids['thread'].get(thread)
+        if thread_id is None:
+            thread_id = self.intern('thread', thread)
+        pid_number = self.pids.get(pid)
+        if pid_number is None:
+            pid_number = self.pids[pid] = int(pid) if pid.isdigit() else -1
+        if retval is None:
+            retval = self.no_retval
+        elif retval.isdigit() or (retval[:1] == '-' and retval[1:].isdigit()):
+            retval = int(retval)
+            if not -2 ** 63 < retval < 2 ** 63:
+                retval = self.no_retval
+        else:
+            retval = self.no_retval
+        self.rows.append((command_id, path_id, error_id, pid_number, thread_id, fd, math.nan if timestamp is None else timestamp,
+                          math.nan if duration is None else duration, retval))
+        if len(self.rows) >= self.flush_events:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        for (name, code), values in zip(self.columns, zip(*self.rows)):
+            with open(os.path.join(self.directory, name), 'ab') as fp:
+                array.array(code, values).tofile(fp)
+        self.events += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        # write what is left and the string tables, only the pending handles are kept after this
+        # so a shard pickles back small
+        self.flush()
+        self.save_meta()
+        self.rows = None
+        self.strings = None
+        self.ids = None
+        self.pids = None
+
+    def save_meta(self):
+        meta = {'events': self.events, 'strings': self.strings,
+                'pending': [[path_id, pid, handle] for path_id, (pid, handle) in self.pending.items()]}
+        temp_path = os.path.join(self.directory, 'meta.json.tmp')
+        with open(temp_path, 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(temp_path, os.path.join(self.directory, 'meta.json'))
+
+    def load(self):
+        with open(os.path.join(self.directory, 'meta.json')) as fp:
+            meta = json.load(fp)
+        self.events = meta['events']
+        self.strings = meta['strings']
+        self.pending = dict((path_id, (pid, handle)) for path_id, pid, handle in meta['pending'])
+        return self
+
+    def resolve_pending(self, lookup):
+        # name the handles the shard couldn't, lookup(pid, handle) is what the earlier shards left them pointing at
+        if not self.pending:
+            return
+        self.load()
+        for path_id, (pid, handle) in self.pending.items():
+            self.strings['path'][path_id] = lookup(pid, handle) or ''
+        self.pending = dict()
+        self.save_meta()
+        self.strings = None
+
+    def column(self, name):
+        # the column straight from the page cache, nothing is read until it is scanned
+        path = os.path.join(self.directory, name)
+        if self.events == 0 or os.path.getsize(path) == 0:
+            return memoryview(array.array(self.typecodes[name]))
+        with open(path, 'rb') as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast(self.typecodes[name])
+
+class EventStore():
+    # the parsed calls kept on disk for --query and [E], a directory of segments and a store.json saying
+    # how far into the log they go, a log that has grown gets a new segment like the cache is appended to
+    version = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        # bytes of the log the segments cover, -1 when they can't be appended to (a time range, a stopped parse)
+        self.offset = -1
+        self.fingerprint = None
+        self.first_timestamp = None
+        self.segment_names = []
+        self.new_segments = []
+
+    def store_path(self):
+        return os.path.join(self.directory, 'store.json')
+
+    def open(self, logfile):
+        # read store.json, the events only count if they came from this log
+        try:
+            with open(self.store_path()) as fp:
+                meta = json.load(fp)
+            if meta.get('version') != self.version:
+                return self
+            offset = meta['offset']
+            if logfile != '-' and offset >= 0:
+                if os.stat(logfile).st_size < offset or meta['fingerprint'] != log_fingerprint(logfile, offset):
+                    return self
+            self.offset = offset
+            self.fingerprint = meta['fingerprint']
+            self.first_timestamp = meta['first_timestamp']
+            self.segment_names = meta['segments']
+        except (OSError, ValueError, KeyError) as error:
+            if not isinstance(error, FileNotFoundError):
+                print("Ignoring the events in {0}: {1}".format(self.directory, repr(error)))
+        return self
+
+    def current(self, logfile):
+        # the events cover the whole log as it is now
+        if self.offset < 0 or logfile == '-':
+            return False
+        return self.offset == os.stat(logfile).st_size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        self.offset = -1
+        self.first_timestamp = None
+        self.segment_names = []
+
+    def new_segment(self, name):
+        self.new_segments.append(name)
+        segment = EventSegment(os.path.join(self.directory, name))
+        segment.create()
+        return segment
+
+    def save(self, logfile, offset, first_timestamp):
+        # a shard that never finished left no meta.json
+        self.segment_names = self.segment_names + [k for k in self.new_segments if os.path.exists(os.path.join(self.directory, k, 'meta.json'))]
+        self.new_segments = []
+        self.offset = offset
+        self.fingerprint = log_fingerprint(logfile, offset) if offset >= 0 and logfile != '-' else None
+        if self.first_timestamp is None or (first_timestamp is not None and first_timestamp < self.first_timestamp):
+            self.first_timestamp = first_timestamp
+        meta = {'version': self.version, 'offset': self.offset, 'fingerprint': self.fingerprint,
+                'first_timestamp': self.first_timestamp, 'segments': self.segment_names}
+        try:
+            temp_path = self.store_path() + '.tmp'
+            with open(temp_path, 'w') as fp:
+                json.dump(meta, fp)
+            os.replace(temp_path, self.store_path())
+        except OSError as error:
+            print("Could not write the events to {0}: {1}".format(self.directory, repr(error)))
+
+    def segments(self):
+        return [EventSegment(os.path.join(self.directory, name)).load() for name in self.segment_names]
+
+    def events(self):
+        return sum(k.events for k in self.segments())
+
+def timestamp_second(timestamp):
+    return -1 if timestamp != timestamp else int(math.floor(timestamp))
+
+class EventQuery():
+    # "COLUMN[,COLUMN] [where COLUMN=VALUE [and ...]] [top N] [by calls|errors|seconds|mean|max]" over an EventStore,
+    # e.g. "path where command=read duration>0.01 top 20 by seconds" or "second,command where error=*ENOENT*"
+    # the filters and group by run vectorised with numpy when it is installed, otherwise as scans of the columns
+    group_columns = ['command', 'path', 'dir', 'error', 'thread', 'pid', 'fd', 'retval', 'second']
+    filter_columns = group_columns + ['timestamp', 'duration']
+    orders = ['calls', 'errors', 'seconds', 'mean', 'max']
+    condition = re.compile(r'(\w+)\s*(<=|>=|!=|=|<|>)\s*(.*)$')
+    operators = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '>': operator.gt, '<=': operator.le, '>=': operator.ge}
+    # the bound method of the value that gives the same answer with the column value as its argument
+    reflected = {'=': '__eq__', '!=': '__ne__', '<': '__gt__', '>': '__lt__', '<=': '__ge__', '>=': '__le__'}
+
+    def __init__(self, text, output_limit = 10, first_timestamp = None):
+        self.text = text
+        self.group = []
+        self.conditions = []
+        self.top = output_limit
+        self.order = None
+        try:
+            words = shlex.split(text)
+        except ValueError as error:
+            raise ValueError('can\'t split the query: {0}'.format(error))
+        keyword = 'group'
+        for word in words:
+            if word.lower() in ('where', 'top', 'by'):
+                keyword = word.lower()
+            elif keyword == 'group':
+                self.group += [k for k in word.split(',') if k]
+            elif keyword == 'where':
+                if word.lower() != 'and':
+                    self.conditions.append(self.parse_condition(word, first_timestamp))
+            elif keyword == 'top':
+                if not word.isdigit():
+                    raise ValueError('top takes a number, not "{0}"'.format(word))
+                self.top = int(word)
+            elif keyword == 'by':
+                if word not in self.orders:
+                    raise ValueError('"{0}" can\'t be ordered by, use one of {1}'.format(word, ', '.join(self.orders)))
+                self.order = word
+        if not self.group:
+            self.group = ['command']
+        for column in self.group:
+            if column not in self.group_columns:
+                raise ValueError('"{0}" can\'t be grouped by, use one of {1}'.format(column, ', '.join(self.group_columns)))
+
+    def parse_condition(self, word, first_timestamp):
+        match = self.condition.match(word)
+        if match is None:
+            raise ValueError('"{0}" isn\'t a filter like command=read or duration>0.01'.format(word))
+        column, op, value = match.groups()
+        if column not in self.filter_columns:
+            raise ValueError('"{0}" can\'t be filtered on, use one of {1}'.format(column, ', '.join(self.filter_columns)))
+        if column in EventSegment.string_columns or column == 'dir':
+            if op not in ('=', '!='):
+                raise ValueError('{0} can only be compared with = or !='.format(column))
+            return (column, op, value)
+        if column in ('second', 'timestamp'):
+            # like --from and --to, seconds as in the log, "+seconds" from the start of it or a time of day
+            column = 'timestamp'
+            value = parse_time(value, first_timestamp or 0)
+        else:
+            try:
+                value = float(value) if column == 'duration' else int(value)
+            except ValueError:
+                raise ValueError('{0} is compared with a number, not "{1}"'.format(column, value))
+        return (column, op, value)
+
+    def matching_ids(self, strings, value):
+        # the ids of the strings equal to the value, or matching it when it is a glob. "pipe:[7,8]"
+        # is equal to itself, even though as a glob its brackets would be a set of characters
+        if FilenameIndex.glob_chars.search(value) is None:
+            return set(k for k in range(len(strings)) if strings[k] == value)
+        return set(k for k in range(len(strings)) if strings[k] == value or fnmatch.fnmatchcase(strings[k], value))
+
+    def directories(self, segment):
+        # path id -> directory id, and the directory names
+        names = dict()
+        path_dirs = []
+        for path in segment.strings['path']:
+            name = parent_directory(path) if path else ''
+            path_dirs.append(names.setdefault(name, len(names)))
+        return path_dirs, list(names)
+
+    def condition_ids(self, segment, column, value):
+        if column == 'dir':
+            path_dirs, names = self.directories(segment)
+            dir_ids = self.matching_ids(names, value)
+            return 'path', set(k for k in range(len(path_dirs)) if path_dirs[k] in dir_ids)
+        return column, self.matching_ids(segment.strings[column], value)
+
+    def key_names(self, segment):
+        # column -> function turning its key values back into what is shown
+        names = dict()
+        for column in self.group:
+            if column in EventSegment.string_columns:
+                names[column] = segment.strings[column].__getitem__
+            elif column == 'dir':
+                names[column] = self.directories(segment)[1].__getitem__
+            elif column == 'retval':
+                names[column] = lambda k: None if k == EventSegment.no_retval else k
+            elif column in ('pid', 'second', 'fd'):
+                names[column] = lambda k: None if k == -1 else k
+        return names
+
+    def scan(self, segment):
+        # (key, calls, errors, timed calls, seconds, max) for each group in the segment
+        if segment.events == 0:
+            return []
+        try:
+            import numpy
+        except ImportError:
+            return self.scan_columns(segment)
+        return self.scan_numpy(segment, numpy)
+
+    def scan_numpy(self, segment, numpy):
+        columns = dict()
+        def column(name):
+            if name not in columns:
+                columns[name] = numpy.frombuffer(segment.column(name), dtype=segment.typecodes[name])
+            return columns[name]
+        mask = numpy.ones(segment.events, dtype=bool)
+        for name, op, value in self.conditions:
+            if name in EventSegment.string_columns or name == 'dir':
+                name, ids = self.condition_ids(segment, name, value)
+                selected = numpy.isin(column(name), numpy.fromiter(ids, dtype=numpy.int64, count=len(ids)))
+                mask &= selected if op == '=' else ~selected
+            else:
+                mask &= self.operators[op](column(name), value)
+                if name == 'retval':
+                    mask &= column(name) != EventSegment.no_retval
+        keys = []
+        for name in self.group:
+            if name == 'dir':
+                path_dirs = numpy.array(self.directories(segment)[0], dtype=numpy.int64)
+                keys.append(path_dirs[column('path')[mask]])
+            elif name == 'second':
+                timestamps = numpy.floor(column('timestamp')[mask])
+                keys.append(numpy.where(numpy.isnan(timestamps), -1, timestamps).astype(numpy.int64))
+            else:
+                keys.append(column(name)[mask].astype(numpy.int64))
+        if len(keys) == 1:
+            unique, inverse = numpy.unique(keys[0], return_inverse=True)
+            unique = unique.reshape(-1, 1)
+        else:
+            unique, inverse = numpy.unique(numpy.stack(keys, axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        groups = len(unique)
+        calls = numpy.bincount(inverse, minlength=groups)
+        errors = numpy.bincount(inverse, weights=column('error')[mask] != 0, minlength=groups)
+        durations = column('duration')[mask]
+        timed = ~numpy.isnan(durations)
+        timed_groups = inverse[timed]
+        timed_calls = numpy.bincount(timed_groups, minlength=groups)
+        seconds = numpy.bincount(timed_groups, weights=durations[timed], minlength=groups)
+        maxes = numpy.zeros(groups)
+        numpy.maximum.at(maxes, timed_groups, durations[timed])
+        return zip(map(tuple, unique.tolist()), calls.tolist(), errors.astype(numpy.int64).tolist(), timed_calls.tolist(),
+                   seconds.tolist(), maxes.tolist())
+
+    def scan_columns(self, segment):
+        # without numpy, the filters are mapped over the columns with C level predicates
+        # where they can be and only the selected events go through the loop
+        mask = None
+        for name, op, value in self.conditions:
+            if name in EventSegment.string_columns or name == 'dir':
+                name, ids = self.condition_ids(segment, name, value)
+                selected = map(ids.__contains__, segment.column(name))
+                if op == '!=':
+                    selected = map(operator.not_, selected)
+            else:
+                selected = map(getattr(value, self.reflected[op]), segment.column(name))
+                if name == 'retval':
+                    selected = map(operator.and_, selected, map(EventSegment.no_retval.__ne__, segment.column(name)))
+            selected = bytearray(selected)
+            mask = selected if mask is None else bytearray(map(operator.and_, mask, selected))
+        keys = []
+        for name in self.group:
+            if name == 'dir':
+                keys.append(map(self.directories(segment)[0].__getitem__, segment.column('path')))
+            elif name == 'second':
+                keys.append(map(timestamp_second, segment.column('timestamp')))
+            else:
+                keys.append(segment.column(name))
+        events = zip(zip(*keys), segment.column('error'), segment.column('duration'))
+        if mask is not None:
+            events = itertools.compress(events, mask)
+        groups = dict()
+        for key, error, duration in events:
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0, 0, 0.0, 0.0]
+            group[0] += 1
+            if error:
+                group[1] += 1
+            if duration == duration:
+                group[2] += 1
+                group[3] += duration
+                if duration > group[4]:
+                    group[4] = duration
+        # in key order like numpy.unique gives them, so ties are ranked the same with or without it
+        return [(key,) + tuple(group) for key, group in sorted(groups.items())]
+
+    def run(self, store):
+        # (columns, rows) with the groups of every segment added up by name, the top ones first
+        totals = dict()
+        for segment in store.segments():
+            names = self.key_names(segment)
+            for key, calls, errors, timed_calls, seconds, longest in self.scan(segment):
+                key = tuple(names[column](value) if column in names else value for column, value in zip(self.group, key))
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [calls, errors, timed_calls, seconds, longest]
+                else:
+                    total[0] += calls
+                    total[1] += errors
+                    total[2] += timed_calls
+                    total[3] += seconds
+                    total[4] = max(total[4], longest)
+        rows = [key + (calls, errors, seconds, seconds / timed_calls if timed_calls else 0.0, longest)
+                for key, (calls, errors, timed_calls, seconds, longest) in totals.items()]
+        order = self.order
+        if order is None:
+            order = 'seconds' if any(k[-3] for k in rows) else 'calls'
+        index = len(self.group) + self.orders.index(order)
+        return self.group + self.orders, heapq.nlargest(self.top, rows, key=operator.itemgetter(index))
+
+def print_query(title, columns, rows):
+    print('{0}:'.format(title))
+    keys = len(columns) - len(EventQuery.orders)
+    specs = ['<{0}'.format(max([len(columns[k])] + [len(str(row[k])) for row in rows])) for k in range(keys)]
+    table = TableRenderer(list(zip(columns, specs + ['>10', '>8', '>12.6f', '>12.6f', '>12.6f'])))
+    table.write_header()
+    table.write_rows([str(k) for k in row[:keys]] + list(row[keys:]) for row in rows)
+    if not rows:
+        print('no events match')
+
 class PerfTracerParser():
     def print_usage(self):
         print('')
     
-    def __init__(self, logfile):
+    def __init__(self, logfile, jobs=1, shard=False, use_cache=False, follow=None, output=None, report_format='jsonl', top_k=None,
+                 window=1.0, time_range=None, events=None, query=None, trace_format=None, checkpoint=None, resume=False):
         self.lines = 0
+        self.jobs = jobs
+        # keep only about this many files, handles, memory addresses and errors, None keeps them all
+        self.top_k = top_k
+        # headless mode, write the report here ("-" for stdout) and exit instead of opening the menu
+        self.output = output
+        self.report_format = report_format
+        # seconds between redraws when following a growing log, None to parse it once
+        self.follow = follow
+        # keep the parsed state in a cache next to the log so it isn't parsed again,
+        # a time range is only part of the log so it isn't cached
+        self.use_cache = use_cache and time_range is None
+        # logs smaller than two of these are not worth spreading over processes
+        self.min_shard_bytes = 4 * 1024 * 1024
+        # a checkpoint can only be taken between shards, so when they are being taken a shard is at most this big
+        self.checkpoint_shard_bytes = 1024 * 1024 * 1024
+        # a shard is one byte range of the log parsed in a worker process
+        self.shard = shard
+        # no progress output from shards or while following
+        self.quiet = shard
+        self.shard_end = 0
+        # handle -> {command: count} for handles a shard used before seeing where they came from
+        self.pending_handles = dict()
+        # (pid, handle) -> LatencyStats of the calls held in pending_handles
+        self.pending_latency = dict()
+        # (pid, handle) -> ByteStats of the reads and writes held in pending_handles
+        self.pending_transfers = dict()
+        # (child, parent, shared) for every fork/clone a shard saw, replayed on merge
+        self.fd_table_links = []
+        # (pid, command) for every exit a shard saw
+        self.released_pids = []
         self.fd_limit = 1024
+        # commands whose return value is a new pid
+        self.fork_commands = ['fork', 'vfork', 'clone', 'clone3', 'kfork']
+        self.exit_commands = ['exit', 'exit_group', '_exit']
+        # commands that take a path and return a new handle
+        self.open_commands = ['open', 'open64', 'openat', 'openat2', 'creat', 'kopen', 'openx', 'kopenat', 'memfd_create']
+        # commands that take a directory handle and a path relative to it
+        self.at_commands = ['openat', 'openat2', 'kopenat', 'newfstatat', 'fstatat', 'fstatat64', 'statx',
+                            'faccessat', 'faccessat2', 'fchmodat', 'fchownat', 'futimesat', 'utimensat',
+                            'unlinkat', 'mkdirat', 'mknodat', 'readlinkat', 'renameat', 'renameat2',
+                            'linkat', 'execveat', 'name_to_handle_at']
+        # commands that return new handles without having a path
+        self.anonymous_handle_commands = ['socket', 'socketpair', 'pipe', 'pipe2', 'epoll_create', 'epoll_create1',
+                                          'eventfd', 'eventfd2', 'timerfd_create', 'signalfd', 'signalfd4',
+                                          'inotify_init', 'inotify_init1']
+        # commands on an existing handle that close it or copy it to a new one
+        self.handle_lifecycle_commands = ['close', 'dup', 'dup2', 'dup3', 'fcntl', 'fcntl64', 'kfcntl', 'accept', 'accept4', 'naccept']
+        # commands that return how many bytes they moved, doing it a few bytes at a time is slow
+        self.transfer_commands = frozenset(['read', 'write', 'pread', 'pwrite', 'pread64', 'pwrite64', 'readv', 'writev',
+                                            'preadv', 'pwritev', 'preadv2', 'pwritev2', 'recv', 'recvfrom', 'recvmsg',
+                                            'send', 'sendto', 'sendmsg', 'kread', 'kwrite', 'kreadv', 'kwritev'])
+        self.write_commands = frozenset(['write', 'pwrite', 'pwrite64', 'writev', 'pwritev', 'pwritev2',
+                                         'send', 'sendto', 'sendmsg', 'kwrite', 'kwritev'])
+        self.small_io_bytes = 64
+        # commands that map part of a file, the length is the second argument and the handle the fifth
+        self.map_commands = ['mmap', 'mmap2', 'mmap64']
+        # commands that look a path up, doing it over and over is wasted time
+        self.stat_commands = ['stat', 'stat64', 'lstat', 'lstat64', 'fstat', 'fstat64', 'newfstatat', 'fstatat',
+                              'fstatat64', 'statx', 'kstat', 'access', 'faccessat', 'faccessat2', 'accessx']
         self.early_stop = False
         self.output_limit = 10
         self.descending_direction = True
         self.filename_filter = ''
+        # the last 'A' view, see filtered_files and top_files
+        self.filtered_view = None
+        self.top_files_view = None
+        self.directories_view = None
+        # built on the first filter, see filtered_files
+        self.filename_index = None
         self.associated_file_instances = []
-        self.file_commands = []
-        self.handles_and_files = dict()
+        # filename -> FileInstance, so lookups don't scan the list above
+        self.file_instance_index = dict()
+        self.file_commands = FileCommands()
+        # pid -> FdTable, threads that share their handles share the same table
+        self.fd_tables = dict()
+        # the table of the traced process, every pid that wasn't seen forked is one of its threads
+        self.default_fd_table = FdTable()
+        # the one a shard started with, later ones are processes that started in it
+        self.first_fd_table = self.default_fd_table
+        # pid -> the pid forked before the shard that it belongs to, and that pid -> its FdTable, see shard_process_roots
+        self.process_roots = dict()
+        self.process_tables = dict()
+        # handles open across all processes, sampled every fd_sample_lines lines
+        self.open_handles = 0
+        self.fd_samples = []
+        self.fd_sample_lines = 1000
+        self.next_fd_sample = 0
+        self.max_fd_samples = 512
+        # thread (pid or pid/lwp) -> PidInstance
+        self.pid_instances = dict()
         self.syscall_commands = dict()
         self.syscall_files = dict()
         self.syscall_semaphores = dict()
@@ -237,27 +2553,75 @@ class PerfTracerParser():
         self.syscall_empty = dict()
         self.syscall_errors = dict()
         self.syscall_unknown = dict()
+        # every read and write, and handle -> bytes read and written through it
+        self.transfers = ByteStats()
+        self.handle_bytes = dict()
+        # path -> calls that failed with ENOENT, programs that look for the same missing file again and again
+        self.missing_paths = dict()
+        if self.top_k is not None:
+            # these can have a key per file, address or errno text, so they are bounded
+            self.syscall_files = TopCounts(self.top_k)
+            self.syscall_handles = TopCounts(self.top_k)
+            self.syscall_memaddresses = TopCounts(self.top_k)
+            self.syscall_errors = TopCounts(self.top_k)
+            self.missing_paths = TopCounts(self.top_k)
+            self.handle_bytes = TopCounts(self.top_k)
+        # (command, command, command) -> times a thread made those calls in a row, once there are
+        # max_call_sequences of them the rarer half is dropped so the memory stays bounded
+        self.call_sequences = dict()
+        self.max_call_sequences = 4096
+        # command -> LatencyStats, filled from the <seconds> suffix strace -T adds
+        self.syscall_latency = dict()
+        # thread -> the start of a strace call that is <unfinished ...>, prefix and all
+        self.unfinished = dict()
+        # (thread, line) for resumed calls a shard saw without their start, finished on merge
+        self.orphan_resumed = []
+        # lines that are neither a system call nor something strace or truss is known to print
+        self.unparsed_lines = 0
+        # calls per window of this many seconds, from the timestamps
+        self.window = window
+        self.timeline = Timeline(window)
+        # (from, to) as given to --from and --to, only the lines stamped in between are parsed
+        self.time_range = time_range
+        # the span of the -ttt (or truss -d) timestamps seen
+        self.first_timestamp = None
+        self.last_timestamp = None
         self.logfile = logfile
-        print('Log file is: \'{0}\''.format(self.logfile))
+        # gzip, bz2, xz or zstd when the log is compressed, and the compressed file underneath
+        self.compression = None
+        self.compressed_fp = None
+        if not self.shard and self.output != '-':
+            print('Log file is: \'{0}\''.format(self.logfile))
         self.print_format = PrintFormat()
+        # the TraceFormat of the tracer that wrote the log, worked out from the first lines unless it is given
+        self.trace_format = trace_formats[trace_format] if trace_format is not None else None
+        # a StageTimer when the stages are being timed, see debug
+        self.stage_timer = None
+        # directory to keep every call in for ad hoc queries, see EventStore, and the query to run on it
+        self.events = events
+        self.query = query
+        self.event_store = None
+        # the EventSegment the calls are written to while parsing
+        self.event_segment = None
+        # seconds between the checkpoints saved in the cache while parsing, None saves none, see save_checkpoint
+        self.checkpoint = checkpoint
+        # carry on from the checkpoint a stopped parse left in the cache rather than parsing the log again
+        self.resume = resume
+        # when the next checkpoint is due, None when this parse can't be carried on from one
+        self.next_checkpoint = None
+        # Ctrl-C stopped the parse between two lines, so what was parsed can be saved as a checkpoint
+        self.clean_stop = False
+        # settings and per run state that are not saved in the cache
+        self.transient_attributes = ['logfile', 'jobs', 'shard', 'quiet', 'follow', 'use_cache', 'output', 'report_format', 'top_k', 'window', 'time_range', 'early_stop', 'output_limit',
+                                     'descending_direction', 'filename_filter', 'filtered_view', 'top_files_view', 'directories_view', 'filename_index', 'min_shard_bytes', 'checkpoint_shard_bytes',
+                                     'total_bytes', 'bytes_read', 'progress_step', 'next_progress',
+                                     'stage_timer', 'compression', 'compressed_fp', 'events', 'query', 'event_store', 'event_segment',
+                                     'checkpoint', 'resume', 'next_checkpoint', 'clean_stop', 'first_fd_table', 'process_roots', 'process_tables', 'transient_attributes']
         return
         
-    def sort_dicts(self):
-        self.syscall_commands = sort_dict(self.syscall_commands)
-        self.syscall_files = sort_dict(self.syscall_files)
-        self.syscall_semaphores = sort_dict(self.syscall_semaphores)
-        self.syscall_handles = sort_dict(self.syscall_handles)
-        self.syscall_memaddresses = sort_dict(self.syscall_memaddresses)
-        self.syscall_empty = sort_dict(self.syscall_empty)
-        self.syscall_errors = sort_dict(self.syscall_errors)
-        self.syscall_unknown = sort_dict(self.syscall_unknown)
-        return
-
-    def print_summary(self, sort=False):
-        if sort:
-            self.sort_dicts()
+    def print_summary(self):
         print('\n++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++\n')
-        print('Total lines parsed: {0}'.format(self.lines))
+        print('Total lines parsed: {0}{1}'.format(self.lines, ' from a {0} log'.format(self.trace_format.name) if self.trace_format is not None else ''))
         print('------------------------------')
         print_dict("commands", self.syscall_commands)
         print('------------------------------')
@@ -275,15 +2639,109 @@ class PerfTracerParser():
         print('------------------------------')
         print_dict("unknown", self.syscall_unknown)
         print('------------------------------')
-        self.key_control('O'+ list(self.syscall_commands.keys())[0])
+        if self.unparsed_lines:
+            print('Lines that could not be parsed: {0}'.format(self.unparsed_lines))
+            print('------------------------------')
+        if self.first_timestamp is not None:
+            print('Trace covers {0:.6f} seconds'.format(self.last_timestamp - self.first_timestamp))
+            print('------------------------------')
+        if self.transfers.calls() or self.transfers.mapped_bytes:
+            print('Bytes read: {0} in {1} calls, written: {2} in {3} calls, mapped: {4}'.format(
+                format_bytes(self.transfers.read_bytes), self.transfers.reads, format_bytes(self.transfers.write_bytes),
+                self.transfers.writes, format_bytes(self.transfers.mapped_bytes)))
+            print('------------------------------')
+        if len(self.pid_instances) > 1:
+            print_pids("busiest threads", self.pid_instances, self.output_limit)
+            print('------------------------------')
+            if self.syscall_latency:
+                print_pids("threads by time spent", self.pid_instances, self.output_limit, True)
+                print('------------------------------')
+        print_fd_tables("processes by open handles", self.fd_tables, self.output_limit)
+        print('------------------------------')
+        if self.syscall_latency:
+            print_latency("commands", self.syscall_latency, self.output_limit)
+            print('------------------------------')
+            print_latency("files", self.file_latency(), self.output_limit)
+            print('------------------------------')
+        for title, table, counts in self.call_patterns():
+            if counts:
+                print_dict(title, counts, self.output_limit)
+                print('------------------------------')
+        if self.syscall_commands:
+            self.key_control('O'+ max(self.syscall_commands, key=self.syscall_commands.get))
         print('\n++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++\n')
         return
 
+    def filtered_files(self):
+        # the files matching the filter, only worked out again once the
+        # filter changes or more of the log has been parsed
+        key = (self.filename_filter, self.lines, len(self.associated_file_instances))
+        if self.filtered_view is None or self.filtered_view[0] != key:
+            if self.filename_filter != '':
+                if self.filename_index is None:
+                    self.filename_index = FilenameIndex()
+                self.filename_index.update(self.associated_file_instances)
+                files = [self.associated_file_instances[file_id] for file_id in self.filename_index.search(self.filename_filter)]
+            else:
+                files = self.associated_file_instances
+            self.filtered_view = (key, files)
+        return self.filtered_view[1]
+
+    def top_files(self, files):
+        # heap select just the rows that get printed and keep them until the
+        # filter, sort field, direction or limit changes
+        global compare_field
+        key = (self.filtered_view[0], compare_field, self.descending_direction, self.output_limit)
+        if self.top_files_view is None or self.top_files_view[0] != key:
+            sort_key = file_sort_key(self.file_commands, compare_field)
+            if self.descending_direction:
+                # from the end, so ties come out in the same order a reversed sort gave
+                top = heapq.nlargest(self.output_limit, reversed(files), key=sort_key)
+            else:
+                top = heapq.nsmallest(self.output_limit, files, key=sort_key)
+            self.top_files_view = (key, top)
+        return self.top_files_view[1]
+
+    def directories(self):
+        # the matching files rolled up per directory, kept like the 'A' view
+        global compare_field
+        files = self.filtered_files()
+        key = (self.filtered_view[0], compare_field)
+        if self.directories_view is None or self.directories_view[0] != key:
+            self.directories_view = (key, directory_rollup(files, self.file_commands, compare_field))
+        return self.directories_view[1]
+
+    def call_patterns(self):
+        # the repetition that usually means time is being wasted, as (title, report table, {key: count}):
+        # the call sequences the threads repeat most, reads and writes of a few bytes, missing paths
+        # looked for again and again and paths stat'ed more than once
+        sequences = dict((' > '.join(sequence), count) for sequence, count in self.call_sequences.items() if count > 1)
+        small_io = dict()
+        stats = dict()
+        small_io_index = self.file_commands.ids.get('small_io')
+        stat_indexes = [self.file_commands.ids[command] for command in self.stat_commands if command in self.file_commands.ids]
+        for fileinstance in self.associated_file_instances:
+            counts = fileinstance.counts
+            if small_io_index is not None and small_io_index < len(counts) and counts[small_io_index]:
+                small_io[fileinstance.filename] = counts[small_io_index]
+            stat_calls = sum(counts[index] for index in stat_indexes if index < len(counts))
+            if stat_calls > 1:
+                stats[fileinstance.filename] = stat_calls
+        missing_paths = dict((path, count) for path, count in self.missing_paths.items() if count > 1)
+        return [('repeated call sequences', 'call_sequences', sequences),
+                ('files read or written {0} bytes or less at a time'.format(self.small_io_bytes), 'small_io', small_io),
+                ('missing paths looked for more than once', 'missing_paths', missing_paths),
+                ('paths stat\'ed more than once', 'repeated_stats', stats)]
+
+    def file_latency(self):
+        # filename -> LatencyStats for the files that had any timed calls
+        return dict((fileinstance.filename, fileinstance.latency) for fileinstance in self.associated_file_instances if fileinstance.latency.count)
+
     def user_input(self,prompt):
         try:
             input_chars = input(prompt)
             return input_chars
-        except (KeyboardInterrupt, SystemExit):
+        except (KeyboardInterrupt, SystemExit, EOFError):
             #Exititing
             print("Exiting")
             sys.exit(0)
@@ -305,35 +2763,46 @@ class PerfTracerParser():
                 print('New limit is -> {0}'.format(self.output_limit))
         elif chars == 'C':
             print_dict('Commands',self.syscall_commands)
+        elif chars == 'T':
+            print_latency('commands', self.syscall_latency, self.output_limit)
+            print_latency('files', self.file_latency(), self.output_limit)
+        elif chars == 'P':
+            print_pids('busiest threads', self.pid_instances, self.output_limit)
+            if self.syscall_latency:
+                print_pids('threads by time spent', self.pid_instances, self.output_limit, True)
+        elif chars == 'W':
+            print_timeline('Calls over time', self.timeline, self.output_limit)
+        elif chars == 'I':
+            print_transfers('Bytes read and written', self.transfers, [k for k in self.associated_file_instances if k.transfers is not None],
+                            self.handle_bytes, self.output_limit, self.small_io_bytes)
+        elif chars == 'N':
+            for title, table, counts in self.call_patterns():
+                print_dict(title, counts, self.output_limit)
+        elif chars == 'H':
+            print_fd_tables('processes by open handles', self.fd_tables, self.output_limit)
+            print_fd_samples('Open handles over time', self.fd_samples)
         elif chars == 'A':
             print('Associated files = {0}'.format(len(self.associated_file_instances)))
             print('output limited to => {0}'.format(self.output_limit))
             print('filename filter is set to => \'{0}\''.format(self.filename_filter))
-            print('Ordered by "{0}" in {1} order'.format('filename' if compare_field is '' else compare_field, 'descending' if self.descending_direction else 'ascending'))
-            counter = 0
-            print(FileInstance('', 0, self.print_format, self.file_commands).header())
-            if self.descending_direction:
-                output_array = reversed(sorted(self.associated_file_instances))
-            else:
-                output_array = sorted(self.associated_file_instances)
-            # loop through the array
-            for fileinstance in output_array:
-                # text filter
-                if self.filename_filter is not '':
-                    if self.filename_filter.lower() not in fileinstance.filename.lower():
-                        continue
-                counter += 1
-                if counter > self.output_limit:
-                    continue
-                else:
-                    print(fileinstance)
-            if self.filename_filter is not '':
-                print("{0} entries match the filter".format(counter))
+            print('Ordered by "{0}" in {1} order'.format('filename' if compare_field == '' else compare_field, 'descending' if self.descending_direction else 'ascending'))
+            self.print_format.compute_maxes(self.associated_file_instances, self.file_commands, (self.lines, len(self.associated_file_instances)))
+            sys.stdout.flush()
+            table = self.print_format.file_table(self.file_commands)
+            table.write_header(underline=True)
+            matching_files = self.filtered_files()
+            columns = len(self.file_commands)
+            table.write_rows(fileinstance.cells(columns) for fileinstance in self.top_files(matching_files))
+            if self.filename_filter != '':
+                print("{0} entries match the filter".format(len(matching_files)))
+        elif chars == 'D':
+            print('filename filter is set to => \'{0}\''.format(self.filename_filter))
+            print_directories('directories', self.directories(), compare_field, self.output_limit)
         elif chars[:1] == 'F':
             if chars == 'F':
                 #reset the sort, which will default to filenames
                 self.filename_filter = ''
-                print('Enter keyword to search for and filter associated files with: ')
+                print('Enter keyword to search for and filter associated files with, or a glob like /var/log/*.log: ')
                 self.key_control('F' + self.user_input(''))
             elif chars == 'F ':
                 self.filename_filter = ''
@@ -365,7 +2834,7 @@ class PerfTracerParser():
                     # has the user entered blank
                     print(chars[1:])
                     text_selection = chars[1:]                        
-                    if text_selection is '':
+                    if text_selection == '':
                         # default to filename
                         compare_field = 'filename'
                     else:
@@ -391,21 +2860,44 @@ class PerfTracerParser():
         elif chars == 'Q':
             print('BYE!')
             sys.exit(0)
+        elif chars[:1] == 'E':
+            if self.event_store is None:
+                print('No events were stored, parse the log with --events to query them')
+            elif chars == 'E':
+                print('Enter a query, columns to group by then any of "where" filters, "top" N and "by" {0}'.format('|'.join(EventQuery.orders)))
+                print('e.g. "path where command=read duration>0.01 top 20 by seconds" or "second,command where error=*ENOENT*"')
+                print('group by: {0}'.format(', '.join(EventQuery.group_columns)))
+                text = self.user_input('')
+                if text.strip():
+                    self.key_control('E' + text)
+            else:
+                result = self.query_events(chars[1:])
+                if result is not None:
+                    print_query(chars[1:], *result)
         elif chars == 'S':
-            self.print_summary(False)
+            self.print_summary()
         elif chars == 'R':
             self.descending_direction = not self.descending_direction
             print('Output direction will be ' + ('descending' if self.descending_direction is True else 'ascending')) 
-            self.print_summary(True)
+            self.print_summary()
         return
 
     def show_options(self):
         while True:
             print('============================================================')
             print('[C] Show top {0} commands'.format(self.output_limit))
+            print('[T] Show top {0} commands and files by time spent'.format(self.output_limit))
+            print('[P] Show the busiest threads')
+            print('[W] Show the calls over time and the busiest windows')
+            print('[H] Show open handles, to look for leaks')
+            print('[I] Show the bytes read and written per file and handle, and the sizes of the reads and writes')
+            print('[N] Show repeated call sequences, small reads and writes, missing paths and repeated stats')
             print('[A] Show associated files')
             print('[O] Order associated files by field')
             print('[F] Filter on filenames')
+            print('[D] Show the busiest directories')
+            if self.event_store is not None:
+                print('[E] Query the stored events, group by and filter on any column')
             print('[S] Print the summary')
             print('[R] Reverse the output direction')
             print('[L] Change output limit, currently set to "{0}"'.format(self.output_limit))
@@ -414,236 +2906,1293 @@ class PerfTracerParser():
             self.key_control(self.user_input(''))
         return
 
-    def startTimer(self):
-        self.stopwatch = time.time()
-        
-    def stopTimer(self):
-        self.stopwatch = time.time() - self.stopwatch
+    def get_file_instance(self, filename):
+        # fetch the file instance for this filename, creating it the first time it is seen
+        fileinstance = self.file_instance_index.get(filename)
+        if fileinstance is None:
+            fileinstance = FileInstance(filename, 0, self.print_format, self.file_commands)
+            self.file_instance_index[filename] = fileinstance
+            self.associated_file_instances.append(fileinstance)
+        return fileinstance
 
-    def printTimer(self):
-        print("Time taken: {0:.3} seconds".format(self.stopwatch), flush=True)
-        
-    def fileLength(self):
-        iLines = 0
-        with open(self.logfile) as fp:
-            iLines = sum(1 for _ in fp)
-        self.total_lines = iLines
+    def fileSize(self):
+        # the size is only used to estimate progress, a pipe has no size to go by
+        self.total_bytes = 0
+        if self.logfile != '-':
+            try:
+                self.total_bytes = os.stat(self.logfile).st_size
+            except OSError:
+                self.total_bytes = 0
+
+    def open_log(self):
+        # '-' reads the trace from stdin, e.g. strace ... 2>&1 | PerfTraceParser.py -
+        # the log is read as bytes so bytes_read is an exact offset into it
+        if self.logfile == '-':
+            fp = sys.stdin.buffer
+        else:
+            fp = open(self.logfile, 'rb', buffering=read_buffer_size)
+        # gzip, bz2, xz and zstd logs are decompressed on the fly
+        self.compression = detect_compression(fp.peek(6)[:6])
+        if self.compression is not None:
+            self.compressed_fp = fp
+            return open_compressed(fp, self.compression)
+        return fp
+
+    def close_log(self, fp):
+        if fp is not sys.stdin.buffer:
+            fp.close()
+        if self.compressed_fp is not None and self.compressed_fp is not sys.stdin.buffer:
+            self.compressed_fp.close()
+        self.compressed_fp = None
+
+    def show_progress(self):
+        if self.total_bytes > 0:
+            # for a compressed log go by how much of the compressed file has been read
+            position = self.compressed_fp.tell() if self.compressed_fp is not None else self.bytes_read
+            progressPerc = min(100, int((position / self.total_bytes) * 100))
+            done = int(progressPerc / 5)
+            sys.stdout.write("\r[{0}{1}] line {2}, {3}% of {4} bytes".format("="*done, " "*(20-done), self.lines, progressPerc, self.total_bytes))
+        else:
+            sys.stdout.write("\rline {0}".format(self.lines))
+        sys.stdout.flush()
 
     def parse_log_file(self):
-        global debug
-        # read the file to get line count and save in globals
-        if debug:
-            print("Checking file length")
-            self.startTimer()
-        self.fileLength()
-        if debug:
-            self.stopTimer()        
-            self.printTimer()
-        print("Parsing trace log...")
-        with open(self.logfile) as fp:            
-            for line_no, line in enumerate(fp,1):
-                if self.early_stop == True:
-                    print("stopping parsing", flush=True)
-                    break
-                found_command = False
-                progressPerc = int((self.lines / self.total_lines) * 100)
+        # no upfront pass over the file, progress is estimated from how much of it has been read
+        self.fileSize()
+        self.bytes_read = 0
+        if self.logfile != '-':
+            with open(self.logfile, 'rb') as fp:
+                self.compression = detect_compression(fp.read(6))
+        if self.events is not None:
+            self.event_store = EventStore(self.events).open(self.logfile)
+        resumed = False
+        if self.use_cache and self.logfile != '-':
+            # a cache from an earlier run covers the log up to bytes_read, with
+            # --events it has to end where the stored events do to be added to
+            header = self.load_cache(None if self.event_store is None else self.event_store.offset)
+            resumed = header is not None and header.get('checkpoint', False)
+            if self.bytes_read == self.total_bytes and self.bytes_read > 0 and not resumed:
+                print("Loaded the parsed log from {0}\n".format(self.cache_path()))
+                return
+            if self.resume and header is None:
+                print("There is no checkpoint in {0} to resume from, parsing the whole log".format(self.cache_path()))
+        if self.event_store is not None and self.bytes_read == 0:
+            self.event_store.clear()
+        if self.trace_format is None and self.logfile != '-':
+            self.trace_format = sniff_trace_format(log_head(self.logfile))
+        seekable = self.logfile != '-' and self.compression is None
+        if self.time_range is not None and seekable:
+            # seek straight to the lines in the time range rather than reading up to them
+            try:
+                self.bytes_read, self.total_bytes = find_time_range(self.logfile, self.time_range, self.total_bytes, self.trace_format)
+            except ValueError as error:
+                print('Can\'t parse a time range: {0}'.format(error))
+                sys.exit(1)
+        # report progress every 5% of the file, or every 100000 lines when reading a pipe
+        self.progress_step = self.total_bytes / 20 if self.total_bytes > 0 and self.compression is None else 0
+        self.next_progress = self.progress_step
+        if self.progress_step > 0:
+            self.next_progress = (int(self.bytes_read / self.progress_step) + 1) * self.progress_step
+        if self.time_range is not None:
+            print("Parsing the trace log from {0} to {1}...".format(self.time_range[0] or 'the start', self.time_range[1] or 'the end'))
+        elif resumed:
+            print("Resuming the parse from the checkpoint at {0} of {1} bytes...".format(self.bytes_read, self.total_bytes))
+        elif self.bytes_read > 0:
+            print("Parsing the {0} bytes added to the log since it was cached...".format(self.total_bytes - self.bytes_read))
+        else:
+            print("Parsing trace log...")
+        if self.event_store is not None:
+            # calls parsed here rather than in a shard, the resumed ones a shard couldn't finish go in it too
+            self.event_segment = self.event_store.new_segment('{0:016d}-parse'.format(self.bytes_read))
+            self.event_segment.create()
+        previous_handler = None
+        if self.checkpoint and self.use_cache and self.logfile != '-' and self.compression is None and self.event_store is None:
+            # the parse is saved every so often and when Ctrl-C stops it, --resume carries on from there
+            self.next_checkpoint = time.time() + self.checkpoint
+            previous_handler = signal.signal(signal.SIGINT, self.interrupt)
+        try:
+            if self.jobs > 1 and self.logfile != '-' and self.compression is None and self.total_bytes - self.bytes_read >= self.min_shard_bytes * 2:
+                self.parse_log_file_parallel()
+            else:
+                if self.bytes_read > 0 or (self.time_range is not None and seekable):
+                    fp = read_log_range(self.logfile, self.bytes_read, self.total_bytes)
+                else:
+                    fp = self.open_log()
+                    if self.trace_format is None:
+                        # a pipe, only what is already buffered can be looked at without reading it
+                        self.trace_format = sniff_trace_format(fp.peek(read_buffer_size).split(b'\n')[:sniff_lines])
+                lines = fp
+                if self.time_range is not None and not seekable:
+                    # pipes and compressed logs are read up to the time range
+                    lines = lines_in_time_range(fp, self.time_range, self.trace_format)
                 try:
-                    # debug the timing
-                    if debug == True:
-                        if self.lines % 1000 == 0:
-                            self.stopTimer()                        
-                            print('processed {0} lines so far in {1:.3} sseconds'.format(self.lines, self.stopwatch) +
-                                    '\nAssociated Files so far: {0}'.format(len(self.associated_file_instances)) +
-                                    '\nFiles mentioned: {0}'.format(len(self.handles_and_files)), flush=True)
-                            self.startTimer()
-                    # new way of showing progress
-                    # point = self.total_lines / 100
-                    # increment = round(self.total_lines / 20)                    
-                    # progressPerc = round((self.lines / self.total_lines) * 100,2)
-                    # if int(progressPerc)>0 and int(progressPerc) % 5 == 0:
-                       # sys.stdout.write('\r processing: <{0:=<20}>{1:2.2f}%'.format("*"*int(progressPerc/10),progressPerc))
-                       # sys.stdout.flush()
-                    line = line.rstrip()
-                    self.lines += 1
-                    if line_no == 1 and "Trace Started" in line:
-                        continue
-                    progressPerc = round((self.lines / self.total_lines) * 100)
-                    increment = self.total_lines / 20
-                    if (self.lines % int(increment) == 0) or (self.lines == self.total_lines):
-                        sys.stdout.write("\r[{0}{1}] line {2} of {3} lines = {4}%".format("="*int(self.lines/increment)," "*int((self.total_lines-self.lines)/increment), self.lines, self.total_lines, progressPerc))
-                        sys.stdout.flush()
-                    # grab the first bit of the string up till the open bracket
-                    syscall_command = line.split("(")[0]
-                    # now remove the first part of the string until the last space
-                    syscall_command = syscall_command[syscall_command.rfind(' ')+1:].strip()
-                    # what remains should be the command
-                    dict_inc_or_add(self.syscall_commands, syscall_command)
-                    found_file = 0
-                    firstparam = ""
-                    filehandle = 0
-                    # try to get a filename
-                    #grab everything after the first open bracket
+                    # the first line only gets special treatment at the start of the log
+                    self.parse_lines(lines, 1 if self.bytes_read == 0 else 2)
+                finally:
+                    self.close_log(fp)
+                if self.lines % 100000 != 0 if self.progress_step == 0 else self.next_progress <= self.total_bytes:
+                    # the last step was not reached, so bring the progress line up to date
+                    self.show_progress()
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGINT, previous_handler)
+        if self.early_stop and self.clean_stop and self.next_checkpoint is not None:
+            # saved before the last samples are taken, so carrying on from it comes to the same as a parse that never stopped
+            self.save_cache(checkpoint=True)
+            print("\nSaved a checkpoint at {0} of {1} bytes, --resume carries on from there".format(self.bytes_read, self.total_bytes))
+        self.next_checkpoint = None
+        self.sample_open_handles()
+        self.sample_timeline()
+        if self.event_store is not None:
+            self.save_events()
+        print("\nFinished parsing trace log!\n\n")
+        if self.use_cache and self.logfile != '-' and not self.early_stop:
+            self.save_cache()
+
+    def interrupt(self, signum, frame):
+        # the first Ctrl-C stops the parse at the end of the line, or the shard being merged, so it can be
+        # carried on from, a second one stops it where it is like it used to
+        if self.early_stop:
+            self.clean_stop = False
+            raise KeyboardInterrupt
+        self.early_stop = True
+        self.clean_stop = True
+
+    def save_checkpoint(self):
+        # the cache of the log up to the last line parsed, what --resume carries on from after a crash or Ctrl-C
+        self.save_cache(checkpoint=True)
+        self.next_checkpoint = time.time() + self.checkpoint
+
+    def follow_log_file(self):
+        # tail the log, or read the pipe, as it is written and redraw the top tables
+        # every self.follow seconds, only whole lines are parsed
+        self.quiet = True
+        self.fileSize()
+        self.bytes_read = 0
+        self.progress_step = 0
+        if self.use_cache and self.logfile != '-':
+            self.load_cache()
+        if self.logfile == '-':
+            fp = None
+            fd = sys.stdin.buffer.fileno()
+        else:
+            fp = open(self.logfile, 'rb')
+            fp.seek(self.bytes_read)
+            fd = fp.fileno()
+        partial_line = b''
+        start_time = time.time()
+        start_lines = self.lines
+        next_redraw = start_time
+        try:
+            while not self.early_stop:
+                wait = max(0, next_redraw - time.time())
+                if fp is None:
+                    # a pipe blocks, so only read once there is something there
+                    chunk = os.read(fd, 1024 * 1024) if select.select([fd], [], [], wait)[0] else None
+                    if chunk == b'':
+                        # the writer has gone away
+                        break
+                else:
+                    chunk = os.read(fd, 1024 * 1024)
+                    if not chunk:
+                        if os.fstat(fd).st_size < self.bytes_read + len(partial_line):
+                            # another log now, what was counted from the old one (and saved to the cache) goes
+                            print("\nThe log was truncated, following it from the start")
+                            fp.seek(0)
+                            self.reset_state()
+                            partial_line = b''
+                            start_time = time.time()
+                            start_lines = 0
+                        time.sleep(min(0.25, wait))
+                if chunk:
+                    partial_line += chunk
+                    end = partial_line.rfind(b'\n') + 1
+                    if end:
+                        self.parse_lines(partial_line[:end].splitlines(True), self.lines + 1)
+                        partial_line = partial_line[end:]
+                        if self.lines >= self.next_fd_sample:
+                            self.sample_open_handles()
+                if time.time() >= next_redraw:
+                    self.print_live_view(start_time, start_lines)
+                    next_redraw = time.time() + self.follow
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if fp is not None:
+                fp.close()
+        if partial_line and fp is None:
+            # the pipe closed without a last newline
+            self.parse_lines([partial_line], self.lines + 1)
+        self.early_stop = False
+        self.sample_open_handles()
+        self.sample_timeline()
+        self.print_live_view(start_time, start_lines)
+        print("\nStopped following the trace log\n\n")
+        if self.use_cache and fp is not None:
+            self.save_cache()
+
+    def reset_state(self):
+        # back to what a new parser starts from, the settings stay
+        fresh = PerfTracerParser(self.logfile, shard=True, top_k=self.top_k, window=self.window,
+                                 trace_format=self.trace_format.name if self.trace_format is not None else None)
+        for name, value in fresh.__dict__.items():
+            if name not in self.transient_attributes:
+                setattr(self, name, value)
+        self.bytes_read = 0
+
+    def print_live_view(self, start_time, start_lines):
+        # the whole view is built first and written in one go to keep the redraw cheap
+        elapsed = max(time.time() - start_time, 0.001)
+        output = []
+        if sys.stdout.isatty():
+            output.append('\x1b[2J\x1b[H')
+        output.append('Following \'{0}\': {1} lines, {2:.0f} lines/s over {3:.0f} seconds (Ctrl-C to stop)'.format(
+            self.logfile, self.lines, (self.lines - start_lines) / elapsed, elapsed))
+        tables = [('commands', self.syscall_commands), ('files referenced', self.syscall_files), ('errors', self.syscall_errors)]
+        for title, counts in tables:
+            output.append('------------------------------')
+            output.append('Top {0} {1}:'.format(self.output_limit, title))
+            for key, count in heapq.nlargest(self.output_limit, counts.items(), key=lambda k: k[1]):
+                output.append('{0}: {1}'.format(key, count))
+        if self.syscall_latency:
+            output.append('------------------------------')
+            latency_top = heapq.nlargest(self.output_limit, self.syscall_latency.items(), key=lambda k: k[1].total)
+            output.append(LatencyStats().header('commands by time'))
+            for key, latency in latency_top:
+                output.append(latency.summary(key))
+        if len(self.pid_instances) > 1:
+            output.append('------------------------------')
+            output.append(PidInstance('').header())
+            for pid_instance in heapq.nlargest(self.output_limit, self.pid_instances.values(), key=lambda k: k.calls):
+                output.append(str(pid_instance))
+        output.append('')
+        sys.stdout.write('\n'.join(output))
+        sys.stdout.flush()
+
+    def save_events(self):
+        # the events line up with the cache, a part of the log or a stopped parse can't be added to later
+        self.event_segment.close()
+        self.event_segment = None
+        offset = self.total_bytes if self.compression is not None else self.bytes_read
+        if self.time_range is not None or self.early_stop or self.logfile == '-':
+            offset = -1
+        self.event_store.save(self.logfile, offset, self.first_timestamp)
+        print("\n{0} events stored in {1}".format(self.event_store.events(), self.events), end='')
+
+    def query_events(self, text):
+        try:
+            query = EventQuery(text, self.output_limit, self.event_store.first_timestamp)
+        except ValueError as error:
+            print('Error, {0}'.format(error))
+            return None
+        return query.run(self.event_store)
+
+    def cache_path(self):
+        # named after the log and where it is, so logs of the same name in different directories get their own
+        logfile = os.path.abspath(self.logfile)
+        return os.path.join(cache_directory(), '{0}-{1}.ptcache'.format(
+            os.path.basename(logfile), hashlib.sha1(logfile.encode('utf-8', 'surrogateescape')).hexdigest()[:16]))
+
+    def get_state(self):
+        # everything the parse produced, leaving out settings and the state of the run itself
+        state = self.__getstate__()
+        for name in self.transient_attributes:
+            state.pop(name, None)
+        return state
+
+    def __getstate__(self):
+        # the files are pickled as columns, see pack_file_instances, and looked up by name
+        # again once they are unpacked. The cache, the checkpoints and the shards all go this way
+        state = dict(self.__dict__)
+        state['associated_file_instances'] = pack_file_instances(self.associated_file_instances)
+        del state['file_instance_index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.associated_file_instances = unpack_file_instances(state['associated_file_instances'], self.print_format, self.file_commands)
+        self.file_instance_index = dict((fileinstance.filename, fileinstance) for fileinstance in self.associated_file_instances)
+        self.timeline.touched = dict((filename, (self.file_instance_index[filename],) + touched)
+                                     for filename, touched in self.timeline.touched.items())
+
+    def load_cache(self, offset_wanted=None):
+        # restore the state saved by an earlier run if the log is the same one, or
+        # the same one with more lines appended to it, sets bytes_read to where it got to,
+        # offset_wanted only takes a cache that got to exactly there. Returns the header of the cache it loaded
+        try:
+            directory_stat = os.stat(cache_directory())
+            with open(self.cache_path(), 'rb') as fp:
+                if not private_stat(directory_stat) or not private_stat(os.fstat(fp.fileno())):
+                    print("Ignoring the cache {0}: other users can write to it".format(self.cache_path()))
+                    return
+                header = CacheUnpickler(fp).load()
+                if header.get('version') != cache_version or header.get('top_k') != self.top_k or header.get('window') != self.window:
+                    return
+                if self.trace_format is not None and header.get('trace_format') != self.trace_format.name:
+                    # parsed as another tracer's log
+                    return
+                if header.get('checkpoint', False) and not self.resume:
+                    print("{0} has a checkpoint at {1} bytes of an unfinished parse, --resume carries on from it".format(self.cache_path(), header['offset']))
+                    return
+                stat = os.stat(self.logfile)
+                offset = header['offset']
+                if offset_wanted is not None and offset != offset_wanted:
+                    return
+                if stat.st_size < offset:
+                    # the log was truncated or replaced
+                    return
+                if stat.st_size == header['size'] and stat.st_mtime != header['mtime']:
+                    # same size but rewritten
+                    return
+                if header['fingerprint'] != log_fingerprint(self.logfile, offset):
+                    return
+                if stat.st_size > offset and not header['complete']:
+                    # the last line was still being written when it was cached, start over
+                    return
+                state = CacheUnpickler(io.BytesIO(zlib.decompress(fp.read()))).load()
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError, zlib.error) as error:
+            if not isinstance(error, FileNotFoundError):
+                print("Ignoring the cache {0}: {1}".format(self.cache_path(), repr(error)))
+            return
+        self.__setstate__(state)
+        self.bytes_read = offset
+        return header
+
+    def save_cache(self, checkpoint=False):
+        # a small header to validate the cache against the log, then the compressed state
+        try:
+            stat = os.stat(self.logfile)
+            if self.compression is not None:
+                # offsets into the decompressed log mean nothing on disk, the cache
+                # covers the whole compressed file and can't be appended to
+                offset = self.total_bytes
+                complete = False
+            else:
+                offset = self.bytes_read
+                with open(self.logfile, 'rb') as fp:
+                    fp.seek(max(0, offset - 1))
+                    complete = offset == 0 or fp.read(1) == b'\n'
+            header = {
+                'version': cache_version,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'offset': offset,
+                'complete': complete,
+                'fingerprint': log_fingerprint(self.logfile, offset),
+                'top_k': self.top_k,
+                'window': self.window,
+                'trace_format': self.trace_format.name if self.trace_format is not None else None,
+                # a checkpoint is taken part way through a parse and is only carried on from with --resume
+                'checkpoint': checkpoint,
+            }
+            state = zlib.compress(pickle.dumps(self.get_state(), pickle.HIGHEST_PROTOCOL), 1)
+            os.makedirs(cache_directory(), mode=0o700, exist_ok=True)
+            # a name of its own, two parsers of the same log (--compare with itself) write at the same time
+            temp_fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(self.cache_path()) + '.', suffix='.tmp', dir=cache_directory())
+            try:
+                with os.fdopen(temp_fd, 'wb') as fp:
+                    pickle.dump(header, fp, pickle.HIGHEST_PROTOCOL)
+                    fp.write(state)
+                os.replace(temp_path, self.cache_path())
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as error:
+            print("Could not write the cache {0}: {1}".format(self.cache_path(), repr(error)))
+
+    def parse_log_file_parallel(self):
+        # cut the log into newline aligned byte ranges and parse each one in its own process
+        shards = self.jobs
+        if self.next_checkpoint is not None:
+            shards = max(shards, -(-(self.total_bytes - self.bytes_read) // self.checkpoint_shard_bytes))
+        shards = split_log_file(self.logfile, self.bytes_read, self.total_bytes, shards)
+        print("Parsing {0} shards with {1} processes...".format(len(shards), self.jobs))
+        process_roots = self.shard_process_roots(shards)
+        # the workers stop at Ctrl-C themselves, a forked one would have the handler of this process otherwise
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs, initializer=signal.signal,
+                                                          initargs=(signal.SIGINT, signal.default_int_handler))
+        try:
+            results = executor.map(parse_shard, [(self.logfile, start, end, self.top_k, self.window, self.stage_timer is not None,
+                                                  self.event_store.new_segment('{0:016d}-shard'.format(start)).directory if self.event_store is not None else None,
+                                                  self.trace_format.name, roots)
+                                                 for (start, end), roots in zip(shards, process_roots)])
+            # shards have to be merged in file order so the handles are resolved as a serial run would
+            for shard_no, shard in enumerate(results, 1):
+                if shard.early_stop:
+                    # Ctrl-C stopped it part way through, only the whole shards before it are kept
+                    self.early_stop = True
+                    break
+                self.merge_shard(shard)
+                self.bytes_read = shard.shard_end
+                sys.stdout.write("\r[{0}/{1}] shards merged, line {2}".format(shard_no, len(shards), self.lines))
+                sys.stdout.flush()
+                if self.early_stop:
+                    break
+                if self.next_checkpoint is not None and time.time() >= self.next_checkpoint:
+                    self.save_checkpoint()
+        except KeyboardInterrupt:
+            # keep whatever was merged so far
+            self.early_stop = True
+            print("\nstopping parsing", flush=True)
+        finally:
+            executor.shutdown(wait=not self.early_stop, cancel_futures=True)
+
+    def parse_lines(self, lines, first_line_no=1):
+        if self.trace_format is None:
+            # a pipe or a followed log, see which tracer wrote it from the lines it starts with
+            lines = iter(lines)
+            head = list(itertools.islice(lines, sniff_lines))
+            self.trace_format = sniff_trace_format(head)
+            lines = itertools.chain(head, lines)
+        for line_no, line in enumerate(lines, first_line_no):
+            if self.early_stop == True:
+                print("stopping parsing", flush=True)
+                break
+            try:
+                self.bytes_read += len(line)
+                line = line.decode('utf-8', 'replace').rstrip()
+                self.lines += 1
+                if self.progress_step > 0:
+                    if self.bytes_read >= self.next_progress:
+                        self.next_progress = (int(self.bytes_read / self.progress_step) + 1) * self.progress_step
+                        self.show_progress()
+                elif self.lines % 100000 == 0 and not self.quiet:
+                    self.show_progress()
+                self.parse_line(line, line_no)
+                if self.lines >= self.next_fd_sample:
+                    self.sample_open_handles()
+                    if self.next_checkpoint is not None and time.time() >= self.next_checkpoint:
+                        self.save_checkpoint()
+            except (KeyboardInterrupt, SystemExit):
+                self.early_stop = True
+            except Exception as e:
+                # first line is sometimes incomplete
+                if line_no > 1:
+                    print('\nerror processing line <', self.lines, '> of file <', self.logfile,'>')
+                    print(line)
+                    #print(sys.exc_info())
+                    #print(e)
+                    traceback.print_exc(file=sys.stdout)
+                    sys.exit(1)
+
+    def tokenize_line(self, line):
+        # (thread, pid, timestamp, command, first argument, path, arguments, return value, error text, duration)
+        # or None for lines that are not a finished call, from whichever tracer wrote the log
+        return self.trace_format.tokenize(self, line)
+
+    def add_timestamp(self, timestamp):
+        # -ttt and truss -d give seconds, -t and -tt the time of day, perf trace milliseconds that are already seconds here
+        if timestamp.__class__ is str:
+            if ':' in timestamp:
+                hours, minutes, seconds = timestamp.split(':')
+                timestamp = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            else:
+                timestamp = float(timestamp)
+        if self.first_timestamp is None:
+            self.first_timestamp = self.last_timestamp = timestamp
+        elif timestamp > self.last_timestamp:
+            # a resumed call carries the time it started
+            self.last_timestamp = timestamp
+        return timestamp
+
+    def parse_line(self, line, line_no):
+        event = self.tokenize_line(line)
+        if event is None:
+            return
+        thread, pid, timestamp, syscall_command, firstparam, filename, args, retval, error_text, duration = event
+        if syscall_command is None:
+            # "+++ exited with 0 +++", the handles go once nothing else shares them
+            self.release_fd_table(pid, 'exit')
+            return
+        if timestamp is not None and (self.timeline.end is None or timestamp >= self.timeline.end):
+            # the counters so far belong to the window before this line
+            self.sample_timeline(timestamp)
+        # what remains should be the command
+        dict_inc_or_add(self.syscall_commands, syscall_command)
+        fd_table = self.fd_tables.get(pid)
+        if fd_table is None:
+            fd_table = self.process_fd_table(pid)
+        pid_instance = self.pid_instances.get(thread)
+        if pid_instance is None:
+            pid_instance = self.pid_instances[thread] = PidInstance(thread)
+        pid_instance.add_call(syscall_command, duration)
+        # the calls the thread made just before this one, a sequence that keeps coming back is a loop
+        last_calls = pid_instance.last_calls
+        if len(last_calls) == 2:
+            sequence = (last_calls[0], last_calls[1], syscall_command)
+            count = self.call_sequences.get(sequence)
+            if count is not None:
+                self.call_sequences[sequence] = count + 1
+            else:
+                self.count_sequence(sequence, 1)
+            pid_instance.last_calls = (last_calls[1], syscall_command)
+        else:
+            pid_instance.last_calls = pid_instance.first_calls = last_calls + (syscall_command,)
+        if syscall_command in self.fork_commands:
+            self.fork_fd_table(pid, syscall_command, args, retval)
+        elif syscall_command in self.exit_commands:
+            self.release_fd_table(pid, syscall_command)
+        if duration is not None:
+            latency = self.syscall_latency.get(syscall_command)
+            if latency is None:
+                latency = self.syscall_latency[syscall_command] = LatencyStats()
+            latency.add(duration)
+        filehandle = 0
+        # try to get a filename
+        if filename is None and syscall_command in self.at_commands and "\"" in args:
+            # openat, newfstatat, unlinkat... take the path relative to a directory handle
+            filename = self.at_path(fd_table, firstparam, args)
+        if self.event_segment is not None:
+            self.record_event(fd_table, thread, pid, timestamp, syscall_command, firstparam, filename, retval, error_text, duration)
+        is_error = error_text is not None
+        if filename is not None:
+            dict_inc_or_add(self.syscall_files, filename)
+            # what do we want to track about this particular system call
+            attr_key = ''
+            #first make sure the command did not error
+            if not is_error:
+                # if there is a filename then there could be a handle at the end...
+                filehandle = retval if retval is not None else ''
+                if filehandle == 0:
+                    # command was executed with success
+                    attr_key = 'success'
+                    attr_value = 1
+                elif filehandle == -1:
+                    # command was executed with failure                                
+                    attr_key = 'failure'
+                    attr_value = 1
+                else:
+                    # this is probably statx or kopen giving us a handle...
+                    attr_key = 'handle'
+                    attr_value = filehandle
+                if syscall_command in self.open_commands and filehandle.isdigit():
+                    # only calls that open something hand out a new handle
+                    self.open_handles += fd_table.open(filehandle, filename)
+            else:
+                # there is an error add it to the dict
+                dict_inc_or_add(self.syscall_errors,error_text)
+                pid_instance.errors += 1
+                if 'ENOENT' in error_text:
+                    dict_inc_or_add(self.missing_paths, filename)
+                # command was executed with failure
+                attr_key = 'error'
+                attr_value = error_text
+            # now look for the file in the index and either 
+            # update the attribute or add a new file instance
+            try:
+                fileinstance = self.get_file_instance(filename)
+                if filename not in self.timeline.touched:
+                    self.timeline.touched[filename] = (fileinstance, fileinstance.calls(), fileinstance.latency.total)
+                # update the key value pair with the system call that was executed
+                fileinstance.incAttr(syscall_command)
+                if duration is not None:
+                    fileinstance.latency.add(duration)
+                # update the key value pair with the result of the system call
+                if attr_key == 'handle':
+                    fileinstance.incHandles(filehandle)
+                fileinstance.incAttr(attr_key)
+            except (KeyboardInterrupt, SystemExit):
+                self.early_stop = True
+            except Exception as error:
+                print("Error checking the file instance {0}".format(repr(error)))
+        else:
+            if is_error:
+                # there is an error add it to the dict
+                dict_inc_or_add(self.syscall_errors,error_text)
+                pid_instance.errors += 1
+            elif syscall_command in self.anonymous_handle_commands:
+                # sockets, pipes, eventfds... hand out handles without a path
+                self.open_anonymous_handles(fd_table, syscall_command, firstparam, args, retval, duration)
+                return
+            elif syscall_command in self.map_commands:
+                self.map_file(pid, fd_table, args)
+            # no file probably a handle
+            address = firstparam
+            if address == "":
+                # empty params passed in, count them seperately
+                dict_inc_or_add(self.syscall_empty,syscall_command)
+            else:
+                # is it a memory address or a handle
+                if address[:2] == "0x":
+                    # for the counter we only count by handle number
+                    dict_inc_or_add(self.syscall_memaddresses, address)
+                else:
                     try:
-                        firstparam = line.split("(")[1]                       
-
-                    except Exception as e:
-                        # first line is sometimes incomplete
-                        if line_no > 1:
-                            print('error processing line <', self.lines, '> of file <', self.logfile,'>')
-                            print(line)
-                            #print(sys.exc_info())
-                            #print(e)
-                            traceback.print_exc(file=sys.stdout)
-                            sys.exit(1)
-                    # now grab everything before the first comma, if there is one
-                    if "," in firstparam:
-                        firstparam = firstparam.split(",")[0]
-                    if "\"" in firstparam:
-                        filename = firstparam.split("\"")[1]                        
-                        dict_inc_or_add(self.syscall_files, filename)
-                        # what do we want to track about this particular system call
-                        attr_key = ''
-                        #first make sure the command did not error
-                        if "Err#" not in line and "= -" not in line:
-                            # if there is a filename then there could be a handle at the end...
-                            filehandle = line[line.rfind('=')+1:].strip()
-                            if filehandle == 0:
-                                # command was executed with success
-                                attr_key = 'success'
-                                attr_value = 1
-                            elif filehandle == -1:
-                                # command was executed with failure                                
-                                attr_key = 'failure'
-                                attr_value = 1
-                            else:
-                                # this is probably statx or kopen giving us a handle...
-                                attr_key = 'handle'
-                                attr_value = filehandle
+                        if int(address) > self.fd_limit:
+                            dict_inc_or_add(self.syscall_semaphores, address)
+                            if not is_error and syscall_command in self.handle_lifecycle_commands:
+                                # the opens that handed out handles this high are in the table, so their closes have to be
+                                self.update_handle(fd_table, syscall_command, address, args, retval)
                         else:
-                            # there is an error add it to the dict
-                            if line.rfind('Err#') > -1:
-                                error_text = line[line.rfind('Err#'):].strip()
-                            else:
-                                error_text = line[line.rfind('= -')+1:].strip()
-                            dict_inc_or_add(self.syscall_errors,error_text)
-                            # command was executed with failure
-                            attr_key = 'error'
-                            attr_value = error_text
-                        # update the file's handle in our list
-                        self.handles_and_files[filehandle] = filename
-                        # now look for the file in the list and either 
-                        # update the attribute
-                        try:
-                            index = self.associated_file_instances.index(filename)
-                            if index in range(0,len(self.associated_file_instances)):
-                                found_file = True
-                                fileinstance = self.associated_file_instances[index]
+                            dict_inc_or_add(self.syscall_handles, address)
+                            # look the handle up, then the file it belongs to
+                            filename = fd_table.get(address)
+                            pending_address = address
+                            if filename.__class__ is tuple:
+                                # a shard dup'ed a handle it never saw opened, charge the original
+                                pending_address = filename[1]
+                                filename = None
+                            fileinstance = self.file_instance_index.get(filename) if filename is not None else None
+                            transferred = None
+                            if not is_error and syscall_command in self.transfer_commands and retval is not None and retval.isdigit():
+                                # the return value is the number of bytes read or written
+                                transferred = int(retval)
+                                is_write = syscall_command in self.write_commands
+                                self.transfers.add(transferred, is_write, duration)
+                                dict_add(self.handle_bytes, address, transferred)
+                            # a read or write that only moved a few bytes
+                            small_io = transferred is not None and 0 < transferred <= self.small_io_bytes
+                            if fileinstance is not None:
+                                if filename not in self.timeline.touched:
+                                    self.timeline.touched[filename] = (fileinstance, fileinstance.calls(), fileinstance.latency.total)
+                                # we have a filename!
                                 # update the key value pair with the system call that was executed
                                 fileinstance.incAttr(syscall_command)
-                                # update the key value pair with the result of the system call
-                                if attr_key == 'handle':
-                                    fileinstance.incHandles(filehandle)
-                                fileinstance.incAttr(attr_key)
-                        except (KeyboardInterrupt, SystemExit):
-                            self.early_stop = True
-                        except ValueError:
-                            pass
-                        except Exception as error:
-                            print("Error checking the file instance {0}".format(repr(error)))
-                        # the file is not in our list
-                        if found_file == 0:
-                            # create a file instance with the handle as 0
-                            file_instance = FileInstance(filename, 0, self.print_format, self.file_commands)
-                            file_instance.incAttr(syscall_command)
-                            # update the key value pair with the result of the system call
-                            if attr_key == 'handle':
-                                file_instance.incHandles(filehandle)
+                                if duration is not None:
+                                    fileinstance.latency.add(duration)
+                                if transferred is not None:
+                                    if fileinstance.transfers is None:
+                                        fileinstance.transfers = ByteStats()
+                                    fileinstance.transfers.add(transferred, is_write, duration)
+                                if small_io:
+                                    fileinstance.incAttr('small_io')
+                            elif self.shard and filename is None and address not in fd_table.removed:
+                                # the handle may have been opened in an earlier shard, it gets resolved on merge
+                                commands = self.pending_handles.setdefault((pid, pending_address), dict())
+                                dict_inc_or_add(commands, syscall_command)
+                                if small_io:
+                                    dict_inc_or_add(commands, 'small_io')
+                                if transferred is not None:
+                                    self.pending_transfers.setdefault((pid, pending_address), ByteStats()).add(transferred, is_write, duration)
+                                if duration is not None:
+                                    self.pending_latency.setdefault((pid, pending_address), LatencyStats()).add(duration)
                             else:
-                                file_instance.incAttr(attr_key)                            
-                            self.associated_file_instances.append(file_instance)                        
+                                # not in our associated files, we don't know where to put to return add it to the unknown.
+                                dict_inc_or_add(self.syscall_unknown, syscall_command)
+                            if not is_error and syscall_command in self.handle_lifecycle_commands:
+                                self.update_handle(fd_table, syscall_command, address, args, retval)
+                    except KeyboardInterrupt:
+                        self.early_stop = True
+                    except:
+                        # non number...
+                        dict_inc_or_add(self.syscall_unknown, syscall_command)
+
+    def record_event(self, fd_table, thread, pid, timestamp, syscall_command, firstparam, filename, retval, error_text, duration):
+        # a row in the event store, a call on a handle gets the path of the file behind it
+        segment = self.event_segment
+        fd = -1
+        path_id = 0
+        if filename is not None:
+            path_id = segment.intern('path', filename)
+            if syscall_command in self.open_commands and retval is not None and retval.isdigit():
+                fd = int(retval)
+        elif firstparam.isdigit() and int(firstparam) <= self.fd_limit:
+            fd = int(firstparam)
+            name = fd_table.get(firstparam)
+            if name is not None and name.__class__ is not tuple:
+                path_id = segment.intern('path', name)
+            elif self.shard and firstparam not in fd_table.removed:
+                path_id = segment.pending_path(pid, firstparam if name is None else name[1])
+        segment.add(syscall_command, path_id, error_text, pid, thread, fd, timestamp, duration, retval)
+
+    def map_file(self, pid, fd_table, args):
+        # mmap(addr, length, prot, flags, fd, offset), the length is counted against the file
+        args = args.split(',')
+        if len(args) < 5 or not args[1].strip().isdigit():
+            return
+        length = int(args[1].strip())
+        self.transfers.mapped_bytes += length
+        handle = args[4].strip()
+        if not handle.isdigit():
+            # -1 for anonymous memory
+            return
+        filename = fd_table.get(handle)
+        if filename.__class__ is tuple:
+            handle = filename[1]
+            filename = None
+        fileinstance = self.file_instance_index.get(filename) if filename is not None else None
+        if fileinstance is not None:
+            if fileinstance.transfers is None:
+                fileinstance.transfers = ByteStats()
+            fileinstance.transfers.mapped_bytes += length
+        elif self.shard and filename is None and handle not in fd_table.removed:
+            self.pending_transfers.setdefault((pid, handle), ByteStats()).mapped_bytes += length
+
+    def count_sequence(self, sequence, count):
+        # add to a call sequence, making room by dropping the rarer half when there are too many
+        if sequence in self.call_sequences:
+            self.call_sequences[sequence] += count
+            return
+        if len(self.call_sequences) >= self.max_call_sequences:
+            self.call_sequences = dict(heapq.nlargest(self.max_call_sequences // 2, self.call_sequences.items(), key=operator.itemgetter(1)))
+        self.call_sequences[sequence] = count
+
+    def at_path(self, fd_table, dirfd, params):
+        # the path is the second parameter, relative ones hang off the directory handle
+        path = quoted_string.match(params, params.find(",")+1)
+        if path is None:
+            return None
+        path = path.group(1)
+        if dirfd == 'AT_FDCWD' or path[:1] == '/':
+            return path
+        directory = fd_table.get(dirfd)
+        if directory is None or directory.__class__ is tuple:
+            return path
+        return directory.rstrip('/') + '/' + path
+
+    def update_handle(self, fd_table, syscall_command, address, args, retval):
+        # close and the dup family change which handle points at which file
+        if syscall_command == 'close':
+            self.open_handles -= fd_table.close(address, self.shard)
+        elif syscall_command in ('fcntl', 'fcntl64', 'kfcntl') and 'F_DUPFD' not in args:
+            return
+        else:
+            new_handle = retval
+            if new_handle is not None and new_handle.isdigit() and new_handle != address:
+                name = fd_table.get(address)
+                if name is None and self.shard:
+                    # resolved against the earlier shards on merge
+                    name = ('dup', address)
+                if name is not None:
+                    self.open_handles += fd_table.open(new_handle, name)
+
+    def open_anonymous_handles(self, fd_table, syscall_command, firstparam, args, retval, duration):
+        # sockets and pipes get a made up name so the reads and writes on them can be followed
+        if syscall_command in ['pipe', 'pipe2', 'socketpair']:
+            handles = args[args.find('[')+1:args.find(']')].replace(' ', '').split(',')
+            name = '{0}:[{1}]'.format('pipe' if syscall_command != 'socketpair' else 'socket', ','.join(handles))
+        else:
+            handles = [retval or '']
+            if syscall_command == 'socket':
+                name = 'socket:[{0}]'.format(firstparam)
+            else:
+                name = 'anon_inode:[{0}]'.format(syscall_command)
+        fileinstance = self.get_file_instance(name)
+        fileinstance.incAttr(syscall_command)
+        if duration is not None:
+            fileinstance.latency.add(duration)
+        for handle in handles:
+            if handle.isdigit():
+                self.open_handles += fd_table.open(handle, name)
+                fileinstance.incHandles(handle)
+
+    def release_fd_table(self, pid, syscall_command):
+        # exit_group takes every thread of the process down, exit just the one
+        fd_table = self.fd_tables.pop(pid, None)
+        if self.shard:
+            # the pid may have a table from an earlier shard, the merge takes it out of that too
+            self.released_pids.append((pid, syscall_command))
+        if fd_table is None:
+            return
+        if syscall_command == 'exit_group':
+            for other_pid in [k for k, v in self.fd_tables.items() if v is fd_table]:
+                del self.fd_tables[other_pid]
+        elif any(v is fd_table for v in self.fd_tables.values()):
+            return
+        if fd_table is self.default_fd_table:
+            # a pid that turns up without a fork after this is another process
+            self.default_fd_table = FdTable()
+        self.open_handles -= len(fd_table.handles)
+
+    def sample_open_handles(self):
+        # keep a bounded timeline of open handles, halving its resolution when it fills up
+        self.next_fd_sample = self.lines + self.fd_sample_lines
+        self.fd_samples.append((self.last_timestamp if self.last_timestamp is not None else self.lines, self.open_handles))
+        if len(self.fd_samples) >= self.max_fd_samples:
+            self.fd_samples = self.fd_samples[::2]
+            self.fd_sample_lines *= 2
+
+    def sample_timeline(self, timestamp=None, count=True):
+        # add what the counters went up by since the last window to the current one, then
+        # move on to the window of timestamp. count=False only takes a new starting point
+        timeline = self.timeline
+        if timeline.first is not None:
+            current = timeline.current
+            calls = 0
+            seconds = 0.0
+            for syscall_command, count_now in self.syscall_commands.items():
+                latency = self.syscall_latency.get(syscall_command)
+                if not count:
+                    timeline.last_commands[syscall_command] = (count_now, latency.total if latency is not None else 0.0)
+                    continue
+                added_calls, added_seconds = timeline.add(timeline.commands, timeline.last_commands, syscall_command, count_now,
+                                                          latency.total if latency is not None else 0.0)
+                calls += added_calls
+                seconds += added_seconds
+            errors = sum(pid_instance.errors for pid_instance in self.pid_instances.values())
+            if count:
+                timeline.calls[current] += calls
+                timeline.seconds[current] += seconds
+                timeline.errors[current] += errors - timeline.last_errors
+            timeline.last_errors = errors
+            # the tracked files, and the ones used in this window that are now busy enough
+            for filename in list(timeline.files):
+                fileinstance = self.file_instance_index.get(filename)
+                if fileinstance is not None:
+                    calls = fileinstance.calls()
+                    timeline.file_calls[filename] = calls
+                    if count:
+                        timeline.add(timeline.files, timeline.last_files, filename, calls, fileinstance.latency.total)
                     else:
-                        if "Err#" in line or "= -" in line:
-                            # there is an error add it to the dict
-                            if line.rfind('Err#') > -1:
-                                error_text = line[line.rfind('Err#'):].strip()
-                            else:
-                                error_text = line[line.rfind('= -')+1:].strip()
-                            dict_inc_or_add(self.syscall_errors,error_text)
-                        # no file probably a handle
-                        if "," in line:
-                            address = line.split("(")[1].split(",")[0]
-                        else:
-                            # look for the close bracket
-                            address = line.split("(")[1].split(")")[0]
-                        if address == "":
-                            # empty params passed in, count them seperately
-                            dict_inc_or_add(self.syscall_empty,syscall_command)
+                        timeline.last_files[filename] = (calls, fileinstance.latency.total)
+            for filename, (fileinstance, calls_before, seconds_before) in timeline.touched.items():
+                if filename not in timeline.files:
+                    calls = fileinstance.calls()
+                    if calls >= timeline.file_threshold:
+                        series = timeline.files[filename] = timeline.new_series()
+                        if count:
+                            series[0][current] = calls - calls_before
+                            series[1][current] = fileinstance.latency.total - seconds_before
+                        timeline.file_calls[filename] = calls
+                        timeline.last_files[filename] = (calls, fileinstance.latency.total)
+            timeline.touched = dict()
+            timeline.prune_files()
+        if timestamp is not None:
+            timeline.move_to(timestamp)
+
+    def process_fd_table(self, pid):
+        # strace -f prints thread ids and has no clone lines for the threads that were running when it
+        # attached, so a pid that wasn't seen forked is a thread of the traced process and shares its handles
+        root = self.process_roots.get(pid)
+        if root is None:
+            fd_table = self.default_fd_table
+        else:
+            fd_table = self.process_tables.get(root)
+            if fd_table is None:
+                fd_table = self.process_tables[root] = FdTable()
+        self.fd_tables[pid] = fd_table
+        return fd_table
+
+    def shard_process_roots(self, shards):
+        # a shard can't see the forks in the shards before it, so the fork and clone lines are read here
+        # first. For each shard, pid -> the forked pid whose handles it has, for every pid that doesn't
+        # share the table of the traced process
+        roots = dict()
+        representatives = dict()
+        for pid, fd_table in self.fd_tables.items():
+            if fd_table is not self.default_fd_table:
+                roots[pid] = representatives.setdefault(id(fd_table), pid)
+        scanner = PerfTracerParser(self.logfile, shard=True, trace_format=self.trace_format.name)
+        shard_roots = []
+        with open(self.logfile, 'rb') as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for start, end in shards:
+                    shard_roots.append(dict(roots))
+                    line_end = start
+                    for match in fork_line_pattern.finditer(mapped, start, end):
+                        if match.start() < line_end:
+                            continue
+                        line_start = max(start, mapped.rfind(b'\n', start, match.start()) + 1)
+                        line_end = mapped.find(b'\n', match.end(), end)
+                        if line_end < 0:
+                            line_end = end
+                        event = scanner.tokenize_line(mapped[line_start:line_end].decode('utf-8', 'replace').rstrip())
+                        if event is None:
+                            continue
+                        syscall_command, args, retval = event[3], event[6], event[7]
+                        if syscall_command not in self.fork_commands or retval is None or not retval.isdigit():
+                            continue
+                        root = retval if 'CLONE_FILES' not in args else roots.get(event[1])
+                        if root is None:
+                            roots.pop(retval, None)
                         else:
-                            # is it a memory address or a handle
-                            if address[:2] == "0x":
-                                # for the counter we only count by handle number
-                                dict_inc_or_add(self.syscall_memaddresses, address)
-                            else:
-                                try:
-                                    if int(address) > self.fd_limit:
-                                        dict_inc_or_add(self.syscall_semaphores, address)
-                                    else:
-                                        dict_inc_or_add(self.syscall_handles, address)
-                                        file_found = False
-                                        file_instance_found = False
-                                        if address in self.handles_and_files:
-                                            filename = self.handles_and_files[address]
-                                            file_found = True
-                                            # we have a filename!
-                                            # let's add the system call to it's collections
-                                            # fetch the instance from our list
-                                            try:
-                                                index = self.associated_file_instances.index(filename)
-                                                if index in range(0,len(self.associated_file_instances)):
-                                                    file_instance_found = True
-                                                    # update the key value pair with the system call that was executed
-                                                    self.associated_file_instances[index].incAttr(syscall_command)
-                                            except ValueError:
-                                                pass
-                                            except Exception as error:
-                                                print("Error checking the file instance {0}".format(repr(error)))
-                                        if not file_found and not file_instance_found:
-                                            # not in our associated files, we don't know where to put to return add it to the unknown.
-                                            dict_inc_or_add(self.syscall_unknown, syscall_command)
-                                except KeyboardInterrupt:
-                                    self.early_stop = True
-                                except:
-                                    # non number...
-                                    dict_inc_or_add(self.syscall_unknown, syscall_command)
-                except (KeyboardInterrupt, SystemExit):
-                    self.early_stop = True
-                except Exception as e:
-                    # first line is sometimes incomplete
-                    if line_no > 1:
-                        print('error processing line <', self.lines, '> of file <', self.logfile,'>')
-                        print(line)
-                        #print(sys.exc_info())
-                        #print(e)
-                        traceback.print_exc(file=sys.stdout)
-                        sys.exit(1)
-            print("\nFinished parsing trace log!\n\n")
+                            roots[retval] = root
+            finally:
+                mapped.close()
+        return shard_roots
+
+    def resolve_handle(self, pid, address):
+        # what a handle points at after the shards merged so far
+        return self.fd_tables.get(pid, self.default_fd_table).get(address)
+
+    def fork_fd_table(self, pid, syscall_command, args, retval):
+        # the child of a fork gets a copy of the handles, a thread created with
+        # CLONE_FILES shares them with its parent
+        child = retval
+        if child is None or not child.isdigit():
+            return
+        shared = 'CLONE_FILES' in args
+        fd_table = self.fd_tables[pid]
+        if shared:
+            self.fd_tables[child] = fd_table
+        else:
+            self.fd_tables[child] = fd_table.copy()
+            self.open_handles += len(fd_table.handles)
+        if self.shard:
+            self.fd_table_links.append((child, pid, shared))
+
+    def merge_shard(self, shard):
+        # fold the results of a shard parsed in another process into this parser
+        self.lines += shard.lines
+        self.unparsed_lines += shard.unparsed_lines
+        # calls the shard saw resumed were started in an earlier one
+        for thread, line in shard.orphan_resumed:
+            self.parse_line(line, 0)
+        if shard.orphan_resumed:
+            self.sample_timeline()
+        self.unfinished.update(shard.unfinished)
+        # recreate the handle tables of the processes forked in the shard from
+        # what their parents had at the start of it
+        start_handles = self.open_handles
+        for child, parent, shared in shard.fd_table_links:
+            fd_table = self.fd_tables.setdefault(parent, self.default_fd_table)
+            self.fd_tables[child] = fd_table if shared else fd_table.copy()
+        # handles that were used in the shard before it saw them opened belong to
+        # whatever the earlier shards left them pointing at
+        for (pid, address), commands in shard.pending_handles.items():
+            filename = self.resolve_handle(pid, address)
+            fileinstance = self.file_instance_index.get(filename) if filename is not None else None
+            for syscall_command, count in commands.items():
+                if fileinstance is not None:
+                    fileinstance.addAttr(syscall_command, count)
+                elif syscall_command != 'small_io':
+                    dict_add(self.syscall_unknown, syscall_command, count)
+            if fileinstance is not None and (pid, address) in shard.pending_latency:
+                fileinstance.latency.merge(shard.pending_latency[(pid, address)])
+        if shard.event_segment is not None:
+            shard.event_segment.resolve_pending(self.resolve_handle)
+        for (pid, address), transfers in shard.pending_transfers.items():
+            filename = self.resolve_handle(pid, address)
+            fileinstance = self.file_instance_index.get(filename) if filename is not None else None
+            if fileinstance is not None:
+                fileinstance.add_transfers(transfers)
+        # handles the shard dup'ed from ones it never saw opened take the name the original has now
+        merged_handles = dict()
+        for pid, fd_table in shard.fd_tables.items():
+            if id(fd_table) in merged_handles:
+                continue
+            handles = dict()
+            for handle, name in fd_table.handles.items():
+                if name.__class__ is tuple:
+                    name = self.resolve_handle(pid, name[1])
+                    if name is None:
+                        continue
+                handles[handle] = name
+            merged_handles[id(fd_table)] = handles
+        # the threads first seen in the shard were there before the exits in it
+        for pid, fd_table in shard.fd_tables.items():
+            if fd_table is shard.first_fd_table and pid not in self.fd_tables:
+                self.fd_tables[pid] = self.default_fd_table
+        for pid, syscall_command in shard.released_pids:
+            self.release_fd_table(pid, syscall_command)
+        # and the ones of a process that started in the shard join the table it has now
+        merged_tables = set()
+        for pid, fd_table in shard.fd_tables.items():
+            merged_table = self.fd_tables.get(pid)
+            if merged_table is None:
+                merged_table = self.fd_tables[pid] = self.default_fd_table if fd_table is shard.default_fd_table else FdTable()
+            if id(fd_table) not in merged_tables:
+                merged_tables.add(id(fd_table))
+                merged_table.merge(fd_table, merged_handles[id(fd_table)])
+        self.open_handles = sum(len(k.handles) for k in dict((id(v), v) for v in self.fd_tables.values()).values())
+        for position, open_handles in shard.fd_samples:
+            self.fd_samples.append((position, start_handles + open_handles))
+        while len(self.fd_samples) >= self.max_fd_samples:
+            self.fd_samples = self.fd_samples[::2]
+        self.transfers.merge(shard.transfers)
+        for sequence, count in shard.call_sequences.items():
+            self.count_sequence(sequence, count)
+        for thread, pid_instance in shard.pid_instances.items():
+            if thread in self.pid_instances:
+                # the sequences that start before the shard and end in it
+                merged = self.pid_instances[thread]
+                calls = merged.last_calls + pid_instance.first_calls
+                for start in range(len(merged.last_calls)):
+                    sequence = calls[start:start + 3]
+                    if len(sequence) == 3:
+                        self.count_sequence(sequence, 1)
+                merged.merge(pid_instance)
+            else:
+                self.pid_instances[thread] = pid_instance
+        for fileinstance in shard.associated_file_instances:
+            self.get_file_instance(fileinstance.filename).merge(fileinstance)
+        for name in ['syscall_commands', 'syscall_files', 'syscall_semaphores', 'syscall_handles',
+                     'syscall_memaddresses', 'syscall_empty', 'syscall_errors', 'syscall_unknown', 'missing_paths',
+                     'handle_bytes']:
+            merged = getattr(self, name)
+            if merged.__class__ is TopCounts:
+                merged.merge(getattr(shard, name))
+                continue
+            for key, count in getattr(shard, name).items():
+                dict_add(merged, key, count)
+        for syscall_command, latency in shard.syscall_latency.items():
+            self.syscall_latency.setdefault(syscall_command, LatencyStats()).merge(latency)
+        if self.stage_timer is not None and shard.stage_timer is not None:
+            self.stage_timer.merge(shard.stage_timer)
+        self.timeline.merge(shard.timeline)
+        # the merged counters already include what the shard put in its windows
+        self.sample_timeline(count=False)
+        if shard.first_timestamp is not None:
+            if self.first_timestamp is None or shard.first_timestamp < self.first_timestamp:
+                self.first_timestamp = shard.first_timestamp
+            if self.last_timestamp is None or shard.last_timestamp > self.last_timestamp:
+                self.last_timestamp = shard.last_timestamp
+
+    def report_records(self):
+        # everything the summary shows and the whole per file table, one dict at a time
+        yield {'table': 'summary', 'key': self.logfile, 'trace_format': self.trace_format.name if self.trace_format is not None else None,
+               'lines': self.lines, 'unparsed_lines': self.unparsed_lines,
+               'first_timestamp': self.first_timestamp, 'last_timestamp': self.last_timestamp,
+               'files': len(self.associated_file_instances), 'open_handles': self.open_handles, 'complete': not self.early_stop}
+        for table, name in [('commands', 'syscall_commands'), ('files_referenced', 'syscall_files'),
+                            ('semaphores', 'syscall_semaphores'), ('handles', 'syscall_handles'),
+                            ('memory_addresses', 'syscall_memaddresses'), ('empty_calls', 'syscall_empty'),
+                            ('errors', 'syscall_errors'), ('unknown', 'syscall_unknown')]:
+            counts = getattr(self, name)
+            if counts.__class__ is TopCounts:
+                for key, count in counts.items():
+                    yield {'table': table, 'key': key, 'count': count, 'error': counts.errors[key]}
+                continue
+            for key, count in sort_dict(counts).items():
+                yield {'table': table, 'key': key, 'count': count}
+        for syscall_command, latency in sorted(self.syscall_latency.items(), key=lambda k: k[1].total, reverse=True):
+            yield latency_fields({'table': 'command_latency', 'key': syscall_command}, latency)
+        for thread, pid_instance in sorted(self.pid_instances.items(), key=lambda k: k[1].calls, reverse=True):
+            yield latency_fields({'table': 'threads', 'key': thread, 'syscalls': pid_instance.calls,
+                                  'errors': pid_instance.errors}, pid_instance.latency)
+        # threads that share a handle table are one process
+        pids_by_table = OrderedDict()
+        for pid, fd_table in self.fd_tables.items():
+            pids_by_table.setdefault(id(fd_table), (fd_table, []))[1].append(pid)
+        for fd_table, pids in pids_by_table.values():
+            yield {'table': 'processes', 'key': ','.join(pids), 'open': len(fd_table.handles), 'peak': fd_table.peak,
+                   'opened': fd_table.opened, 'closed': fd_table.closed}
+        transfers = self.transfers
+        yield {'table': 'transfers', 'key': self.logfile, 'reads': transfers.reads, 'writes': transfers.writes,
+               'read_bytes': transfers.read_bytes, 'write_bytes': transfers.write_bytes, 'mapped_bytes': transfers.mapped_bytes,
+               'seconds': transfers.seconds}
+        for bucket, count in enumerate(transfers.buckets):
+            if count:
+                yield {'table': 'transfer_sizes', 'key': 0 if bucket == 0 else 2 ** (bucket - 1), 'up_to': 2 ** bucket - 1, 'count': count}
+        counts = self.handle_bytes
+        for key, count in (counts.items() if counts.__class__ is TopCounts else sort_dict(counts).items()):
+            yield {'table': 'handle_bytes', 'key': key, 'bytes': count}
+        for position, open_handles in self.fd_samples:
+            yield {'table': 'open_handles', 'key': position, 'open': open_handles}
+        # one record per window with any calls in it, and per command and tracked file in that window
+        timeline = self.timeline
+        for index in range(len(timeline.calls)):
+            if timeline.calls[index]:
+                yield {'table': 'timeline', 'key': timeline.start(index), 'window': timeline.window, 'calls': timeline.calls[index],
+                       'errors': timeline.errors[index], 'seconds': timeline.seconds[index]}
+        for table, named_series in [('command_timeline', timeline.commands), ('file_timeline', timeline.files)]:
+            for name, (calls, seconds) in named_series.items():
+                for index in range(len(calls)):
+                    if calls[index]:
+                        yield {'table': table, 'key': name, 'start': timeline.start(index), 'calls': calls[index], 'seconds': seconds[index]}
+        for title, table, counts in self.call_patterns():
+            for key, count in sort_dict(counts).items():
+                yield {'table': table, 'key': key, 'count': count}
+        for fileinstance in self.associated_file_instances:
+            record = {'table': 'file_table', 'key': fileinstance.filename, 'last_handle': str(fileinstance.lasthandle)}
+            for command in self.file_commands:
+                record[command] = fileinstance.get_attr_val_safe(command)
+            record['handles'] = fileinstance.handles
+            if fileinstance.transfers is not None:
+                record['read_bytes'] = fileinstance.transfers.read_bytes
+                record['write_bytes'] = fileinstance.transfers.write_bytes
+                record['mapped_bytes'] = fileinstance.transfers.mapped_bytes
+                record['transfer_seconds'] = fileinstance.transfers.seconds
+                # calls per power of two bucket of bytes moved, as in transfer_sizes
+                record['transfer_sizes'] = list(fileinstance.transfers.buckets)
+            if fileinstance.latency.count:
+                latency_fields(record, fileinstance.latency)
+            yield record
+
+    def query_records(self, columns, rows):
+        keys = len(columns) - len(EventQuery.orders)
+        for row in rows:
+            record = {'table': 'query', 'key': ' '.join(str(k) for k in row[:keys])}
+            record.update(zip(columns, row))
+            yield record
+
+    def write_report(self, records=None):
+        if records is None:
+            records = self.report_records()
+        if self.output == '-':
+            try:
+                write_records(records, sys.stdout, self.report_format)
+                sys.stdout.flush()
+            except BrokenPipeError:
+                # whatever read the report stopped early, e.g. head
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        else:
+            with open(self.output, 'w', newline='') as fp:
+                write_records(records, fp, self.report_format)
+            print('Report written to {0}'.format(self.output))
 
     def main(self):
-        self.parse_log_file()
-        self.print_summary(True)
+        global debug
+        if debug:
+            StageTimer().attach(self)
+        if self.query is not None:
+            # the log is only parsed when it has changed since the events were stored
+            with contextlib.redirect_stdout(sys.stderr if self.output == '-' else sys.stdout):
+                event_store = EventStore(self.events).open(self.logfile)
+                if event_store.current(self.logfile):
+                    self.event_store = event_store
+                else:
+                    self.parse_log_file()
+                result = self.query_events(self.query)
+            if result is None:
+                sys.exit(1)
+            if self.output is None:
+                print_query(self.query, *result)
+            else:
+                self.write_report(self.query_records(*result))
+            return
+        if self.output is not None:
+            # headless, nothing but the report goes to stdout when it is the output
+            with contextlib.redirect_stdout(sys.stderr if self.output == '-' else sys.stdout):
+                self.parse_log_file()
+            self.write_report()
+            if self.stage_timer is not None:
+                with contextlib.redirect_stdout(sys.stderr if self.output == '-' else sys.stdout):
+                    print_stage_timer('Time spent', self.stage_timer, self.lines)
+            return
+        if self.follow is not None and self.logfile != '-':
+            with open(self.logfile, 'rb') as fp:
+                if detect_compression(fp.read(6)) is not None:
+                    print('A compressed log can\'t be followed, parsing it once instead')
+                    self.follow = None
+        if self.follow is not None:
+            self.follow_log_file()
+        else:
+            self.parse_log_file()
+        self.print_summary()
+        if self.stage_timer is not None:
+            print_stage_timer('Time spent', self.stage_timer, self.lines)
         # open menu in continuous loop
         self.show_options()
 
 if __name__=='__main__':
-    try:
-        logfile = sys.argv[1].strip()
-    except:
+    arg_parser = argparse.ArgumentParser(description='Summarise the system calls in a truss or strace log file')
+    arg_parser.add_argument('logfile', nargs='?', help='log file to parse, "-" reads it from stdin (default: trace.log)')
+    arg_parser.add_argument('debug', nargs='?', choices=['debug'],
+                            help='time each stage of the parse (read, tokenize, classify, file lookup, handles, '
+                                 'aggregate, cache, report) and print where the time went')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1, help='parse the log in this many processes (default: 1)')
+    arg_parser.add_argument('--no-cache', action='store_true', help='don\'t read or write the cache of the parsed log (in ~/.cache/PerfTraceParser)')
+    arg_parser.add_argument('--checkpoint', nargs='?', type=float, const=300, default=None, metavar='SECONDS',
+                            help='save the parse in the cache every SECONDS (default: 300) and when Ctrl-C stops it, '
+                                 'for --resume to carry on from')
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='carry on from the checkpoint of a parse that was stopped or crashed instead of starting again')
+    arg_parser.add_argument('-f', '--follow', nargs='?', type=float, const=2.0, default=None, metavar='SECONDS',
+                            help='keep reading the log as it grows and redraw the top tables every SECONDS (default: 2)')
+    arg_parser.add_argument('--tracer', choices=list(trace_formats), default=None,
+                            help='the tracer that wrote the log (default: worked out from the first lines of it)')
+    arg_parser.add_argument('--top-k', type=int, default=None, metavar='N',
+                            help='bound the memory used by the files, handles, memory addresses and errors counters '
+                                 'by keeping about the N busiest of each, their counts become approximate '
+                                 '(the per file table still keeps every path)')
+    arg_parser.add_argument('--window', type=float, default=1.0, metavar='SECONDS',
+                            help='width of the windows the calls are counted in over time (default: 1), '
+                                 'they get wider on long traces')
+    arg_parser.add_argument('--from', dest='from_time', metavar='TIME',
+                            help='only parse the lines stamped from TIME, in seconds as in the log, "+SECONDS" '
+                                 'after the start of it or a time of day HH:MM[:SS]')
+    arg_parser.add_argument('--to', dest='to_time', metavar='TIME', help='only parse the lines stamped up to TIME')
+    arg_parser.add_argument('--profile', metavar='FILE',
+                            help='run under cProfile, save the stats to FILE and print the top functions to stderr')
+    arg_parser.add_argument('--trace-memory', action='store_true',
+                            help='trace the Python allocations with tracemalloc, the timings end with the biggest ones')
+    arg_parser.add_argument('--compare', nargs='+', metavar='LOG',
+                            help='parse these logs as well, all at once in their own processes, and show how they differ '
+                                 'from the first one instead of opening the menu')
+    arg_parser.add_argument('--events', nargs='?', const='', default=None, metavar='DIR',
+                            help='keep every call in a columnar store in DIR (default: logfile.ptevents) to query it with '
+                                 '[E] or --query without parsing the log again')
+    arg_parser.add_argument('--query', metavar='QUERY',
+                            help='print the result of a query on the stored events and exit, e.g. "path where command=read '
+                                 'duration>0.01 top 20 by seconds", the log is parsed (with --events) first if it has changed')
+    arg_parser.add_argument('--page', type=int, default=None, metavar='ROWS',
+                            help='rows per page of the tables printed to a terminal, 0 to not page (default: the terminal height)')
+    arg_parser.add_argument('--colour', '--color', choices=['auto', 'always', 'never'], default='auto',
+                            help='colour the busiest cells of the associated files table (default: only on a terminal)')
+    arg_parser.add_argument('-o', '--output', metavar='FILE',
+                            help='don\'t open the menu, write every table to FILE ("-" for stdout) and exit')
+    arg_parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                            help='format of the --output report (default: csv for a .csv file, jsonl otherwise)')
+    args = arg_parser.parse_args()
+    if args.logfile is None:
         print('no log specified defaulting to trace.log')
         logfile = 'trace.log'
-    try:
-        if sys.argv[2].strip() == "debug":
-            debug = True
-    except:
-        debug = False
-    app = PerfTracerParser(logfile)
-    app.main()
+    else:
+        logfile = args.logfile.strip()
+    debug = args.debug == 'debug' or args.trace_memory
+    page_rows = max(0, args.page) if args.page is not None else None
+    colour_output = {'auto': None, 'always': True, 'never': False}[args.colour]
+    if args.trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    report_format = args.format
+    if report_format is None:
+        report_format = 'csv' if args.output is not None and args.output.lower().endswith('.csv') else 'jsonl'
+    if args.output is not None and args.follow is not None:
+        print('--follow is ignored with --output, the log is parsed once', file=sys.stderr)
+        args.follow = None
+    time_range = None
+    if args.from_time is not None or args.to_time is not None:
+        for value in [args.from_time, args.to_time]:
+            try:
+                if value is not None:
+                    parse_time(value, 0)
+            except ValueError:
+                arg_parser.error('can\'t read the time {0}'.format(value))
+        time_range = (args.from_time, args.to_time)
+        if args.follow is not None:
+            print('--follow is ignored with --from and --to, the log is parsed once', file=sys.stderr)
+            args.follow = None
+    if args.window <= 0:
+        arg_parser.error('--window has to be more than 0 seconds')
+    events = args.events
+    if events is None and args.query is not None:
+        events = ''
+    if events == '':
+        if logfile == '-':
+            arg_parser.error('--events needs a directory when the log is read from stdin')
+        events = logfile + '.ptevents'
+    if args.query is not None and args.follow is not None:
+        print('--follow is ignored with --query, the log is parsed once', file=sys.stderr)
+        args.follow = None
+    if args.resume and (args.no_cache or logfile == '-'):
+        arg_parser.error('--resume needs the cache of a log file, it can\'t be used with --no-cache or stdin')
+    if args.checkpoint is not None and (args.no_cache or logfile == '-'):
+        arg_parser.error('--checkpoint saves to the cache of a log file, it can\'t be used with --no-cache or stdin')
+    if args.checkpoint is not None and args.checkpoint <= 0:
+        arg_parser.error('--checkpoint has to be more than 0 seconds')
+    if args.resume and events is not None:
+        print('--resume is ignored with --events, the events can\'t be carried on from a checkpoint', file=sys.stderr)
+        args.resume = False
+    if events is not None and (args.follow is not None or args.compare):
+        print('--events is ignored with {0}'.format('--follow' if args.follow is not None else '--compare'), file=sys.stderr)
+        events = None
+    if args.compare:
+        # -j is how many of the logs are parsed at once, each one in a single process
+        logfiles = [logfile] + [k.strip() for k in args.compare]
+        if '-' in logfiles:
+            arg_parser.error('logs to compare have to be files, not stdin')
+        compare_log_files(logfiles, len(logfiles) if args.jobs == 1 else max(1, args.jobs), not args.no_cache,
+                          max(1, args.top_k) if args.top_k is not None else None, args.window, time_range,
+                          args.output, report_format, trace_format=args.tracer)
+        sys.exit(0)
+    app = PerfTracerParser(logfile, jobs=max(1, args.jobs), use_cache=not args.no_cache, follow=args.follow,
+                           output=args.output, report_format=report_format,
+                           top_k=max(1, args.top_k) if args.top_k is not None else None,
+                           window=args.window, time_range=time_range, events=events, query=args.query, trace_format=args.tracer,
+                           checkpoint=args.checkpoint, resume=args.resume)
+    if args.profile is not None:
+        # the menu quits with sys.exit, the stats are written either way
+        import cProfile, pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            app.main()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+    else:
+        app.main()
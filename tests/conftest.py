@@ -0,0 +1,7 @@
+import pytest
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    # every test gets caches of its own, out of the user's
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
@@ -0,0 +1,56 @@
+import contextlib
+import io
+import os
+import shutil
+
+import PerfTraceParser
+
+logs = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+
+def log_path(name):
+    return os.path.join(logs, name)
+
+def copy_log(name, directory, lines=None):
+    # a copy to append to or rewrite, only the first lines of it if asked
+    path = os.path.join(str(directory), name)
+    if lines is None:
+        shutil.copy(log_path(name), path)
+    else:
+        with open(log_path(name), 'rb') as source, open(path, 'wb') as fp:
+            fp.writelines(source.readlines()[:lines])
+    return path
+
+def parse(logfile, min_shard_bytes=None, **kwargs):
+    # parse the log like the command line does, returns the parser and what it printed
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        parser = PerfTraceParser.PerfTracerParser(logfile, **kwargs)
+        if min_shard_bytes is not None:
+            parser.min_shard_bytes = min_shard_bytes
+        parser.parse_log_file()
+    parser.printed = output.getvalue()
+    return parser
+
+def state(parser):
+    # what the tables are made from, to compare two parses of the same lines
+    bytes_state = lambda k: None if k is None else (k.reads, k.writes, k.read_bytes, k.write_bytes, k.mapped_bytes, round(k.seconds, 9), list(k.buckets))
+    result = dict((name, dict(getattr(parser, name))) for name in
+                  ['syscall_commands', 'syscall_files', 'syscall_semaphores', 'syscall_handles', 'syscall_memaddresses',
+                   'syscall_empty', 'syscall_errors', 'syscall_unknown', 'missing_paths', 'handle_bytes', 'call_sequences'])
+    result['files'] = dict((k.filename, dict((c, k.get_attr_val_safe(c)) for c in parser.file_commands)) for k in parser.associated_file_instances)
+    result['file_latency'] = dict((k.filename, (k.latency.count, round(k.latency.total, 9), dict(k.latency.buckets))) for k in parser.associated_file_instances)
+    result['file_transfers'] = dict((k.filename, bytes_state(k.transfers)) for k in parser.associated_file_instances)
+    result['transfers'] = bytes_state(parser.transfers)
+    result['latency'] = dict((k, (v.count, round(v.total, 9), v.max, dict(v.buckets))) for k, v in parser.syscall_latency.items())
+    result['pids'] = dict((k, (v.calls, v.errors, dict(v.syscall_commands), v.latency.count)) for k, v in parser.pid_instances.items())
+    result['handles'] = dict((k, dict(v.handles)) for k, v in parser.fd_tables.items())
+    # the processes table, and which threads share a handle table
+    result['processes'] = dict((k, (len(v.handles), v.peak, v.opened, v.closed, sorted(p for p, t in parser.fd_tables.items() if t is v)))
+                               for k, v in parser.fd_tables.items())
+    result['open_handles'] = parser.open_handles
+    timeline = parser.timeline
+    result['timeline'] = (timeline.window, timeline.first, list(timeline.calls), list(timeline.errors), [round(k, 6) for k in timeline.seconds],
+                          dict((k, list(v[0])) for k, v in timeline.commands.items()))
+    result['lines'] = parser.lines
+    result['timestamps'] = (parser.first_timestamp, parser.last_timestamp)
+    return result
@@ -0,0 +1,77 @@
+import os
+import pickle
+import stat
+
+import PerfTraceParser
+from tests.support import copy_log, log_path, parse, state
+
+def test_cache_reused(tmp_path):
+    logfile = copy_log('strace.log', tmp_path)
+    first = parse(logfile, use_cache=True)
+    again = parse(logfile, use_cache=True)
+    assert 'Loaded the parsed log' in again.printed
+    assert state(again) == state(first)
+
+def test_appended_lines_parsed(tmp_path):
+    logfile = copy_log('strace.log', tmp_path, lines=300)
+    parse(logfile, use_cache=True)
+    with open(log_path('strace.log'), 'rb') as source, open(logfile, 'ab') as fp:
+        fp.writelines(source.readlines()[300:])
+    appended = parse(logfile, use_cache=True)
+    assert 'bytes added to the log since it was cached' in appended.printed
+    assert state(appended) == state(parse(log_path('strace.log')))
+
+def test_rewritten_log_parsed_again(tmp_path):
+    logfile = copy_log('strace.log', tmp_path)
+    parse(logfile, use_cache=True)
+    with open(logfile, 'rb') as fp:
+        lines = fp.readlines()
+    with open(logfile, 'wb') as fp:
+        fp.writelines(reversed(lines))
+    rewritten = parse(logfile, use_cache=True)
+    assert 'Loaded the parsed log' not in rewritten.printed
+    assert rewritten.syscall_commands == parse(logfile).syscall_commands
+
+def test_no_cache(tmp_path):
+    logfile = copy_log('strace.log', tmp_path)
+    parse(logfile)
+    assert 'Loaded the parsed log' not in parse(logfile, use_cache=True).printed
+
+def test_cache_kept_privately(tmp_path, cache_home):
+    logfile = copy_log('strace.log', tmp_path)
+    parser = parse(logfile, use_cache=True)
+    assert os.path.dirname(parser.cache_path()) == str(cache_home / 'PerfTraceParser')
+    assert not [k for k in os.listdir(str(tmp_path)) if k.endswith('.ptcache')]
+    assert stat.S_IMODE(os.stat(os.path.dirname(parser.cache_path())).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(parser.cache_path()).st_mode) == 0o600
+
+def test_same_name_other_directory(tmp_path):
+    os.mkdir(str(tmp_path / 'a'))
+    os.mkdir(str(tmp_path / 'b'))
+    first = parse(copy_log('strace.log', tmp_path / 'a'), use_cache=True)
+    other = parse(copy_log('handles.log', tmp_path / 'b'), use_cache=True)
+    assert first.cache_path() != other.cache_path()
+
+def test_cache_others_can_write_ignored(tmp_path):
+    logfile = copy_log('strace.log', tmp_path)
+    parser = parse(logfile, use_cache=True)
+    os.chmod(parser.cache_path(), 0o666)
+    again = parse(logfile, use_cache=True)
+    assert 'other users can write to it' in again.printed
+    assert 'Loaded the parsed log' not in again.printed
+
+class Remove():
+    def __reduce__(self):
+        return (os.remove, (self.path,))
+
+def test_cache_only_loads_parser_classes(tmp_path):
+    logfile = copy_log('strace.log', tmp_path)
+    parser = parse(logfile, use_cache=True)
+    victim = Remove()
+    victim.path = str(tmp_path / 'victim')
+    open(victim.path, 'w').close()
+    with open(parser.cache_path(), 'wb') as fp:
+        pickle.dump({'version': PerfTraceParser.cache_version, 'top_k': None, 'window': 1.0, 'evil': victim}, fp)
+    again = parse(logfile, use_cache=True)
+    assert 'is not allowed in a cache' in again.printed
+    assert os.path.exists(victim.path)
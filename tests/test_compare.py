@@ -0,0 +1,63 @@
+import json
+import os
+
+import pytest
+
+import PerfTraceParser
+
+before = ('100 1.0 openat(AT_FDCWD, "/a", O_RDONLY) = 3 <0.1>\n'
+          '100 1.1 read(3, "xx", 2) = 2 <0.2>\n'
+          '100 1.2 stat("/gone", 0x7ffc) = -1 ENOENT (No such file or directory) <0.1>\n'
+          '100 2.0 close(3) = 0 <0.1>\n')
+after = ('100 1.0 openat(AT_FDCWD, "/a", O_RDONLY) = 3 <0.1>\n'
+         '100 1.1 read(3, "xx", 2) = 2 <0.5>\n'
+         '100 1.2 read(3, "xx", 2) = 2 <0.5>\n'
+         '100 1.3 openat(AT_FDCWD, "/new", O_RDONLY) = 4 <0.1>\n'
+         '100 1.4 close(4) = 0 <0.1>\n'
+         '100 2.0 close(3) = 0 <0.1>\n')
+
+def compare(tmp_path, logfiles, use_cache=False, time_range=None):
+    # the records of the comparison, parsed in worker processes like --compare does
+    output = str(tmp_path / 'compare.jsonl')
+    PerfTraceParser.compare_log_files(logfiles, len(logfiles), use_cache, None, 1.0, time_range, output, 'jsonl')
+    with open(output) as fp:
+        return dict(((record['table'], record['key']), record) for record in map(json.loads, fp))
+
+def write_log(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+def test_compare(tmp_path):
+    records = compare(tmp_path, [write_log(tmp_path, 'before.log', before), write_log(tmp_path, 'after.log', after)])
+    assert records[('compare_totals', 'calls')] == {'table': 'compare_totals', 'key': 'calls', 'value:before.log': 4,
+                                                    'value:after.log': 6, 'change': 2}
+    assert records[('compare_totals', 'errors')]['change'] == -1
+    assert records[('compare_commands', 'read')]['change'] == 1
+    assert records[('compare_commands', 'stat')]['change'] == -1
+    assert records[('compare_command_seconds', 'read')]['change'] == pytest.approx(0.8)
+    # with -T the files are compared by the time spent on them
+    assert records[('compare_new_files', '/new')]['seconds:before.log'] is None
+    assert records[('compare_new_files', '/new')]['change'] == pytest.approx(0.2)
+    assert records[('compare_gone_files', '/gone')]['change'] == pytest.approx(-0.1)
+    assert records[('compare_files', '/a')]['change'] == pytest.approx(0.8)
+    assert records[('compare_errors', '-1 ENOENT (No such file or directory)')]['per_1000_calls:before.log'] == 250.0
+    assert records[('compare_errors', '-1 ENOENT (No such file or directory)')]['change'] == -250.0
+
+def test_compare_with_itself(tmp_path, cache_home):
+    # both workers parse the same log and save the same cache at once
+    logfile = write_log(tmp_path, 'before.log', before)
+    records = compare(tmp_path, [logfile, logfile], use_cache=True)
+    assert all(record['change'] == 0 for record in records.values() if 'change' in record)
+    cache_files = os.listdir(str(cache_home / 'PerfTraceParser'))
+    assert len(cache_files) == 1 and cache_files[0].endswith('.ptcache')
+
+def test_compare_failed_parse(tmp_path, capsys):
+    # the log without timestamps can't be cut to a time range, which is said rather than exiting quietly
+    untimed = write_log(tmp_path, 'untimed.log', 'open("/a", O_RDONLY) = 3\nclose(3) = 0\n')
+    with pytest.raises(SystemExit) as exit_info:
+        compare(tmp_path, [write_log(tmp_path, 'before.log', before), untimed], time_range=('+0.1', None))
+    assert exit_info.value.code == 1
+    error = capsys.readouterr().err
+    assert 'Could not parse {0}:'.format(untimed) in error and 'the log has no timestamps' in error
+    assert 'before.log' not in error
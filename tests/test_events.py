@@ -0,0 +1,79 @@
+import contextlib
+import io
+import json
+import os
+
+import pytest
+
+import PerfTraceParser
+from tests.support import copy_log, log_path, parse
+
+queries = ['command', 'path where command=read', 'second,command where error=*ENOENT*', 'pid,fd where duration>0.0001 top 50 by max',
+           'dir top 50', 'retval where command=read top 100', 'thread where command!=read by errors',
+           'path,command where fd>=3 and duration<0.0003 top 1000']
+
+def build_store(logfile, **kwargs):
+    parser = parse(logfile, events=logfile + '.ptevents', **kwargs)
+    return PerfTraceParser.EventStore(logfile + '.ptevents').open(logfile), parser
+
+def rounded(rows):
+    # the sums are added up in another order by numpy
+    return [tuple(round(k, 12) if isinstance(k, float) else k for k in row) for row in rows]
+
+def run_query(store, text, scan_columns=False):
+    query = PerfTraceParser.EventQuery(text, 10, store.first_timestamp)
+    if scan_columns:
+        query.scan = query.scan_columns
+    columns, rows = query.run(store)
+    return columns, rounded(rows)
+
+@pytest.mark.parametrize('text', queries)
+def test_numpy_matches_scan(tmp_path, text):
+    pytest.importorskip('numpy')
+    store, parser = build_store(copy_log('strace.log', tmp_path))
+    # a row per call
+    assert store.events() == sum(parser.syscall_commands.values())
+    columns, rows = run_query(store, text)
+    assert rows
+    assert run_query(store, text, scan_columns=True) == (columns, rows)
+
+def test_glob_characters_in_values(tmp_path):
+    store, parser = build_store(copy_log('handles.log', tmp_path))
+    for scan_columns in [False, True]:
+        # equal to the value even though the brackets would be a set of characters in a glob
+        assert run_query(store, 'path where path=pipe:[7,8]', scan_columns)[1] == [('pipe:[7,8]', 2, 0, 0.00002, 0.00001, 0.00001)]
+        assert [row[0] for row in run_query(store, 'path where path=/srv/dir/* top 20', scan_columns)[1]] == ['/srv/dir/a.txt', '/srv/dir/b.txt']
+
+def test_appended_segment(tmp_path):
+    # a log that has grown gets its new lines in a second segment, the queries add them up
+    (tmp_path / 'grown').mkdir()
+    (tmp_path / 'whole').mkdir()
+    grown = copy_log('strace.log', tmp_path / 'grown', lines=300)
+    build_store(grown, use_cache=True)
+    with open(log_path('strace.log'), 'rb') as source, open(grown, 'ab') as fp:
+        fp.writelines(source.readlines()[300:])
+    store, parser = build_store(grown, use_cache=True)
+    assert 'added to the log since it was cached' in parser.printed
+    assert len(store.segment_names) == 2 and store.current(grown)
+    whole, parser = build_store(copy_log('strace.log', tmp_path / 'whole'))
+    assert len(whole.segment_names) == 1 and store.events() == whole.events()
+    for text in queries:
+        for scan_columns in [False, True]:
+            assert run_query(store, text, scan_columns) == run_query(whole, text, scan_columns)
+
+def test_query_from_stored_events(tmp_path):
+    # --query on a log that hasn't changed reads the events without parsing it again
+    logfile = copy_log('strace.log', tmp_path)
+    store, parser = build_store(logfile, use_cache=True)
+    output = str(tmp_path / 'query.jsonl')
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        PerfTraceParser.PerfTracerParser(logfile, use_cache=True, events=logfile + '.ptevents', query='command top 5',
+                                         output=output).main()
+    assert 'Parsing' not in printed.getvalue()
+    with open(output) as fp:
+        records = [json.loads(line) for line in fp]
+    columns, rows = run_query(store, 'command top 5')
+    assert [record['command'] for record in records] == [row[0] for row in rows][:5]
+    assert [record['calls'] for record in records] == [row[1] for row in rows][:5]
+    assert sorted(os.listdir(logfile + '.ptevents')) == ['0000000000000000-parse', 'store.json']
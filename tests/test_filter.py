@@ -0,0 +1,61 @@
+import pytest
+
+import PerfTraceParser
+from tests.support import log_path, parse
+
+class File():
+    def __init__(self, filename):
+        self.filename = filename
+
+def search(index, text):
+    return [index.names[file_id] for file_id in index.search(text)]
+
+@pytest.fixture
+def index():
+    index = PerfTraceParser.FilenameIndex()
+    index.update(parse(log_path('handles.log')).associated_file_instances)
+    return index
+
+def test_substring(index):
+    assert search(index, 'A.TXT') == ['/srv/dir/a.txt']
+    # common enough that every name is tested rather than finding each match
+    assert search(index, '/srv/d') == ['/srv/dir', '/srv/dir/a.txt', '/srv/dir/b.txt', '/srv/d.txt']
+    assert search(index, 'nothing') == []
+
+def test_glob_characters_in_names(index):
+    # taken literally when a name has them
+    assert search(index, 'pipe:[7') == ['pipe:[7,8]']
+    assert search(index, 'socket:[af_inet]') == ['socket:[af_inet]']
+    assert search(index, '[7,8]') == ['pipe:[7,8]']
+
+def test_glob(index):
+    assert search(index, '/srv/*.txt') == ['/srv/dir/a.txt', '/srv/dir/b.txt', '/srv/c.txt', '/srv/d.txt', '/srv/e.txt', '/srv/f.txt']
+    assert search(index, '/srv/[cd].txt') == ['/srv/c.txt', '/srv/d.txt']
+    assert search(index, '*[!a-z].txt') == []
+    assert search(index, '*:[*') == ['socket:[af_inet]', 'pipe:[7,8]']
+    assert search(index, '?ipe*') == ['pipe:[7,8]']
+    assert search(index, '*') == index.names
+
+def test_prefixed(index):
+    assert [index.names[file_id] for file_id in index.prefixed('/srv/dir')] == ['/srv/dir', '/srv/dir/a.txt', '/srv/dir/b.txt']
+    assert index.prefixed('/var') == []
+    # only the files added since are indexed, the sorted names are rebuilt
+    index.update([File(name) for name in index.names] + [File('/srv/dir/z.txt'), File('/var/log/x.log')])
+    assert [index.names[file_id] for file_id in index.prefixed('/srv/dir/')] == ['/srv/dir/a.txt', '/srv/dir/b.txt', '/srv/dir/z.txt']
+    assert search(index, '/var/*') == ['/var/log/x.log']
+
+def test_directory_rollup():
+    parser = parse(log_path('handles.log'))
+    directories = PerfTraceParser.directory_rollup(parser.associated_file_instances, parser.file_commands, 'read')
+    assert sorted(directories) == ['.', '/', '/srv', '/srv/dir']
+    # files, calls, seconds and reads, each directory with everything below it
+    assert directories['/srv/dir'][:2] + directories['/srv/dir'][3:] == [2, 21, 5]
+    assert directories['/srv'][:2] + directories['/srv'][3:] == [8, 44, 8]
+    assert directories['/'][:2] == directories['/srv'][:2]
+    assert directories['/srv/dir'][2] == pytest.approx(0.00017)
+    assert directories['/srv'][2] == pytest.approx(0.000295)
+    # the socket and the pipe aren't under any directory
+    assert directories['.'] == [2, 6, pytest.approx(0.00004), 1]
+    # a field no file has counts nothing
+    directories = PerfTraceParser.directory_rollup(parser.associated_file_instances, parser.file_commands, 'mmap')
+    assert directories['/srv'][3] == 0
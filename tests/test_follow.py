@@ -0,0 +1,50 @@
+import contextlib
+import io
+import threading
+import time
+
+import PerfTraceParser
+from tests.support import copy_log, log_path, parse, state
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def test_follow_append_and_truncate(tmp_path):
+    with open(log_path('strace.log'), 'rb') as fp:
+        lines = fp.readlines()
+    logfile = copy_log('strace.log', tmp_path, lines=100)
+    parser = PerfTraceParser.PerfTracerParser(logfile, use_cache=True, follow=0.05)
+    printed = io.StringIO()
+    def follow():
+        with contextlib.redirect_stdout(printed):
+            parser.follow_log_file()
+    thread = threading.Thread(target=follow)
+    thread.start()
+    try:
+        wait_for(lambda: parser.lines == 100)
+        with open(logfile, 'ab') as fp:
+            fp.writelines(lines[100:300])
+        wait_for(lambda: parser.lines == 300)
+        # the timeline is only sampled when it stops
+        (tmp_path / 'whole').mkdir()
+        expected = state(parse(copy_log('strace.log', tmp_path / 'whole', lines=300)))
+        assert dict(state(parser), timeline=None) == dict(expected, timeline=None)
+        # rewritten with another, shorter log, nothing of the old one is kept
+        with open(logfile, 'wb') as fp:
+            fp.writelines(lines[300:350])
+        wait_for(lambda: 'The log was truncated' in printed.getvalue() and parser.lines == 50)
+    finally:
+        parser.early_stop = True
+        thread.join()
+    part = str(tmp_path / 'part.log')
+    with open(part, 'wb') as fp:
+        fp.writelines(lines[300:350])
+    expected = state(parse(part))
+    assert state(parser) == expected
+    # and the cache saved when it stopped is of the new log alone
+    cached = parse(logfile, use_cache=True)
+    assert 'Parsing trace log' not in cached.printed
+    assert state(cached) == expected
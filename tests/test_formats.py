@@ -0,0 +1,93 @@
+import gzip
+import shutil
+
+import pytest
+
+import PerfTraceParser
+from tests.support import log_path, parse, state
+
+def file_counts(parser):
+    return dict((k.filename, dict((c, k.get_attr_val_safe(c)) for c in parser.file_commands if k.get_attr_val_safe(c)))
+                for k in parser.associated_file_instances)
+
+@pytest.mark.parametrize('name', ['strace', 'truss', 'ltrace', 'perf'])
+def test_sniffed(name):
+    assert PerfTraceParser.sniff_trace_format(PerfTraceParser.log_head(log_path(name + '.log'))).name == name
+    parser = parse(log_path(name + '.log'))
+    assert parser.trace_format.name == name
+    assert parser.unparsed_lines == 0
+
+def test_sniffed_compressed(tmp_path):
+    logfile = str(tmp_path / 'perf.log.gz')
+    with open(log_path('perf.log'), 'rb') as source, gzip.open(logfile, 'wb') as fp:
+        shutil.copyfileobj(source, fp)
+    parser = parse(logfile)
+    assert parser.trace_format.name == 'perf'
+    assert state(parser) == state(parse(log_path('perf.log')))
+
+def test_truss():
+    parser = parse(log_path('truss.log'))
+    # the "(sleeping...)" line is finished by the next one, the signal line is skipped
+    assert parser.syscall_commands == {'kopen': 2, 'kread': 3, 'statx': 1, 'kwrite': 1, 'kfcntl': 1, 'close': 1}
+    # only Err# is an error, not a negative return value
+    assert parser.syscall_errors == {'Err#2  ENOENT': 1, 'Err#11 EAGAIN': 1}
+    assert file_counts(parser) == {'/etc/x': {'kopen': 1, 'handle': 1, 'kread': 1, 'small_io': 1, 'kfcntl': 1, 'close': 1},
+                                   '/no': {'statx': 1, 'error': 1},
+                                   '/etc/y': {'kopen': 1, 'handle': 1, 'kread': 2, 'small_io': 1, 'kwrite': 1}}
+    assert sorted(parser.pid_instances) == ['4194494', '4194494/1', '4194494/2']
+    # the threads share the handles of the process, kfcntl without F_DUPFD opens nothing
+    fd_table = parser.fd_tables['4194494']
+    assert (fd_table.handles, fd_table.peak, fd_table.opened, fd_table.closed) == ({'4': '/etc/y'}, 2, 2, 1)
+    assert (parser.first_timestamp, parser.last_timestamp) == (0.0, 0.0036)
+    assert (parser.transfers.read_bytes, parser.transfers.write_bytes) == (10, 5)
+
+def test_ltrace():
+    parser = parse(log_path('ltrace.log'))
+    # SYS_ is taken off the system calls, the library calls are counted too
+    assert parser.syscall_commands == {'setlocale': 1, 'fopen': 1, 'openat': 2, 'read': 1, 'malloc': 1, 'strlen': 1,
+                                       'free': 1, 'fclose': 1, 'close': 1}
+    # a system call returning -errno is an error
+    assert parser.syscall_errors == {'-1 ENOENT (No such file or directory)': 1}
+    assert parser.missing_paths == {'/nonexistent': 1}
+    assert file_counts(parser)['/etc/hosts'] == {'handle': 1, 'openat': 1, 'read': 1, 'small_io': 1, 'close': 1}
+    # the unfinished fclose gets the time from the resumed line
+    assert parser.syscall_latency['fclose'].count == 1
+    assert parser.syscall_latency['fclose'].total == pytest.approx(0.0001)
+    assert sorted(parser.pid_instances) == ['1234', '1235']
+    # the process exited, so its handles went with it
+    assert '1234' not in parser.fd_tables
+    assert parser.open_handles == 0
+
+def test_perf():
+    parser = parse(log_path('perf.log'))
+    assert parser.syscall_commands == {'openat': 2, 'read': 2, 'close': 1, 'open': 1, 'lseek': 1, 'mmap': 1, 'poll': 1}
+    # lseek returning -5 without an errno is an offset, not an error
+    assert parser.syscall_errors == {'-1 ENOENT (No such file or directory)': 1}
+    # named arguments, quoted or not, and the path perf puts after the handle
+    assert file_counts(parser) == {'/etc/ld.so.cache': {'openat': 1, 'handle': 1, 'read': 1, 'close': 1},
+                                   '/nonexistent': {'openat': 1, 'error': 1},
+                                   '/etc/hosts': {'handle': 1, 'read': 1, 'open': 1, 'lseek': 1}}
+    # the times are in milliseconds
+    assert (parser.first_timestamp, parser.last_timestamp) == (0.0, pytest.approx(0.00008))
+    assert parser.syscall_latency['openat'].total == pytest.approx(0.000007)
+    # the continued poll gets the time of the whole call
+    assert parser.syscall_latency['poll'].total == pytest.approx(0.01)
+    files = dict((k.filename, k) for k in parser.associated_file_instances)
+    assert (files['/etc/hosts'].transfers.read_bytes, files['/etc/hosts'].transfers.mapped_bytes) == (120, 4096)
+    assert parser.fd_tables['12345'].handles == {'4': '/etc/hosts'}
+
+def test_negative_return_value_strace(tmp_path):
+    logfile = tmp_path / 'neg.log'
+    logfile.write_text('1234 1500000000.100000 open("/tmp/a", O_RDONLY) = 3 <0.000010>\n'
+                       '1234 1500000000.100100 lseek(3, -5, SEEK_END) = -5 <0.000010>\n'
+                       '1234 1500000000.100200 read(3, "x", 1) = -1 EAGAIN (Resource temporarily unavailable) <0.000010>\n')
+    parser = parse(str(logfile))
+    assert parser.syscall_errors == {'-1 EAGAIN (Resource temporarily unavailable)': 1}
+    assert parser.pid_instances['1234'].errors == 1
+
+@pytest.mark.parametrize('name', ['truss', 'ltrace', 'perf'])
+def test_shards_match_serial(name):
+    serial = parse(log_path(name + '.log'))
+    parallel = parse(log_path(name + '.log'), jobs=2, min_shard_bytes=128)
+    assert 'shards with' in parallel.printed
+    assert state(parallel) == state(serial)
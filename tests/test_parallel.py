@@ -0,0 +1,70 @@
+import pytest
+
+from tests.support import log_path, parse, state
+
+@pytest.mark.parametrize('jobs, min_shard_bytes', [(2, 8192), (3, 2048), (4, 1024)])
+def test_shards_match_serial(jobs, min_shard_bytes):
+    serial = parse(log_path('strace.log'))
+    parallel = parse(log_path('strace.log'), jobs=jobs, min_shard_bytes=min_shard_bytes)
+    assert 'shards with' in parallel.printed
+    assert state(parallel) == state(serial)
+
+@pytest.mark.parametrize('jobs', [2, 4])
+def test_shared_handle_tables(jobs):
+    # forks, threads, dups and closes of handles opened in an earlier shard
+    serial = parse(log_path('handles.log'))
+    parallel = parse(log_path('handles.log'), jobs=jobs, min_shard_bytes=256)
+    assert 'shards with' in parallel.printed
+    assert state(parallel) == state(serial)
+
+def test_peak_across_shards(tmp_path):
+    # opened in one shard and closed in the next, the peak is what was open at once
+    logfile = tmp_path / 'peak.log'
+    lines = ['100 1.{0:03d} open("/f{0}", O_RDONLY) = {1} <0.1>\n'.format(k, k + 3) for k in range(40)]
+    lines += ['100 2.{0:03d} close({1}) = 0 <0.1>\n'.format(k, k + 3) for k in range(40)]
+    lines += ['100 3.{0:03d} open("/g{0}", O_RDONLY) = {1} <0.1>\n'.format(k, k + 3) for k in range(30)]
+    logfile.write_text(''.join(lines))
+    serial = parse(str(logfile))
+    assert serial.fd_tables['100'].peak == 40
+    for min_shard_bytes in [512, 1024, 2048]:
+        parallel = parse(str(logfile), jobs=4, min_shard_bytes=min_shard_bytes)
+        assert state(parallel)['processes'] == state(serial)['processes'] == {'100': (30, 40, 70, 40, ['100'])}
+
+def test_closed_before_opened(tmp_path):
+    # handles opened before the trace started are closed in a later shard than the one that opens the next
+    logfile = tmp_path / 'early.log'
+    lines = ['100 1.{0:03d} read({1}, "x", 1) = 1 <0.1>\n'.format(k, k + 3) for k in range(20)]
+    lines += ['100 2.{0:03d} close({1}) = 0 <0.1>\n'.format(k, k + 3) for k in range(20)]
+    lines += ['100 3.{0:03d} open("/f{0}", O_RDONLY) = {1} <0.1>\n'.format(k, k + 3) for k in range(10)]
+    lines += ['100 4.{0:03d} open("/g{0}", O_RDONLY) = {1} <0.1>\n'.format(k, k + 13) for k in range(5)]
+    logfile.write_text(''.join(lines))
+    serial = parse(str(logfile))
+    assert serial.fd_tables['100'].peak == 15
+    for min_shard_bytes in [256, 512, 1024]:
+        parallel = parse(str(logfile), jobs=4, min_shard_bytes=min_shard_bytes)
+        assert state(parallel)['processes'] == state(serial)['processes']
+
+def test_threads_and_forks_across_shards(tmp_path):
+    # the threads that were running share the handles, a forked child and its threads have their own
+    # even in the shards after the one that forked it
+    logfile = tmp_path / 'threads.log'
+    lines = ['101 1.0 openat(AT_FDCWD, "/a", O_RDONLY) = 3 <0.1>\n',
+             '101 1.1 clone(child_stack=NULL, flags=CLONE_CHILD_CLEARTID|SIGCHLD) = 200 <0.1>\n',
+             '200 1.2 clone(child_stack=0x7f, flags=CLONE_VM|CLONE_FILES|CLONE_THREAD) = 201 <0.1>\n']
+    lines += ['102 2.{0:03d} read(3, "x", 1) = 1 <0.1>\n'.format(k) for k in range(20)]
+    lines += ['201 3.0 close(3) = 0 <0.1>\n',
+              '200 3.1 openat(AT_FDCWD, "/b", O_RDONLY) = 3 <0.1>\n']
+    lines += ['103 4.{0:03d} read(3, "x", 1) = 1 <0.1>\n'.format(k) for k in range(20)]
+    lines += ['201 5.{0:03d} read(3, "x", 1) = 1 <0.1>\n'.format(k) for k in range(10)]
+    lines += ['102 6.0 close(3) = 0 <0.1>\n']
+    logfile.write_text(''.join(lines))
+    serial = parse(str(logfile))
+    files = dict((k.filename, k) for k in serial.associated_file_instances)
+    assert files['/a'].get_attr_val_safe('read') == 40
+    assert files['/b'].get_attr_val_safe('read') == 10
+    assert 'read' not in serial.syscall_unknown and 'close' not in serial.syscall_unknown
+    assert state(serial)['handles'] == {'101': {}, '102': {}, '103': {}, '200': {'3': '/b'}, '201': {'3': '/b'}}
+    for jobs, min_shard_bytes in [(2, 512), (4, 256)]:
+        parallel = parse(str(logfile), jobs=jobs, min_shard_bytes=min_shard_bytes)
+        assert 'shards with' in parallel.printed
+        assert state(parallel) == state(serial)
@@ -0,0 +1,82 @@
+from tests.support import log_path, parse
+
+def test_handles_log():
+    parser = parse(log_path('handles.log'))
+    assert parser.lines == 39
+    assert parser.syscall_commands == {'openat': 7, 'socket': 1, 'pipe': 1, 'dup': 1, 'dup2': 1, 'fcntl': 2, 'read': 10,
+                                       'clone': 2, 'close': 9, 'write': 2, 'stat': 1, 'exit_group': 1}
+    assert parser.syscall_errors == {'-1 EBADF (Bad file descriptor)': 1, '-1 ENOENT (No such file or directory)': 1}
+    assert parser.missing_paths == {'/srv/missing': 1}
+    # openat relative to a directory handle gets the directory's path
+    assert '/srv/dir/a.txt' in parser.syscall_files and '/srv/dir/b.txt' in parser.syscall_files
+    files = dict((k.filename, k) for k in parser.associated_file_instances)
+    # through the dup, dup2 and F_DUPFD copies and by the forked child, not the read after it was closed
+    assert files['/srv/dir/a.txt'].get_attr_val_safe('read') == 4
+    assert files['/srv/dir/b.txt'].get_attr_val_safe('read') == 1
+    assert files['pipe:[7,8]'].get_attr_val_safe('read') == 1
+    assert files['pipe:[7,8]'].get_attr_val_safe('write') == 1
+    assert sorted(parser.pid_instances) == ['100', '200', '300']
+
+def test_handle_tables():
+    parser = parse(log_path('handles.log'))
+    # the child exited, the thread shares the table of its process
+    assert sorted(parser.fd_tables) == ['100', '300']
+    assert parser.fd_tables['100'] is parser.fd_tables['300']
+    assert parser.fd_tables['100'].handles == {'3': '/srv/dir', '6': 'socket:[AF_INET]', '7': 'pipe:[7,8]', '8': 'pipe:[7,8]'}
+    assert parser.open_handles == 4
+
+def test_generated_log():
+    parser = parse(log_path('strace.log'))
+    with open(log_path('strace.log')) as fp:
+        lines = fp.read().splitlines()
+    assert parser.lines == len(lines)
+    # an unfinished call is counted once, when it is resumed
+    assert sum(parser.syscall_commands.values()) == len(lines) - sum(1 for k in lines if 'unfinished' in k)
+    assert sum(parser.syscall_errors.values()) == sum(1 for k in lines if '= -1 ' in k)
+    assert sorted(parser.pid_instances) == ['4000', '4001', '4002']
+    assert parser.first_timestamp == float(lines[0].split()[1])
+    assert parser.trace_format.name == 'strace'
+
+def test_fcntl_without_dup(tmp_path):
+    # only F_DUPFD makes a new handle, whichever fcntl it goes through
+    for command in ['fcntl', 'fcntl64', 'kfcntl']:
+        logfile = tmp_path / '{0}.log'.format(command)
+        logfile.write_text('100 1.0 open("/a", O_RDWR) = 3 <0.1>\n'
+                           '100 1.1 {0}(3, F_GETFL) = 32770 <0.1>\n'
+                           '100 1.2 {0}(3, F_SETFD, FD_CLOEXEC) = 0 <0.1>\n'
+                           '100 1.3 {0}(3, F_DUPFD, 10) = 10 <0.1>\n'
+                           '100 1.4 close(10) = 0 <0.1>\n'
+                           '100 1.5 close(3) = 0 <0.1>\n'.format(command))
+        parser = parse(str(logfile))
+        fd_table = parser.fd_tables['100']
+        assert (len(fd_table.handles), fd_table.peak, fd_table.opened, fd_table.closed) == (0, 2, 2, 2)
+        assert parser.open_handles == 0
+
+def test_handles_above_fd_limit(tmp_path):
+    # counted with the semaphores like before, but still opened and closed in the handle table
+    logfile = tmp_path / 'high.log'
+    logfile.write_text('100 1.0 open("/a", O_RDONLY) = 1100 <0.1>\n'
+                       '100 1.1 read(1100, "x", 1) = 1 <0.1>\n'
+                       '100 1.2 close(1100) = 0 <0.1>\n'
+                       '100 1.3 open("/b", O_RDONLY) = 1100 <0.1>\n')
+    parser = parse(str(logfile))
+    assert parser.syscall_semaphores == {'1100': 2}
+    fd_table = parser.fd_tables['100']
+    assert fd_table.handles == {'1100': '/b'}
+    assert (fd_table.peak, fd_table.opened, fd_table.closed) == (1, 2, 1)
+    assert parser.open_handles == 1
+
+def test_threads_share_handles(tmp_path):
+    # strace -f -p prints thread ids, the threads running before it attached have no clone lines
+    logfile = tmp_path / 'threads.log'
+    logfile.write_text('101 1.0 openat(AT_FDCWD, "/a", O_RDONLY) = 3 <0.1>\n'
+                       '102 1.1 read(3, "x", 1) = 1 <0.1>\n'
+                       '103 1.2 read(3, "x", 1) = 1 <0.1>\n'
+                       '102 1.3 close(3) = 0 <0.1>\n')
+    parser = parse(str(logfile))
+    files = dict((k.filename, k) for k in parser.associated_file_instances)
+    assert files['/a'].get_attr_val_safe('read') == 2
+    assert parser.syscall_unknown == {}
+    assert parser.fd_tables['101'] is parser.fd_tables['102'] is parser.fd_tables['103']
+    assert parser.fd_tables['101'].handles == {}
+    assert parser.open_handles == 0
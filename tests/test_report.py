@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+import subprocess
+import sys
+
+import PerfTraceParser
+from tests.support import copy_log, log_path, parse
+
+def run_report(args):
+    # the command line with the report on stdout, the progress goes to stderr
+    run = subprocess.run([sys.executable, PerfTraceParser.__file__] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         universal_newlines=True)
+    assert run.returncode == 0, run.stderr
+    return run.stdout
+
+def read_jsonl(text):
+    return [json.loads(line) for line in text.splitlines()]
+
+def read_csv(text):
+    rows = list(csv.reader(io.StringIO(text)))
+    assert rows[0] == ['table', 'key', 'field', 'value']
+    return rows[1:]
+
+def csv_rows(records):
+    # what the CSV writer makes of each JSON Lines record
+    rows = []
+    for record in records:
+        for field, value in record.items():
+            if field in ('table', 'key'):
+                continue
+            if isinstance(value, list):
+                value = ' '.join(str(k) for k in value)
+            rows.append([record['table'], str(record['key']), field, '' if value is None else str(value)])
+    return rows
+
+def by_table(records, table):
+    return dict((record['key'], record) for record in records if record['table'] == table)
+
+def test_jsonl_report(tmp_path):
+    output = str(tmp_path / 'report.jsonl')
+    parser = parse(log_path('handles.log'), output=output)
+    parser.write_report()
+    with open(output) as fp:
+        records = read_jsonl(fp.read())
+    assert all('table' in record and 'key' in record for record in records)
+    summary = by_table(records, 'summary')[log_path('handles.log')]
+    assert (summary['lines'], summary['trace_format'], summary['files'], summary['complete']) == (39, 'strace', 10, True)
+    assert dict((key, record['count']) for key, record in by_table(records, 'commands').items()) == parser.syscall_commands
+    files = by_table(records, 'file_table')
+    assert list(files) == [fileinstance.filename for fileinstance in parser.associated_file_instances]
+    assert files['/srv/dir/a.txt']['read'] == 4 and files['/srv/dir/a.txt']['read_bytes'] == 9
+    assert by_table(records, 'processes')['100,300'] == {'table': 'processes', 'key': '100,300', 'open': 4, 'peak': 10,
+                                                          'opened': 12, 'closed': 8}
+
+def test_csv_report_matches_jsonl(tmp_path):
+    # every field of every record, lists joined with spaces
+    parser = parse(log_path('handles.log'), output=str(tmp_path / 'report.csv'), report_format='csv')
+    parser.write_report()
+    with open(str(tmp_path / 'report.csv'), newline='') as fp:
+        rows = read_csv(fp.read())
+    assert rows == csv_rows(parser.report_records())
+    assert ['file_table', '/srv/dir/a.txt', 'read', '4'] in rows
+
+def test_stdout_report(tmp_path):
+    logfile = copy_log('handles.log', tmp_path)
+    records = read_jsonl(run_report([logfile, '-o', '-']))
+    parser = parse(logfile)
+    assert records == list(parser.report_records())
+    rows = read_csv(run_report([logfile, '-o', '-', '--format', 'csv']))
+    assert rows == csv_rows(records)
+
+def test_time_range_report(tmp_path):
+    # only the lines from 1.1ms to 2.1ms after the first one
+    with open(log_path('handles.log')) as fp:
+        lines = fp.readlines()
+    part = str(tmp_path / 'part.log')
+    with open(part, 'w') as fp:
+        fp.writelines(lines[10:21])
+    records = read_jsonl(run_report([log_path('handles.log'), '--from', '+0.00095', '--to', '+0.00205', '-o', '-']))
+    expected = read_jsonl(run_report([part, '-o', '-']))
+    assert by_table(records, 'summary')[log_path('handles.log')]['lines'] == 11
+    # the same records but for the name of the log
+    assert [record for record in records if record['key'] != log_path('handles.log')] == \
+           [record for record in expected if record['key'] != part]
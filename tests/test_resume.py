@@ -0,0 +1,66 @@
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+import PerfTraceParser
+from tests.support import copy_log, parse, state
+
+def parse_stopped(monkeypatch, logfile, lines, **kwargs):
+    # Ctrl-C part way through the log
+    parse_line = PerfTraceParser.PerfTracerParser.parse_line
+    def interrupted(parser, line, line_no):
+        parse_line(parser, line, line_no)
+        if parser.lines == lines:
+            parser.interrupt(signal.SIGINT, None)
+    with monkeypatch.context() as patch:
+        patch.setattr(PerfTraceParser.PerfTracerParser, 'parse_line', interrupted)
+        return parse(logfile, **kwargs)
+
+def test_resume(tmp_path, monkeypatch):
+    logfile = copy_log('strace.log', tmp_path)
+    stopped = parse_stopped(monkeypatch, logfile, 250, use_cache=True, checkpoint=3600)
+    assert stopped.lines == 250
+    assert 'Saved a checkpoint' in stopped.printed
+    resumed = parse(logfile, use_cache=True, resume=True)
+    assert 'Resuming the parse from the checkpoint' in resumed.printed
+    assert state(resumed) == state(parse(logfile))
+
+def test_checkpoint_needs_resume(tmp_path, monkeypatch):
+    logfile = copy_log('strace.log', tmp_path)
+    parse_stopped(monkeypatch, logfile, 250, use_cache=True, checkpoint=3600)
+    # without --resume the checkpoint is left alone and the whole log parsed
+    parser = parse(logfile, use_cache=True)
+    assert '--resume carries on from it' in parser.printed
+    assert state(parser) == state(parse(logfile))
+    assert 'Loaded the parsed log' in parse(logfile, use_cache=True).printed
+
+def test_no_checkpoint_unless_asked(tmp_path, monkeypatch):
+    logfile = copy_log('strace.log', tmp_path)
+    stopped = parse_stopped(monkeypatch, logfile, 250, use_cache=True)
+    assert 'Saved a checkpoint' not in stopped.printed
+    assert not os.path.exists(stopped.cache_path())
+    assert 'There is no checkpoint' in parse(logfile, use_cache=True, resume=True).printed
+
+def test_checkpoints_taken(tmp_path, monkeypatch):
+    logfile = copy_log('strace.log', tmp_path)
+    saved = []
+    save_cache = PerfTraceParser.PerfTracerParser.save_cache
+    def counted(parser, checkpoint=False):
+        saved.append((checkpoint, parser.lines))
+        save_cache(parser, checkpoint)
+    monkeypatch.setattr(PerfTraceParser.PerfTracerParser, 'save_cache', counted)
+    parser = parse(logfile, use_cache=True, checkpoint=1e-9)
+    # taken when the open handles are sampled, then the finished cache
+    assert len(saved) >= 2 and all(checkpoint for checkpoint, lines in saved[:-1])
+    assert saved[-1] == (False, parser.lines)
+
+@pytest.mark.parametrize('args, error', [(['--checkpoint', '0'], 'more than 0 seconds'),
+                                         (['--checkpoint', '--no-cache'], 'can\'t be used with --no-cache')])
+def test_checkpoint_arguments(tmp_path, args, error):
+    logfile = copy_log('strace.log', tmp_path)
+    run = subprocess.run([sys.executable, PerfTraceParser.__file__, logfile, '-o', os.devnull] + args,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert run.returncode == 2 and error in run.stdout
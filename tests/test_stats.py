@@ -0,0 +1,80 @@
+import math
+import random
+
+import pytest
+
+import PerfTraceParser
+
+def durations(count, seed):
+    # call times from microseconds to seconds, with some calls too quick for -T to time
+    rng = random.Random(seed)
+    return [0.0 if rng.random() < 0.02 else rng.lognormvariate(-8, 2) for _ in range(count)]
+
+def exact_percentile(values, percent):
+    # nearest rank, as LatencyStats counts them
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * percent / 100.0) - 1)]
+
+def latency(values):
+    stats = PerfTraceParser.LatencyStats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_percentile_error(seed):
+    values = durations(20000, seed)
+    stats = latency(values)
+    assert stats.count == len(values) and stats.max == max(values)
+    assert stats.total == pytest.approx(sum(values))
+    # the upper edge of a bucket 1/16 of its power of two wide, never under the real value
+    for percent in [1, 50, 90, 95, 99, 99.9, 100]:
+        exact = exact_percentile(values, percent)
+        assert exact <= stats.percentile(percent) <= exact * (1 + 1.0 / PerfTraceParser.LatencyStats.sub_buckets)
+    assert stats.percentile(100) == stats.max
+
+def test_untimed_calls():
+    stats = latency([0.0, 0.0, 0.0, 0.5])
+    assert stats.percentile(50) == 0.0 and stats.percentile(75) == 0.0
+    assert stats.percentile(100) == 0.5
+    assert PerfTraceParser.LatencyStats().percentile(99) == 0.0
+
+def test_merge_matches_serial():
+    # the shards of a -j run each fill their own and they are merged in order
+    values = durations(10000, 4)
+    serial = latency(values)
+    merged = PerfTraceParser.LatencyStats()
+    for start in range(0, len(values), 3000):
+        merged.merge(latency(values[start:start + 3000]))
+    assert merged.buckets == serial.buckets
+    assert (merged.count, merged.max) == (serial.count, serial.max)
+    assert merged.total == pytest.approx(serial.total)
+    assert [merged.percentile(k) for k in [50, 95, 99]] == [serial.percentile(k) for k in [50, 95, 99]]
+
+def test_byte_buckets():
+    # bucket n holds the transfers of 2**(n-1) to 2**n-1 bytes, 0 bytes (end of file) in bucket 0
+    stats = PerfTraceParser.ByteStats()
+    for size, is_write in [(0, False), (1, False), (2, True), (3, False), (4, False), (7, True), (4095, False), (4096, True)]:
+        stats.add(size, is_write, 0.001)
+    assert list(stats.buckets) == [1, 1, 2, 2, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1]
+    assert (stats.reads, stats.writes, stats.read_bytes, stats.write_bytes) == (5, 3, 4103, 4105)
+    assert stats.calls() == 8 and stats.total() == 8208 and stats.mean() == 1026.0
+    assert stats.seconds == pytest.approx(0.008) and stats.throughput() == pytest.approx(8208 / 0.008)
+    # a merge adds up buckets of different lengths either way round
+    small = PerfTraceParser.ByteStats()
+    small.add(5, False, None)
+    small.merge(stats)
+    stats.merge(small)
+    assert list(small.buckets) == [1, 1, 2, 3, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1]
+    assert list(stats.buckets) == [2, 2, 4, 5, 0, 0, 0, 0, 0, 0, 0, 0, 2, 2]
+    assert stats.reads == 11 and stats.read_bytes == 8211
+
+def test_transfer_sizes_report():
+    parser = PerfTraceParser.PerfTracerParser('-', shard=True)
+    for size in [0, 1, 3, 3, 4096]:
+        parser.transfers.add(size, False, None)
+    records = [record for record in parser.report_records() if record['table'] == 'transfer_sizes']
+    assert records == [{'table': 'transfer_sizes', 'key': 0, 'up_to': 0, 'count': 1},
+                       {'table': 'transfer_sizes', 'key': 1, 'up_to': 1, 'count': 1},
+                       {'table': 'transfer_sizes', 'key': 2, 'up_to': 3, 'count': 2},
+                       {'table': 'transfer_sizes', 'key': 4096, 'up_to': 8191, 'count': 1}]
@@ -0,0 +1,85 @@
+import io
+
+import pytest
+
+import PerfTraceParser
+
+class Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+@pytest.fixture
+def answers(monkeypatch):
+    # what is typed at each "-- N lines, Enter for the next page" prompt, and the prompts
+    typed = []
+    prompts = []
+    def answer(prompt):
+        prompts.append(prompt)
+        return typed.pop(0)
+    monkeypatch.setattr('builtins.input', answer)
+    monkeypatch.setattr('sys.stdin', Terminal())
+    return typed, prompts
+
+columns = [('name', '<6'), ('calls', '>5'), ('seconds', '>9.3f'), ('note', '')]
+rows = [('read', 10, 0.5, 'a'), ('write', 6, 12.25, 'bb'), ('openat', 2, 0.0, '')]
+
+def test_column_widths():
+    out = io.StringIO()
+    table = PerfTraceParser.TableRenderer(columns, out=out)
+    table.write_header(underline=True)
+    table.write_rows(rows)
+    # the titles only take the width and alignment, the last column isn't padded
+    assert out.getvalue().splitlines() == ['name    calls    seconds  note',
+                                           '------------------------------',
+                                           'read       10      0.500  a',
+                                           'write       6     12.250  bb',
+                                           'openat      2      0.000  ']
+    out = io.StringIO()
+    PerfTraceParser.TableRenderer([('a', '<3'), ('b', '>3')], '|', out).write_rows([('x', 1)])
+    assert out.getvalue() == 'x  |  1\n'
+
+def test_paging(monkeypatch, answers):
+    typed, prompts = answers
+    monkeypatch.setattr(PerfTraceParser, 'page_rows', 3)
+    out = Terminal()
+    table = PerfTraceParser.TableRenderer([('n', '>3')], out=out)
+    typed.extend(['', 'q'])
+    # Enter shows the next page, Q stops it and the rest isn't written
+    assert table.write_rows((k,) for k in range(10)) is False
+    assert out.getvalue().split() == ['0', '1', '2', '3', '4', '5']
+    assert prompts == ['-- 3 lines, Enter for the next page, Q to stop --', '-- 6 lines, Enter for the next page, Q to stop --']
+    assert table.write_rows([(10,)]) is False and out.getvalue().split()[-1] == '5'
+
+@pytest.mark.parametrize('pages, terminal', [(3, False), (0, True)])
+def test_no_paging(monkeypatch, answers, pages, terminal):
+    # not a terminal, or --page 0
+    monkeypatch.setattr(PerfTraceParser, 'page_rows', pages)
+    out = Terminal() if terminal else io.StringIO()
+    assert PerfTraceParser.TableRenderer([('n', '>3')], out=out).write_rows((k,) for k in range(10)) is True
+    assert out.getvalue().split() == [str(k) for k in range(10)]
+    assert answers[1] == []
+
+def coloured(out):
+    # read 10 is the largest of its column and write 6 is near it
+    PerfTraceParser.TableRenderer(columns, out=out, highlights=[(1, 10)], print_format=PerfTraceParser.PrintFormat()).write_rows(rows)
+    return out.getvalue()
+
+def test_colour(monkeypatch):
+    monkeypatch.delenv('NO_COLOR', raising=False)
+    lines = coloured(Terminal()).splitlines()
+    assert lines[0] == 'read    \x1b[5;30;41m   10\x1b[0m      0.500  a'
+    assert lines[1] == 'write   \x1b[5;30;43m    6\x1b[0m     12.250  bb'
+    assert lines[2] == 'openat      2      0.000  '
+    # --colour always colours a file too
+    monkeypatch.setattr(PerfTraceParser, 'colour_output', True)
+    assert '\x1b[' in coloured(io.StringIO())
+
+def test_no_colour(monkeypatch):
+    plain = 'read       10      0.500  a\n'
+    monkeypatch.delenv('NO_COLOR', raising=False)
+    assert coloured(io.StringIO()).startswith(plain)
+    monkeypatch.setenv('NO_COLOR', '1')
+    assert coloured(Terminal()).startswith(plain)
+    monkeypatch.delenv('NO_COLOR')
+    monkeypatch.setattr(PerfTraceParser, 'colour_output', False)
+    assert coloured(Terminal()).startswith(plain)
@@ -0,0 +1,26 @@
+import pytest
+
+from tests.support import log_path, parse, state
+
+def lines_between(tmp_path, from_time, to_time):
+    # the same lines picked out by hand
+    with open(log_path('strace.log'), 'rb') as fp:
+        lines = fp.readlines()
+    start = float(lines[0].split()[1])
+    path = tmp_path / 'range.log'
+    with open(str(path), 'wb') as fp:
+        fp.writelines(k for k in lines if (from_time is None or float(k.split()[1]) >= start + from_time) and
+                      (to_time is None or float(k.split()[1]) <= start + to_time))
+    return str(path)
+
+@pytest.mark.parametrize('from_time, to_time', [(0.02, 0.04), (None, 0.01), (0.05, None)])
+def test_time_range(tmp_path, from_time, to_time):
+    time_range = ('+{0}'.format(from_time) if from_time is not None else None, '+{0}'.format(to_time) if to_time is not None else None)
+    parser = parse(log_path('strace.log'), time_range=time_range)
+    expected = parse(lines_between(tmp_path, from_time, to_time))
+    assert parser.lines == expected.lines
+    assert state(parser) == state(expected)
+
+def test_time_range_not_cached(tmp_path):
+    parser = parse(log_path('strace.log'), use_cache=True, time_range=('+0.02', None))
+    assert not parser.use_cache
@@ -0,0 +1,80 @@
+import random
+
+import PerfTraceParser
+from tests.support import log_path, parse
+
+def zipf_keys(count, seed):
+    # a few keys most of the time and a long tail seen once or twice
+    rng = random.Random(seed)
+    return ['/k{0}'.format(int(rng.paretovariate(1.1))) for _ in range(count)]
+
+def exact_counts(keys):
+    counts = dict()
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def check_bounds(top, exact):
+    # never too low, and too high by no more than the error kept for it
+    for key, count in top.counts.items():
+        assert exact[key] <= count <= exact[key] + top.errors[key]
+    assert top.max_error() == max(top.errors.values())
+
+def test_error_bound():
+    keys = zipf_keys(20000, 1)
+    exact = exact_counts(keys)
+    top = PerfTraceParser.TopCounts(50)
+    for key in keys:
+        top.add(key, 1)
+    assert len(top) == 50 and top.total == len(keys)
+    check_bounds(top, exact)
+    busiest = sorted(exact, key=exact.get, reverse=True)[:10]
+    assert top.keys()[:10] == busiest
+    assert [top[key] for key in busiest] == [exact[key] for key in busiest]
+
+def test_merge_matches_serial():
+    # each -j shard counts its own part, the sketches add up to the one a serial run builds
+    keys = zipf_keys(30000, 2)
+    exact = exact_counts(keys)
+    serial = PerfTraceParser.TopCounts(40)
+    for key in keys:
+        serial.add(key, 1)
+    merged = PerfTraceParser.TopCounts(40)
+    for start in range(0, len(keys), 10000):
+        shard = PerfTraceParser.TopCounts(40)
+        for key in keys[start:start + 10000]:
+            shard.add(key, 1)
+        merged.merge(shard)
+    assert merged.sketch == serial.sketch
+    assert merged.total == serial.total == len(keys)
+    check_bounds(merged, exact)
+    assert merged.keys()[:10] == serial.keys()[:10]
+
+def test_eviction_order():
+    top = PerfTraceParser.TopCounts(3)
+    top.add('a', 5)
+    top.add('b', 3)
+    top.add('c', 1)
+    # the smallest is taken over
+    top.add('d', 1)
+    assert top.counts == {'a': 5, 'b': 3, 'd': 1} and top.errors == {'a': 0, 'b': 0, 'd': 0}
+    # c comes back with what the sketch saw of it, taking over d
+    top.add('c', 3)
+    assert top.counts == {'a': 5, 'b': 3, 'c': 4} and top.errors['c'] == 1
+    # b grew past c, so the stale heap entry of b doesn't make it the next to go
+    top.add('b', 10)
+    top.add('e', 4)
+    assert top.counts == {'a': 5, 'b': 13, 'e': 4} and top.errors['e'] == 0
+    # smaller than anything kept, it isn't
+    top.add('f', 1)
+    assert 'f' not in top and top.keys() == ['b', 'a', 'e']
+
+def test_parse_with_top_k():
+    exact = parse(log_path('strace.log'))
+    top = parse(log_path('strace.log'), top_k=5)
+    for name in ['syscall_files', 'syscall_errors', 'syscall_memaddresses']:
+        counts = getattr(top, name)
+        assert counts.__class__ is PerfTraceParser.TopCounts and len(counts) <= 5
+        check_bounds(counts, getattr(exact, name))
+    # the per file table keeps every path
+    assert len(top.associated_file_instances) == len(exact.associated_file_instances)